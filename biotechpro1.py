@@ -7,38 +7,121 @@ HOW TO RUN:
 4. Open browser: http://localhost:5000
 """
 
+import asyncio
+import csv
+import hashlib
 import json
 import uuid
 import itertools
 import os
-from contextlib import asynccontextmanager
+import random
+import re
+import secrets
+import tempfile
+import zlib
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar, copy_context
+from functools import lru_cache, wraps
+from types import SimpleNamespace
 from datetime import datetime, timedelta
 from enum import Enum
 from typing import Optional, List
 
-from groq import Groq
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, Query, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse
+from fastapi import Request, WebSocket, WebSocketDisconnect
+from fastapi.websockets import WebSocketState
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import HTMLResponse, FileResponse, PlainTextResponse, StreamingResponse, JSONResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from jose import jwt
-from passlib.context import CryptContext
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, Field, ValidationError
 from sqlalchemy import (Column, Integer, String, Float, Boolean,
-    DateTime, ForeignKey, Text, JSON, Enum as SAEnum, create_engine, func)
+    DateTime, ForeignKey, Text, JSON, LargeBinary, Index, Enum as SAEnum, bindparam, create_engine, event, func, inspect,
+    insert, null, or_, select, text)
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import declarative_base, sessionmaker, Session, relationship
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
 # ── CONFIGURATION ──────────────────────────────────────────────────────────────
-DATABASE_URL             = "sqlite:///./biotech.db"
+DATABASE_URL             = os.getenv("DATABASE_URL", "sqlite:///./biotech.db")
 GROQ_API_KEY             = ""   # PUT YOUR KEY HERE
 api_key = os.getenv("GROQ_API_KEY")
 LLM_MODEL = "llama-3.3-70b-versatile"
+LLM_FAST_MODEL           = "llama-3.1-8b-instant"
 SECRET_KEY               = "biomind-secret-key-change-in-production"
 ALGORITHM                = "HS256"
 ACCESS_TOKEN_EXPIRE_MINS = 1440
+ADMIN_EMAILS             = {e.strip().lower() for e in os.getenv("BIOMIND_ADMIN_EMAILS", "").split(",") if e.strip()}
 WEAK_THRESHOLD           = 0.60
 STRONG_THRESHOLD         = 0.80
-_qid_counter             = itertools.count(start=1)
+COHORT_DIR               = os.getenv("BIOMIND_COHORT_DIR", "./cohort_reports")
+COHORT_CHUNK             = 5000
+HISTORY_PAGE_MAX         = 200
+EXPORT_CHUNK             = 500
+JOB_WORKERS              = int(os.getenv("BIOMIND_JOB_WORKERS", "4"))
+JOB_MAX_ATTEMPTS         = 5
+JOB_BACKOFF_SECS         = 2.0
+JOB_POLL_SECS            = 1.0
+JOB_RETENTION_HOURS      = 24
+PENDING_QUESTION_HOURS   = 24
+QUESTION_BANK_DEPTH      = 3
+QUESTION_BANK_KEYS       = 200
+QUESTION_BANK_REFILL     = 60     # seconds; at most one queued refill per bank in this window
+TRACE_FILE               = os.getenv("BIOMIND_TRACE_FILE", "./traces.jsonl")
+TRACE_OTLP_ENDPOINT      = os.getenv("BIOMIND_OTLP_ENDPOINT")   # e.g. http://localhost:4318/v1/traces
+TRACE_SAMPLE_RATE        = float(os.getenv("BIOMIND_TRACE_SAMPLE", "0.1"))
+TRACE_SLOW_MS            = 1000   # slower requests are always kept
+TRACE_RECENT             = 200
+EMBED_DIM                = 4096
+SEMANTIC_THRESHOLD       = 0.85   # cosine similarity for a cache hit
+SEMANTIC_SCOPE_CAPACITY  = 500    # cached answers per (topic, difficulty)
+CONTEXT_TOKEN_BUDGET     = 1500   # tutor history sent with a follow-up
+TUTOR_VERBATIM_TURNS     = 6      # most recent messages kept word for word
+TURN_TOKEN_CAP           = 400    # per verbatim message
+SUMMARY_TOKEN_CAP        = 300
+QUIZ_SESSION_MAX         = 20
+QUIZ_SESSION_CHUNK       = 5      # questions per completion; chunks run in parallel
+QUIZ_TOKENS_PER_QUESTION = 260
+LLM_FANOUT_WORKERS       = 8
+BKT_DEFAULTS             = {"p_init": 0.3, "p_learn": 0.15, "p_slip": 0.1, "p_guess": 0.2}
+BKT_INTERMEDIATE         = 0.70   # p_known needed to practise at intermediate
+BKT_ADVANCED             = 0.95   # ... and at advanced
+BKT_HYSTERESIS           = 0.05   # a level is only lost this far below its boundary
+BKT_MIN_OBS              = 50     # answers a topic needs before its parameters are refit
+BKT_MAX_STEPS            = 200    # most recent answers per (user, topic) used when refitting
+BKT_PARAMS_TTL           = 300
+REVIEW_EASE_INIT         = 2.5
+REVIEW_EASE_MIN          = 1.3
+REVIEW_RELEARN_MINUTES   = 10     # a missed topic comes back this soon
+REVIEW_TICK_SECS         = 30
+CAREER_REGEN_DISTANCE    = float(os.getenv("BIOMIND_CAREER_REGEN_DISTANCE", "15.0"))  # L2 points on the 0-100 skill profile
+SERVER_HOST              = os.getenv("BIOMIND_HOST", "0.0.0.0")
+SERVER_PORT              = int(os.getenv("BIOMIND_PORT", "5000"))
+WEB_WORKERS              = int(os.getenv("BIOMIND_WORKERS", "0"))          # 0 = one per core
+DRAIN_SECS               = float(os.getenv("BIOMIND_DRAIN_SECS", "30"))    # after SIGTERM, in-flight requests (LLM calls) get this long
+LLM_STUB_MS              = os.getenv("BIOMIND_LLM_STUB_MS")                # set to answer from a local stub with this latency
+ADMISSION_FILE           = os.getenv("BIOMIND_ADMISSION_FILE", "./admission.json")   # edited limits apply within a second
+ADMISSION_DEFAULTS       = {"global": 32,         # LLM-backed requests running at once (per worker)
+                            "per_user": 2,        # ... of which one user may hold
+                            "queue": 64,          # requests waiting for a slot; beyond this -> 503
+                            "user_queue": 4,      # waiting requests per user; beyond this -> 429
+                            "queue_timeout": 15.0}
+JSON_BACKEND             = os.getenv("BIOMIND_JSON", "orjson")   # "stdlib" forces the fallback
+LLM_HEDGE_WORKERS        = 64
+IMPORT_BUDGET_MS         = float(os.getenv("BIOMIND_IMPORT_BUDGET_MS", "900"))   # median cold `import biotechpro1`
+ARCHIVE_AFTER_DAYS       = float(os.getenv("BIOMIND_ARCHIVE_DAYS", "90"))  # quiz/lab payloads older than this move to archived_blobs
+ROSTER_MAX_ROWS          = 1000
+ROSTER_HASHES_PER_HOUR   = int(os.getenv("BIOMIND_ROSTER_HASHES_PER_HOUR", "2000"))   # per caller, per worker
+HASH_WORKERS             = int(os.getenv("BIOMIND_HASH_WORKERS", "0"))     # bcrypt processes for roster imports; 0 = one per core
 
 INDUSTRY_BENCHMARKS = {
     "researcher":          {"PCR": 85, "CRISPR": 80, "Data Analysis": 75, "Scientific Writing": 80, "Bioinformatics": 70},
@@ -49,6 +132,30 @@ INDUSTRY_BENCHMARKS = {
     "regulatory_affairs":  {"Regulatory": 90, "GMP": 85, "Documentation": 85, "Pharmacology": 75, "Risk Assessment": 80},
 }
 
+# USD per million tokens (prompt, completion); keep in line with the provider's price list
+LLM_PRICES = {
+    "llama-3.3-70b-versatile": (0.59, 0.79),
+    "llama-3.1-8b-instant":    (0.05, 0.08),
+}
+
+# Per prompt type: primary model, hedge/fallback model (None = no hedge), default token
+# budget, latency SLO in seconds before the hedge is sent (streams: time to first token)
+LLM_ROUTE_DEFAULT = {"model": LLM_MODEL, "fallback": LLM_FAST_MODEL, "max_tokens": 1024, "slo": 10.0, "temperature": 0.7}
+LLM_ROUTES = {
+    "llm_lesson":       {"max_tokens": 1024, "slo": 6.0},
+    "llm_answer":       {"max_tokens": 600,  "slo": 5.0},
+    "llm_summarize":    {"model": LLM_FAST_MODEL, "fallback": None, "max_tokens": SUMMARY_TOKEN_CAP, "slo": None, "temperature": 0.3},
+    "llm_quiz_set":     {"max_tokens": 1400, "slo": 8.0},
+    "llm_quiz":         {"max_tokens": 400,  "slo": 4.0},
+    "llm_explain":      {"max_tokens": 250,  "slo": 3.0, "temperature": 0.5},
+    "llm_followup":     {"model": LLM_FAST_MODEL, "fallback": None, "max_tokens": 120, "slo": None},
+    "llm_start_lab":    {"max_tokens": 400,  "slo": 3.0},
+    "llm_lab_decision": {"max_tokens": 500,  "slo": 3.0},
+    "llm_career":       {"max_tokens": 1024, "slo": 12.0, "temperature": 0.5},
+    "llm_tips":         {"model": LLM_FAST_MODEL, "fallback": None, "max_tokens": 200, "slo": None},
+    "llm_path":         {"max_tokens": 1024, "slo": 12.0, "temperature": 0.5},
+}
+
 # ── FRONTEND HTML (Pure Vanilla JS - No Babel, No CDN, Instant Load) ──────────
 FRONTEND_HTML = r"""<!DOCTYPE html>
 <html lang="en">
@@ -279,6 +386,86 @@ async function apiForm(path, fields) {
 function spinner() { return '<div class="spinner-wrap"><div class="spinner"></div><span>Please wait...</span></div>'; }
 function topicOpts() { return TOPICS.map(function(t){ return '<option>' + t + '</option>'; }).join(''); }
 
+// ── CLIENT CACHE ───────────────────────────────────────────────────────────────
+// Stale-while-revalidate: a cached response is drawn at once. When it is older than
+// SWR_FRESH_MS, or marked stale by activity that changes it, it is fetched again in
+// the background and redrawn; concurrent loads of one key share a request.
+var SWR = {};
+var SWR_FRESH_MS = 60000;
+
+function swr(key, load, draw, force) {
+  var e = SWR[key] || (SWR[key] = {data:null, at:0, pending:null});
+  if (e.data !== null) {
+    draw(e.data);
+    if (!force && Date.now() - e.at < SWR_FRESH_MS) return Promise.resolve(e.data);
+  }
+  if (!e.pending) {
+    // a response the server flags as stale (e.g. a path still being regenerated) is kept but not fresh
+    e.pending = load().then(function(data){ e.data = data; e.at = data && data.stale ? 0 : Date.now(); return data; })
+                      .finally(function(){ e.pending = null; });
+  }
+  return e.pending.then(function(data){ draw(data); return data; });
+}
+
+function swrCached(key) { return SWR[key] && SWR[key].data !== null; }
+function swrStale() { Object.keys(SWR).forEach(function(k){ SWR[k].at = 0; }); }
+
+// ── VIRTUAL LIST ───────────────────────────────────────────────────────────────
+// Keeps only the rows near the viewport of a scrolling element in the DOM. Rows
+// outside it are stood in for by two spacers sized from measured row heights
+// (est until a row has been shown once). items is the caller's array.
+function vlist(el, items, renderRow, est) {
+  var v = {el:el, items:items, render:renderRow, est:est, heights:[], nodes:{}, raf:0,
+           gap:parseFloat(getComputedStyle(el).rowGap) || 0,
+           top:document.createElement('div'), bottom:document.createElement('div')};
+  el.appendChild(v.top);
+  el.appendChild(v.bottom);
+  el.addEventListener('scroll', function() {
+    if (!v.raf) v.raf = requestAnimationFrame(function(){ v.raf = 0; vlistSync(v); });
+  });
+  return v;
+}
+
+function vlistSync(v) {
+  var el = v.el, n = v.items.length, view = el.clientHeight || 400;
+  var lo = el.scrollTop - view, hi = el.scrollTop + 2*view;
+  var y = 0, first = n, last = -1, i, h;
+  for (i = 0; i < n; i++) {
+    h = v.heights[i] || v.est;
+    if (y + h > lo && y < hi) { if (first === n) first = i; last = i; }
+    y += h;
+  }
+  Object.keys(v.nodes).forEach(function(k) {
+    if (+k < first || +k > last) { v.nodes[k].remove(); delete v.nodes[k]; }
+  });
+  var next = v.bottom;
+  for (i = last; i >= first; i--) {
+    if (!v.nodes[i]) { v.nodes[i] = v.render(v.items[i]); el.insertBefore(v.nodes[i], next); }
+    next = v.nodes[i];
+  }
+  var above = 0, below = 0;
+  for (i = 0; i < n; i++) {
+    if (i >= first && i <= last) v.heights[i] = v.nodes[i].offsetHeight + v.gap;
+    else if (i < first) above += v.heights[i] || v.est;
+    else below += v.heights[i] || v.est;
+  }
+  vlistSpacer(v, v.top, above);
+  vlistSpacer(v, v.bottom, below);
+}
+
+function vlistSpacer(v, sp, h) {
+  sp.style.display = h ? '' : 'none';
+  sp.style.height = Math.max(h - v.gap, 0) + 'px';
+}
+
+// Call after items change; follows the end of the list when asked or already there
+function vlistRefresh(v, toBottom) {
+  var el = v.el;
+  var atBottom = toBottom || el.scrollTop + el.clientHeight >= el.scrollHeight - 8;
+  vlistSync(v);
+  if (atBottom) { el.scrollTop = el.scrollHeight; vlistSync(v); el.scrollTop = el.scrollHeight; }
+}
+
 // ── AUTH ───────────────────────────────────────────────────────────────────────
 function toggleAuth() {
   IS_LOGIN = !IS_LOGIN;
@@ -327,7 +514,8 @@ async function authSubmit() {
 }
 
 function logout() {
-  TOKEN = ''; USER = null;
+  if (labWS) labWS.sock.close();
+  TOKEN = ''; USER = null; SWR = {};
   localStorage.removeItem('bm_token');
   localStorage.removeItem('bm_user');
   document.getElementById('auth-page').classList.remove('hidden');
@@ -359,6 +547,7 @@ function navTo(page) {
 
 // ── LEARN ──────────────────────────────────────────────────────────────────────
 var learnMsgs = [];
+var chatList = null;
 
 function renderLearn(c) {
   learnMsgs = [{role:'ai', text:'Hello ' + USER.name + '! I am your AI Biotech Tutor. Select a topic and click Generate Lesson!'}];
@@ -393,26 +582,45 @@ function renderLearn(c) {
   });
 
   drawMsgs();
+  api('GET', '/learn/conversation?limit=20').then(function(hist) {
+    if (!hist.length || learnMsgs.length > 1) return;
+    hist.forEach(function(m){ learnMsgs.push({role: m.role === 'user' ? 'user' : 'ai', text: m.content}); });
+    drawMsgs();
+  }).catch(function(){});
+}
+
+function msgRow(m) {
+  var row = document.createElement('div');
+  row.className = 'msg ' + m.role;
+  var av = document.createElement('div');
+  av.className = 'avatar';
+  av.textContent = m.role === 'ai' ? 'AI' : 'ME';
+  var bub = document.createElement('div');
+  bub.className = 'bubble';
+  bub.textContent = m.text;
+  row.appendChild(av);
+  row.appendChild(bub);
+  return row;
 }
 
+// Full redraw, when the tab opens or history arrives; new messages go through pushMsg
 function drawMsgs() {
   var wrap = document.getElementById('chat-wrap');
   if (!wrap) return;
-  wrap.innerHTML = '';
-  learnMsgs.forEach(function(m) {
-    var row = document.createElement('div');
-    row.className = 'msg ' + m.role;
-    var av = document.createElement('div');
-    av.className = 'avatar';
-    av.textContent = m.role === 'ai' ? 'AI' : 'ME';
-    var bub = document.createElement('div');
-    bub.className = 'bubble';
-    bub.textContent = m.text;
-    row.appendChild(av);
-    row.appendChild(bub);
-    wrap.appendChild(row);
-  });
-  wrap.scrollTop = wrap.scrollHeight;
+  // One list (and one scroll listener) per chat element; later redraws just swap the items
+  if (!chatList || chatList.el !== wrap) {
+    wrap.innerHTML = '';
+    chatList = vlist(wrap, learnMsgs, msgRow, 60);
+  }
+  chatList.items = learnMsgs;
+  vlistRefresh(chatList, true);
+}
+
+function pushMsg(role, text) {
+  learnMsgs.push({role:role, text:text});
+  var typing = document.getElementById('typing-row');
+  if (typing) typing.remove();
+  if (chatList && chatList.items === learnMsgs && document.body.contains(chatList.el)) vlistRefresh(chatList, true);
 }
 
 function showTyping() {
@@ -444,8 +652,7 @@ async function learnSend(text) {
   var btn   = document.getElementById('chat-send');
   if (btn) btn.disabled = true;
 
-  learnMsgs.push({role:'user', text: isLesson ? 'Generate lesson: ' + topic + ' (' + diff + ')' : msg});
-  drawMsgs();
+  pushMsg('user', isLesson ? 'Generate lesson: ' + topic + ' (' + diff + ')' : msg);
   showTyping();
 
   try {
@@ -453,19 +660,19 @@ async function learnSend(text) {
     var txt = isLesson
       ? 'LESSON: ' + data.topic + '\n\n' + data.content + '\n\nSUMMARY:\n' + data.summary + '\n\nREAL WORLD EXAMPLE:\n' + data.real_example
       : data.content;
-    learnMsgs.push({role:'ai', text:txt});
+    swrStale();
+    pushMsg('ai', txt);
   } catch(e) {
-    learnMsgs.push({role:'ai', text:'Error: ' + e.message});
+    pushMsg('ai', 'Error: ' + e.message);
   }
-  drawMsgs();
   if (btn) btn.disabled = false;
 }
 
 // ── QUIZ ───────────────────────────────────────────────────────────────────────
-var quizState = {q:null, sel:null, score:{c:0, t:0}};
+var quizState = {q:null, sel:null, score:{c:0, t:0}, queue:[]};
 
 function renderQuiz(c) {
-  quizState = {q:null, sel:null, score:{c:0, t:0}};
+  quizState = {q:null, sel:null, score:{c:0, t:0}, queue:[]};
   c.innerHTML = '<div class="card">'
     + '<div class="card-title">QUIZ AND ASSESSMENT ENGINE</div>'
     + '<div class="card-sub">LLM-generated questions targeting your weak areas.</div>'
@@ -473,6 +680,7 @@ function renderQuiz(c) {
     + '<select class="select" id="quiz-topic">' + topicOpts() + '</select>'
     + '<select class="select" id="quiz-type"><option value="mcq">MCQ</option><option value="short">Short Answer</option><option value="scenario">Scenario</option></select>'
     + '<button class="btn btn-primary" onclick="quizGen()">Generate Question</button>'
+    + '<button class="btn btn-outline" onclick="quizSession()">Practice Set (10)</button>'
     + '</div>'
     + '<div class="score-row">'
     + '<div class="score-pill"><div class="score-label">SESSION SCORE</div><div class="score-val" id="quiz-score" style="color:var(--accent2)">0/0</div></div>'
@@ -481,8 +689,22 @@ function renderQuiz(c) {
     + '<div id="quiz-area"></div></div>';
 }
 
+async function quizSession() {
+  var area  = document.getElementById('quiz-area');
+  var topic = document.getElementById('quiz-topic').value;
+  area.innerHTML = spinner();
+  try {
+    var s = await api('POST', '/quiz/session', {topic:topic, count:10, difficulty:USER.level});
+    quizState.queue = s.questions;
+    quizGen();
+  } catch(e) {
+    area.innerHTML = '<div class="error-box">' + e.message + '</div>';
+  }
+}
+
 async function quizGen() {
   quizState.q = null; quizState.sel = null;
+  if (quizState.queue.length) { quizState.q = quizState.queue.shift(); drawQuizQ(quizState.q); return; }
   var area  = document.getElementById('quiz-area');
   var topic = document.getElementById('quiz-topic').value;
   var qtype = document.getElementById('quiz-type').value;
@@ -524,6 +746,7 @@ async function quizSubmit(idx) {
   fbEl.innerHTML = spinner();
   try {
     var data = await api('POST', '/quiz/submit', {question_id: quizState.q.question_id, student_answer: String(idx)});
+    swrStale();
     var ci = parseInt(data.correct_answer);
     if (!isNaN(ci)) {
       var cEl = document.getElementById('opt-' + ci);
@@ -554,6 +777,7 @@ async function quizSubmitShort() {
   fbEl.innerHTML = spinner();
   try {
     var data = await api('POST', '/quiz/submit', {question_id: quizState.q.question_id, student_answer: ans});
+    swrStale();
     quizState.score.t++;
     if (data.is_correct) quizState.score.c++;
     document.getElementById('quiz-score').textContent = quizState.score.c + '/' + quizState.score.t;
@@ -569,6 +793,55 @@ async function quizSubmitShort() {
 
 // ── LAB ────────────────────────────────────────────────────────────────────────
 var labState = {session:null, log:[], done:false, type:'pcr'};
+var labWS = null;
+var labLogList = null;
+
+// One authenticated socket for the whole lab run; /lab/start and /lab/decide are the fallback
+function labSocket() {
+  if (labWS) return labWS.ready;
+  if (!window.WebSocket) return Promise.reject(new Error('WebSocket unavailable'));
+  var sock = new WebSocket((location.protocol === 'https:' ? 'wss://' : 'ws://') + location.host + '/lab/ws');
+  var ws = labWS = {sock:sock, waiting:null, onDelta:null};
+  ws.ready = new Promise(function(resolve, reject) {
+    sock.onopen = function(){ sock.send(JSON.stringify({type:'auth', token:TOKEN})); };
+    sock.onmessage = function(ev) {
+      var m = JSON.parse(ev.data);
+      if (m.type === 'ready') return resolve(ws);
+      if (m.type === 'delta') { if (ws.onDelta) ws.onDelta(m.field, m.text); return; }
+      var w = ws.waiting; ws.waiting = null;
+      if (w) { if (m.type === 'error') w.reject(new Error(m.detail)); else w.resolve(m); }
+    };
+    sock.onclose = function() {
+      if (labWS === ws) labWS = null;
+      reject(new Error('Lab connection closed'));
+      if (ws.waiting) { ws.waiting.reject(new Error('Lab connection lost')); ws.waiting = null; }
+    };
+  });
+  return ws.ready;
+}
+
+async function labCall(msg, onDelta) {
+  var ws;
+  try { ws = await labSocket(); } catch(e) { return null; }
+  return new Promise(function(resolve, reject) {
+    ws.waiting = {resolve:resolve, reject:reject}; ws.onDelta = onDelta;
+    ws.sock.send(JSON.stringify(msg));
+  });
+}
+
+// Shows streamed result/scenario text while the step is still being generated
+function labStream(area) {
+  var boxes = {};
+  return function(field, text) {
+    if (!boxes[field]) {
+      if (!Object.keys(boxes).length) area.innerHTML = '';
+      boxes[field] = document.createElement('div');
+      boxes[field].className = 'lab-scene';
+      area.appendChild(boxes[field]);
+    }
+    boxes[field].textContent += text;
+  };
+}
 
 function renderLab(c) {
   labState = {session:null, log:[], done:false, type:'pcr'};
@@ -601,7 +874,8 @@ async function labStart() {
   area.innerHTML = spinner();
   document.getElementById('lab-log-wrap').innerHTML = '';
   try {
-    var data = await api('POST', '/lab/start', {lab_type: labState.type});
+    var data = await labCall({type:'start', lab_type:labState.type}, labStream(area))
+            || await api('POST', '/lab/start', {lab_type: labState.type});
     labState.session = data;
     drawLabStep(data);
   } catch(e) {
@@ -627,8 +901,11 @@ async function labDecide(el) {
   var area = document.getElementById('lab-area');
   area.innerHTML = spinner();
   try {
-    var data = await api('POST', '/lab/decide', {session_id: labState.session.session_id, choice: choice});
+    var body = {session_id: labState.session.session_id, choice: choice};
+    var data = await labCall(Object.assign({type:'decide'}, body), labStream(area))
+            || await api('POST', '/lab/decide', body);
     labState.log.push(data.result + (data.error ? ' | Mistake: ' + data.error : ''));
+    swrStale();
     if (data.completed) {
       labState.done = true;
       labState.log.push('Complete! Score: ' + (data.score != null ? data.score : 'N/A'));
@@ -645,17 +922,27 @@ async function labDecide(el) {
   }
 }
 
+function labLogRow(line) {
+  var row = document.createElement('div');
+  row.style.paddingBottom = '4px';
+  row.textContent = line;
+  return row;
+}
+
 function drawLabLog() {
   var wrap = document.getElementById('lab-log-wrap');
-  if (!labState.log.length) return;
-  wrap.innerHTML = '<div class="lab-log"><div style="color:var(--accent);font-size:10px;margin-bottom:8px">LAB LOG</div>'
-    + labState.log.map(function(l){ return '<div style="margin-bottom:4px">' + l + '</div>'; }).join('')
-    + '</div>';
-  var logEl = wrap.querySelector('.lab-log');
-  if (logEl) logEl.scrollTop = 9999;
+  if (!wrap || !labState.log.length) return;
+  if (!labLogList || !wrap.contains(labLogList.el)) {
+    wrap.innerHTML = '<div class="lab-log"><div style="color:var(--accent);font-size:10px;margin-bottom:8px">LAB LOG</div></div>';
+    labLogList = vlist(wrap.firstChild, labState.log, labLogRow, 24);
+  }
+  labLogList.items = labState.log;
+  vlistRefresh(labLogList, true);
 }
 
 // ── CAREER ─────────────────────────────────────────────────────────────────────
+var careerRole = null;
+
 function renderCareer(c) {
   var roleOpts = ROLES.map(function(r){ return '<option value="' + r.v + '">' + r.l + '</option>'; }).join('');
   c.innerHTML = '<div class="card">'
@@ -666,38 +953,48 @@ function renderCareer(c) {
     + '<button class="btn btn-primary" onclick="careerAnalyze()">Analyze</button>'
     + '</div>'
     + '<div id="career-area"></div></div>';
+  if (careerRole) {
+    document.getElementById('career-role').value = careerRole;
+    if (swrCached('career:' + careerRole)) careerAnalyze();
+  }
 }
 
-async function careerAnalyze() {
-  var role = document.getElementById('career-role').value;
+function careerAnalyze(force) {
+  var role = careerRole = document.getElementById('career-role').value;
   var area = document.getElementById('career-area');
-  area.innerHTML = spinner();
-  try {
-    var res = await api('POST', '/career/analyze', {target_role: role});
-    var sc  = res.readiness_score;
-    var col = sc >= 70 ? 'var(--accent2)' : sc >= 40 ? 'var(--accent3)' : 'var(--danger)';
-    var html = '<div class="flex gap10 wrap mb18">';
-    html += '<div class="readiness-wrap"><div class="readiness-num" style="color:' + col + '">' + sc.toFixed(0) + '%</div><div class="readiness-lbl">INDUSTRY READINESS</div></div>';
-    html += '<div class="flex1"><div style="font-size:11px;color:var(--muted);margin-bottom:10px">TOP SKILL GAPS</div>';
-    res.skill_gaps.slice(0,5).forEach(function(g) {
-      html += '<div class="barchart"><div class="bar-label"><span>' + g.skill + '</span><span style="color:var(--danger)">' + g.gap.toFixed(0) + ' pts gap</span></div>'
-            + '<div class="bar-bg"><div class="bar-fill" style="width:' + g.student_score + '%;background:var(--accent3)"></div></div></div>';
-    });
-    html += '</div></div><div class="divider"></div>';
-    html += '<div style="font-size:12px;color:var(--accent);font-weight:700;margin-bottom:14px">CAREER ROADMAP</div>';
-    res.roadmap.forEach(function(step, i) {
-      html += '<div class="road-step"><div class="road-dot"></div><div><div class="road-num">STEP ' + (i+1) + '</div><div class="road-text">' + step + '</div></div></div>';
-    });
-    html += '<div class="divider"></div><div class="flex gap10 wrap">';
-    html += '<div class="flex1"><div style="font-size:11px;color:var(--accent);margin-bottom:10px">MINI-PROJECTS</div>'
-          + res.mini_projects.map(function(p){ return '<div style="font-size:13px;margin-bottom:8px;padding-left:10px;border-left:2px solid var(--accent3);line-height:1.6">' + p + '</div>'; }).join('') + '</div>';
-    html += '<div class="flex1"><div style="font-size:11px;color:var(--accent);margin-bottom:10px">CERTIFICATIONS</div>'
-          + res.certifications.map(function(c){ return '<div style="font-size:13px;margin-bottom:8px;padding-left:10px;border-left:2px solid var(--accent2);line-height:1.6">' + c + '</div>'; }).join('') + '</div>';
-    html += '</div>';
-    area.innerHTML = html;
-  } catch(e) {
-    area.innerHTML = '<div class="error-box">' + e.message + '</div>';
-  }
+  if (!swrCached('career:' + role)) area.innerHTML = spinner();
+  swr('career:' + role, function(){ return api('POST', '/career/analyze', {target_role: role}); }, function(res) {
+    if (careerRole === role) drawCareer(res);
+  }, force).catch(function(e) {
+    if (!swrCached('career:' + role) && careerRole === role) area.innerHTML = '<div class="error-box">' + e.message + '</div>';
+  });
+}
+
+function drawCareer(res) {
+  var area = document.getElementById('career-area');
+  if (!area) return;
+  var sc  = res.readiness_score;
+  var col = sc >= 70 ? 'var(--accent2)' : sc >= 40 ? 'var(--accent3)' : 'var(--danger)';
+  var html = '<div class="flex gap10 wrap mb18">';
+  html += '<div class="readiness-wrap"><div class="readiness-num" style="color:' + col + '">' + sc.toFixed(0) + '%</div><div class="readiness-lbl">INDUSTRY READINESS</div></div>';
+  html += '<div class="flex1"><div style="font-size:11px;color:var(--muted);margin-bottom:10px">TOP SKILL GAPS</div>';
+  res.skill_gaps.slice(0,5).forEach(function(g) {
+    html += '<div class="barchart"><div class="bar-label"><span>' + g.skill + '</span><span style="color:var(--danger)">' + g.gap.toFixed(0) + ' pts gap</span></div>'
+          + '<div class="bar-bg"><div class="bar-fill" style="width:' + g.student_score + '%;background:var(--accent3)"></div></div></div>';
+  });
+  html += '</div></div><div class="divider"></div>';
+  html += '<div style="font-size:12px;color:var(--accent);font-weight:700;margin-bottom:14px">CAREER ROADMAP</div>';
+  if (res.stale) html += '<div style="font-size:11px;color:var(--muted);margin-bottom:10px">Could not refresh this plan just now; showing the last saved one.</div>';
+  res.roadmap.forEach(function(step, i) {
+    html += '<div class="road-step"><div class="road-dot"></div><div><div class="road-num">STEP ' + (i+1) + '</div><div class="road-text">' + step + '</div></div></div>';
+  });
+  html += '<div class="divider"></div><div class="flex gap10 wrap">';
+  html += '<div class="flex1"><div style="font-size:11px;color:var(--accent);margin-bottom:10px">MINI-PROJECTS</div>'
+        + res.mini_projects.map(function(p){ return '<div style="font-size:13px;margin-bottom:8px;padding-left:10px;border-left:2px solid var(--accent3);line-height:1.6">' + p + '</div>'; }).join('') + '</div>';
+  html += '<div class="flex1"><div style="font-size:11px;color:var(--accent);margin-bottom:10px">CERTIFICATIONS</div>'
+        + res.certifications.map(function(c){ return '<div style="font-size:13px;margin-bottom:8px;padding-left:10px;border-left:2px solid var(--accent2);line-height:1.6">' + c + '</div>'; }).join('') + '</div>';
+  html += '</div>';
+  area.innerHTML = html;
 }
 
 // ── ANALYTICS ──────────────────────────────────────────────────────────────────
@@ -706,7 +1003,7 @@ function renderAnalytics(c) {
     + '<div class="card-title">PERFORMANCE ANALYTICS</div>'
     + '<div class="card-sub">Real-time tracking of accuracy, XP, and topic mastery.</div>'
     + '<div id="analytics-area">' + spinner() + '</div>'
-    + '<button class="btn btn-outline btn-sm mt16" onclick="loadAnalytics()">Refresh</button>'
+    + '<button class="btn btn-outline btn-sm mt16" onclick="loadAnalytics(true)">Refresh</button>'
     + '</div>'
     + '<div class="card">'
     + '<div class="card-title">PERSONALIZED LEARNING PATH</div>'
@@ -714,74 +1011,83 @@ function renderAnalytics(c) {
     + '<button class="btn btn-primary" onclick="loadPath()">Generate My 6-Week Path</button>'
     + '<div id="path-area"></div></div>';
   loadAnalytics();
+  if (swrCached('path')) loadPath();
 }
 
-async function loadAnalytics() {
+function loadAnalytics(force) {
   var area = document.getElementById('analytics-area');
   if (!area) return;
-  area.innerHTML = spinner();
-  try {
-    var data = await api('GET', '/analytics/dashboard');
-    var html = '<div class="stat-grid">'
-      + '<div class="stat-card"><div class="stat-num">' + data.total_xp + '</div><div class="stat-lbl">TOTAL XP</div></div>'
-      + '<div class="stat-card"><div class="stat-num">' + Math.round(data.overall_accuracy*100) + '%</div><div class="stat-lbl">ACCURACY</div></div>'
-      + '<div class="stat-card"><div class="stat-num">' + Math.round(data.industry_readiness) + '%</div><div class="stat-lbl">READINESS</div></div>'
-      + '<div class="stat-card"><div class="stat-num" style="font-size:18px">' + USER.level.toUpperCase() + '</div><div class="stat-lbl">LEVEL</div></div>'
-      + '</div>';
-    if (data.topic_breakdown.length) {
-      html += '<div style="font-size:11px;color:var(--accent);margin-bottom:14px">TOPIC ACCURACY</div>';
-      data.topic_breakdown.forEach(function(t, i) {
-        var col = t.accuracy >= 0.7 ? 'var(--accent2)' : 'var(--danger)';
-        html += '<div class="barchart"><div class="bar-label"><span>' + t.topic + '</span><span style="color:' + col + ';font-weight:600">' + Math.round(t.accuracy*100) + '%</span></div>'
-              + '<div class="bar-bg"><div class="bar-fill" style="width:' + (t.accuracy*100) + '%;background:' + COLORS[i%COLORS.length] + '"></div></div></div>';
-      });
-    } else {
-      html += '<div style="color:var(--muted);font-size:13px;padding:10px 0">Complete quizzes to see analytics!</div>';
-    }
-    if (data.weak_topics.length) {
-      html += '<div class="divider"></div><div style="font-size:11px;color:var(--danger);margin-bottom:10px">WEAK AREAS</div><div style="margin-bottom:14px">';
-      data.weak_topics.forEach(function(t){ html += '<span class="skill-chip chip-bad">' + t + '</span>'; });
-      html += '</div>';
-      data.improvement_tips.forEach(function(tip){ html += '<div style="font-size:13px;margin-bottom:10px;padding-left:12px;border-left:2px solid var(--accent);line-height:1.7">' + tip + '</div>'; });
-    }
-    if (data.strong_topics.length) {
-      html += '<div class="divider"></div><div style="font-size:11px;color:var(--accent2);margin-bottom:10px">STRONG AREAS</div>';
-      data.strong_topics.forEach(function(t){ html += '<span class="skill-chip chip-good">' + t + '</span>'; });
-    }
-    area.innerHTML = html;
-  } catch(e) {
-    area.innerHTML = '<div class="error-box">' + e.message + '</div>';
+  if (!swrCached('dashboard')) area.innerHTML = spinner();
+  swr('dashboard', function(){ return api('GET', '/analytics/dashboard'); }, drawAnalytics, force).catch(function(e) {
+    var area = document.getElementById('analytics-area');
+    if (area && !swrCached('dashboard')) area.innerHTML = '<div class="error-box">' + e.message + '</div>';
+  });
+}
+
+function drawAnalytics(data) {
+  var area = document.getElementById('analytics-area');
+  if (!area) return;
+  var html = '<div class="stat-grid">'
+    + '<div class="stat-card"><div class="stat-num">' + data.total_xp + '</div><div class="stat-lbl">TOTAL XP</div></div>'
+    + '<div class="stat-card"><div class="stat-num">' + Math.round(data.overall_accuracy*100) + '%</div><div class="stat-lbl">ACCURACY</div></div>'
+    + '<div class="stat-card"><div class="stat-num">' + Math.round(data.industry_readiness) + '%</div><div class="stat-lbl">READINESS</div></div>'
+    + '<div class="stat-card"><div class="stat-num" style="font-size:18px">' + USER.level.toUpperCase() + '</div><div class="stat-lbl">LEVEL</div></div>'
+    + '</div>';
+  if (data.topic_breakdown.length) {
+    html += '<div style="font-size:11px;color:var(--accent);margin-bottom:14px">TOPIC ACCURACY</div>';
+    data.topic_breakdown.forEach(function(t, i) {
+      var col = t.accuracy >= 0.7 ? 'var(--accent2)' : 'var(--danger)';
+      html += '<div class="barchart"><div class="bar-label"><span>' + t.topic + '</span><span style="color:' + col + ';font-weight:600">' + Math.round(t.accuracy*100) + '%</span></div>'
+            + '<div class="bar-bg"><div class="bar-fill" style="width:' + (t.accuracy*100) + '%;background:' + COLORS[i%COLORS.length] + '"></div></div></div>';
+    });
+  } else {
+    html += '<div style="color:var(--muted);font-size:13px;padding:10px 0">Complete quizzes to see analytics!</div>';
+  }
+  if (data.weak_topics.length) {
+    html += '<div class="divider"></div><div style="font-size:11px;color:var(--danger);margin-bottom:10px">WEAK AREAS</div><div style="margin-bottom:14px">';
+    data.weak_topics.forEach(function(t){ html += '<span class="skill-chip chip-bad">' + t + '</span>'; });
+    html += '</div>';
+    data.improvement_tips.forEach(function(tip){ html += '<div style="font-size:13px;margin-bottom:10px;padding-left:12px;border-left:2px solid var(--accent);line-height:1.7">' + tip + '</div>'; });
   }
+  if (data.strong_topics.length) {
+    html += '<div class="divider"></div><div style="font-size:11px;color:var(--accent2);margin-bottom:10px">STRONG AREAS</div>';
+    data.strong_topics.forEach(function(t){ html += '<span class="skill-chip chip-good">' + t + '</span>'; });
+  }
+  area.innerHTML = html;
 }
 
-async function loadPath() {
+function loadPath(force) {
   var area = document.getElementById('path-area');
   if (!area) return;
-  area.innerHTML = '<div style="margin-top:14px">' + spinner() + '</div>';
-  try {
-    var data = await api('GET', '/analytics/learning-path');
-    if (!data.path || !data.path.weeks) { area.innerHTML = ''; return; }
-    var html = '<div style="margin-top:18px">';
-    data.path.weeks.forEach(function(w, i) {
-      var col = 'hsl(' + (180+i*45) + ',100%,55%)';
-      html += '<div class="flex gap10 mb18"><div style="width:4px;background:' + col + ';border-radius:2px;flex-shrink:0"></div><div>';
-      html += '<div style="font-size:10px;color:var(--muted);margin-bottom:3px">' + w.week + '</div>';
-      html += '<div style="font-size:13px;font-weight:700;margin-bottom:10px">' + w.focus + '</div>';
-      if (w.topics) w.topics.forEach(function(t){
-        html += '<span style="padding:4px 9px;border-radius:6px;font-size:11px;background:var(--surface2);border:1px solid var(--border);color:var(--muted);margin:2px;display:inline-block">' + t + '</span>';
-      });
-      html += '</div></div>';
+  if (!swrCached('path')) area.innerHTML = '<div style="margin-top:14px">' + spinner() + '</div>';
+  swr('path', function(){ return api('GET', '/analytics/learning-path'); }, drawPath, force).catch(function(e) {
+    var area = document.getElementById('path-area');
+    if (area && !swrCached('path')) area.innerHTML = '<div class="error-box" style="margin-top:14px">' + e.message + '</div>';
+  });
+}
+
+function drawPath(data) {
+  var area = document.getElementById('path-area');
+  if (!area) return;
+  if (!data.path || !data.path.weeks) { area.innerHTML = ''; return; }
+  var html = '<div style="margin-top:18px">';
+  data.path.weeks.forEach(function(w, i) {
+    var col = 'hsl(' + (180+i*45) + ',100%,55%)';
+    html += '<div class="flex gap10 mb18"><div style="width:4px;background:' + col + ';border-radius:2px;flex-shrink:0"></div><div>';
+    html += '<div style="font-size:10px;color:var(--muted);margin-bottom:3px">' + w.week + '</div>';
+    html += '<div style="font-size:13px;font-weight:700;margin-bottom:10px">' + w.focus + '</div>';
+    if (w.topics) w.topics.forEach(function(t){
+      html += '<span style="padding:4px 9px;border-radius:6px;font-size:11px;background:var(--surface2);border:1px solid var(--border);color:var(--muted);margin:2px;display:inline-block">' + t + '</span>';
     });
-    if (data.path.milestone) {
-      html += '<div class="flex gap10" style="align-items:center;padding:14px;background:rgba(0,255,153,0.05);border-radius:10px;border:1px solid rgba(0,255,153,0.2);margin-top:8px">'
-            + '<div><div style="font-size:10px;color:var(--muted)">FINAL MILESTONE</div>'
-            + '<div style="color:var(--accent2);font-weight:600;font-size:14px;margin-top:3px">' + data.path.milestone + '</div></div></div>';
-    }
-    html += '</div>';
-    area.innerHTML = html;
-  } catch(e) {
-    area.innerHTML = '<div class="error-box" style="margin-top:14px">' + e.message + '</div>';
+    html += '</div></div>';
+  });
+  if (data.path.milestone) {
+    html += '<div class="flex gap10" style="align-items:center;padding:14px;background:rgba(0,255,153,0.05);border-radius:10px;border:1px solid rgba(0,255,153,0.2);margin-top:8px">'
+          + '<div><div style="font-size:10px;color:var(--muted)">FINAL MILESTONE</div>'
+          + '<div style="color:var(--accent2);font-weight:600;font-size:14px;margin-top:3px">' + data.path.milestone + '</div></div></div>';
   }
+  html += '</div>';
+  area.innerHTML = html;
 }
 
 // ── INIT ───────────────────────────────────────────────────────────────────────
@@ -790,16 +1096,221 @@ if (TOKEN && USER) { showApp(); }
 </body>
 </html>"""
 
+# ── JSON ──────────────────────────────────────────────────────────────────────
+# JSON columns, API responses and LLM output all go through these. orjson is
+# used when installed; both backends produce compact UTF-8 with the same values.
+def _json_default(o): return o.isoformat() if isinstance(o,datetime) else str(o)
+
+if orjson is not None and JSON_BACKEND=="orjson":
+    _ORJSON_OPTS=orjson.OPT_NON_STR_KEYS|orjson.OPT_SERIALIZE_NUMPY
+    def json_bytes(obj): return orjson.dumps(obj,default=_json_default,option=_ORJSON_OPTS)
+    def json_dumps(obj): return orjson.dumps(obj,default=_json_default,option=_ORJSON_OPTS).decode()
+    json_loads=orjson.loads
+else:
+    def json_bytes(obj): return json.dumps(obj,default=_json_default,ensure_ascii=False,separators=(",",":")).encode()
+    def json_dumps(obj): return json.dumps(obj,default=_json_default,ensure_ascii=False,separators=(",",":"))
+    json_loads=json.loads
+
+class FastJSONResponse(JSONResponse):
+    def render(self,content): return json_bytes(content)
+
 # ── DATABASE ───────────────────────────────────────────────────────────────────
 Base = declarative_base()
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+_engine = None
+_engine_lock = threading.Lock()
+_session_factory = sessionmaker(autocommit=False, autoflush=False)
+
+def get_engine():
+    # Built on first use so importing the module (CLI jobs, workers, tooling) never touches the database
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                args = {"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {}
+                eng = create_engine(DATABASE_URL, connect_args=args,
+                                    json_serializer=json_dumps, json_deserializer=json_loads)
+                event.listen(eng, "before_cursor_execute", _before_cursor)
+                event.listen(eng, "after_cursor_execute", _after_cursor)
+                _engine = eng
+    return _engine
+
+def SessionLocal(): return _session_factory(bind=get_engine())
 
 def get_db():
     db = SessionLocal()
     try: yield db
     finally: db.close()
 
+# ── METRICS ───────────────────────────────────────────────────────────────────
+# Minimal in-process registry rendered in the Prometheus text format (0.0.4).
+METRICS:list=[]
+LATENCY_BUCKETS = (0.005,0.01,0.025,0.05,0.1,0.25,0.5,1.0,2.5,5.0,10.0,30.0)
+COUNT_BUCKETS   = (1,2,5,10,20,50,100,250)
+
+def _esc(v): return str(v).replace("\\","\\\\").replace('"','\\"').replace("\n","\\n")
+
+class Metric:
+    def __init__(self,name,help,kind,labels=(),buckets=None):
+        self.name=name; self.help=help; self.kind=kind; self.labels=tuple(labels); self.buckets=buckets
+        self.lock=threading.Lock(); self.values=defaultdict(float); self.hist={}; METRICS.append(self)
+
+    def _key(self,lb): return tuple(str(lb.get(l,"")) for l in self.labels)
+
+    def inc(self,v=1.0,**lb):
+        with self.lock: self.values[self._key(lb)]+=v
+
+    def set(self,v,**lb):
+        with self.lock: self.values[self._key(lb)]=v
+
+    def observe(self,v,**lb):
+        k=self._key(lb)
+        with self.lock:
+            h=self.hist.setdefault(k,[[0]*len(self.buckets),0.0,0])
+            for i,b in enumerate(self.buckets):
+                if v<=b: h[0][i]+=1
+            h[1]+=v; h[2]+=1
+
+    def _lbl(self,k,extra=()):
+        pairs=[f'{l}="{_esc(v)}"' for l,v in zip(self.labels,k)]+[f'{l}="{v}"' for l,v in extra]
+        return "{"+",".join(pairs)+"}" if pairs else ""
+
+    def expose(self):
+        out=[f"# HELP {self.name} {self.help}",f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            if self.kind=="histogram":
+                for k,(counts,total,n) in sorted(self.hist.items()):
+                    out+=[f"{self.name}_bucket{self._lbl(k,[('le',b)])} {c}" for b,c in zip(self.buckets,counts)]
+                    out+=[f"{self.name}_bucket{self._lbl(k,[('le','+Inf')])} {n}",f"{self.name}_sum{self._lbl(k)} {total}",f"{self.name}_count{self._lbl(k)} {n}"]
+            else: out+=[f"{self.name}{self._lbl(k)} {v}" for k,v in sorted(self.values.items())]
+        return out
+
+def render_metrics(): return "\n".join(line for m in METRICS for line in m.expose())+"\n"
+
+HTTP_REQUESTS  = Metric("biomind_http_requests_total","HTTP requests by route and status","counter",("method","route","status"))
+HTTP_LATENCY   = Metric("biomind_http_request_duration_seconds","HTTP request latency","histogram",("method","route"),LATENCY_BUCKETS)
+HTTP_INFLIGHT  = Metric("biomind_http_requests_in_flight","HTTP requests currently being served","gauge")
+REQ_DB_QUERIES = Metric("biomind_http_db_queries","SQL statements executed per request","histogram",("route",),COUNT_BUCKETS)
+REQ_DB_TIME    = Metric("biomind_http_db_seconds","SQL time spent per request","histogram",("route",),LATENCY_BUCKETS)
+DB_QUERIES     = Metric("biomind_db_queries_total","SQL statements executed","counter")
+DB_TIME        = Metric("biomind_db_seconds_total","SQL execution time","counter")
+LLM_CALLS      = Metric("biomind_llm_requests_total","Completed LLM calls by prompt type","counter",("prompt",))
+LLM_LATENCY    = Metric("biomind_llm_duration_seconds","LLM call latency by prompt type","histogram",("prompt",),LATENCY_BUCKETS)
+LLM_TOKENS     = Metric("biomind_llm_tokens_total","LLM tokens used by prompt type","counter",("prompt","kind"))
+LLM_FAILURES   = Metric("biomind_llm_failures_total","LLM failures by prompt type and reason","counter",("prompt","reason"))
+LLM_ATTEMPT_LATENCY = Metric("biomind_llm_attempt_seconds","Latency of each model attempt by outcome (won/lost/error)","histogram",("prompt","model","outcome"),LATENCY_BUCKETS)
+LLM_HEDGES     = Metric("biomind_llm_hedges_total","Requests re-sent to the fallback model","counter",("prompt","reason"))
+LLM_COST       = Metric("biomind_llm_cost_usd_total","Estimated LLM spend by prompt type and model","counter",("prompt","model"))
+SEMANTIC_LOOKUPS = Metric("biomind_semantic_cache_lookups_total","Tutor answer cache lookups","counter",("result",))
+JOB_DEPTH      = Metric("biomind_job_queue_depth","Pending jobs by kind","gauge",("kind",))
+JOB_INFLIGHT   = Metric("biomind_job_inflight","Jobs currently running","gauge")
+ADMISSION_QUEUE  = Metric("biomind_admission_queue_depth","LLM-backed requests waiting for a slot","gauge")
+ADMISSION_ACTIVE = Metric("biomind_admission_active","LLM-backed requests holding a slot","gauge")
+ADMISSION_SHED   = Metric("biomind_admission_shed_total","LLM-backed requests rejected by admission control","counter",("route","reason"))
+ADMISSION_WAIT   = Metric("biomind_admission_wait_seconds","Time spent queued for a slot","histogram",("route",),LATENCY_BUCKETS)
+JOB_EVENTS     = Metric("biomind_job_events_total","Job queue events","counter",("event",))
+
+# Per-request accumulator; sync routes run in a copied context so the dict is shared
+_req_stats:ContextVar=ContextVar("biomind_req_stats",default=None)
+_llm_prompt:ContextVar=ContextVar("biomind_llm_prompt",default="unknown")
+
+def _before_cursor(conn,cursor,statement,params,context,executemany):
+    conn.info.setdefault("biomind_t0",[]).append((time.perf_counter(),time.time_ns()))
+
+def _after_cursor(conn,cursor,statement,params,context,executemany):
+    t0,start_ns=conn.info["biomind_t0"].pop(); dt=time.perf_counter()-t0; DB_QUERIES.inc(); DB_TIME.inc(dt)
+    st=_req_stats.get()
+    if st is not None: st["queries"]+=1; st["db_time"]+=dt
+    cur=_trace.get()
+    if cur is not None:
+        cur[0].add("db.query",os.urandom(8).hex(),cur[1],start_ns,start_ns+int(dt*1e9),
+                   {"db.system":conn.dialect.name,"db.statement":statement[:300],"db.rows":cursor.rowcount,"db.executemany":executemany})
+
+def llm_prompt(fn):
+    # Tags every _llm call made inside fn with fn's name as the prompt type
+    @wraps(fn)
+    def inner(*a,**kw):
+        tok=_llm_prompt.set(fn.__name__)
+        try: return fn(*a,**kw)
+        finally: _llm_prompt.reset(tok)
+    return inner
+
+# ── TRACING ───────────────────────────────────────────────────────────────────
+# One trace per request: a root span from the middleware plus child spans for
+# each SQL statement and LLM call. Finished traces are tail-sampled (slow or
+# failed ones always kept) and exported as OTLP/JSON to a file or collector.
+_trace:ContextVar=ContextVar("biomind_trace",default=None)   # (Trace, current span id)
+
+class Trace:
+    def __init__(self):
+        self.trace_id=os.urandom(16).hex(); self.spans=[]; self.lock=threading.Lock()
+
+    def add(self,name,span_id,parent_id,start_ns,end_ns,attrs,error=None):
+        with self.lock: self.spans.append({"name":name,"span_id":span_id,"parent_id":parent_id,"start":start_ns,"end":end_ns,"attrs":attrs,"error":error})
+
+@contextmanager
+def span(name,**attrs):
+    # Yields the attribute dict so callers can tag results (tokens, etc.)
+    cur=_trace.get()
+    if cur is None: yield attrs; return
+    tr,parent=cur; sid=os.urandom(8).hex(); t0=time.time_ns(); tok=_trace.set((tr,sid)); err=None
+    try: yield attrs
+    except Exception as e: err=repr(e); raise
+    finally: _trace.reset(tok); tr.add(name,sid,parent,t0,time.time_ns(),attrs,err)
+
+def _otlp_value(v):
+    if isinstance(v,bool): return {"boolValue":v}
+    if isinstance(v,int): return {"intValue":str(v)}
+    if isinstance(v,float): return {"doubleValue":v}
+    return {"stringValue":"" if v is None else str(v)}
+
+def _otlp_payload(traces):
+    spans=[{"traceId":tr.trace_id,"spanId":sp["span_id"],"parentSpanId":sp["parent_id"] or "","name":sp["name"],
+            "kind":2 if not sp["parent_id"] else 3 if sp["name"].startswith(("db.","llm.")) else 1,
+            "startTimeUnixNano":str(sp["start"]),"endTimeUnixNano":str(sp["end"]),
+            "attributes":[{"key":k,"value":_otlp_value(v)} for k,v in sp["attrs"].items()],
+            "status":{"code":2,"message":sp["error"]} if sp["error"] else {"code":1}} for tr in traces for sp in tr.spans]
+    return {"resourceSpans":[{"resource":{"attributes":[{"key":"service.name","value":{"stringValue":"biomind-ai"}}]},
+                              "scopeSpans":[{"scope":{"name":"biotechpro1"},"spans":spans}]}]}
+
+def timeline(tr):
+    root=min(tr.spans,key=lambda sp:sp["start"])
+    return {"trace_id":tr.trace_id,"name":root["name"],"duration_ms":round((root["end"]-root["start"])/1e6,2),
+            "spans":[{"name":sp["name"],"offset_ms":round((sp["start"]-root["start"])/1e6,2),"duration_ms":round((sp["end"]-sp["start"])/1e6,2),
+                      "attrs":sp["attrs"],"error":sp["error"]} for sp in sorted(tr.spans,key=lambda sp:sp["start"])]}
+
+class TraceExporter:
+    def __init__(self):
+        self.pending=deque(maxlen=10000); self.recent=deque(maxlen=TRACE_RECENT)
+        self.wake=threading.Event(); self.halt=threading.Event(); self.thread=None
+
+    def finish(self,tr,duration_ms,failed=False):
+        if duration_ms>=TRACE_SLOW_MS or failed or random.random()<TRACE_SAMPLE_RATE:
+            self.pending.append(tr); self.recent.append(tr)
+
+    def start(self):
+        self.halt.clear(); self.thread=threading.Thread(target=self._loop,name="biomind-traces",daemon=True); self.thread.start()
+
+    def stop(self):
+        if not self.thread: return
+        self.halt.set(); self.wake.set(); self.thread.join(10); self.thread=None; self.flush()
+
+    def _loop(self):
+        while not self.halt.is_set(): self.wake.wait(2.0); self.wake.clear(); self.flush()
+
+    def flush(self):
+        batch=[]
+        while self.pending: batch.append(self.pending.popleft())
+        if not batch: return
+        body=json_dumps(_otlp_payload(batch))
+        if TRACE_OTLP_ENDPOINT:
+            try:
+                from urllib import request as urlrequest
+                urlrequest.urlopen(urlrequest.Request(TRACE_OTLP_ENDPOINT,data=body.encode(),headers={"Content-Type":"application/json"}),timeout=5).close(); return
+            except Exception as e: print(f"[trace export] {e}; writing to {TRACE_FILE}")
+        with open(TRACE_FILE,"a") as f: f.write(body+"\n")
+
+tracer=TraceExporter()
+
 # ── ENUMS ──────────────────────────────────────────────────────────────────────
 class DifficultyLevel(str, Enum):
     beginner="beginner"; intermediate="intermediate"; advanced="advanced"
@@ -832,7 +1343,42 @@ class TopicMastery(Base):
     id=Column(Integer,primary_key=True,index=True); user_id=Column(Integer,ForeignKey("users.id"),nullable=False)
     topic_name=Column(String(150),nullable=False); attempts=Column(Integer,default=0); correct=Column(Integer,default=0)
     accuracy=Column(Float,default=0.0); current_level=Column(SAEnum(DifficultyLevel),default=DifficultyLevel.beginner)
+    p_known=Column(Float,default=BKT_DEFAULTS["p_init"])
     user=relationship("User",back_populates="topic_masteries")
+    __table_args__=(Index("ix_topic_mastery_user_topic","user_id","topic_name"),)
+
+class ReviewSchedule(Base):
+    __tablename__="review_schedule"
+    id=Column(Integer,primary_key=True,index=True); user_id=Column(Integer,ForeignKey("users.id"),nullable=False)
+    topic=Column(String(150),nullable=False); easiness=Column(Float,default=REVIEW_EASE_INIT); interval_days=Column(Float,default=0.0)
+    repetitions=Column(Integer,default=0); due_at=Column(DateTime,nullable=False); last_reviewed_at=Column(DateTime)
+    __table_args__=(Index("ix_review_schedule_user_topic","user_id","topic",unique=True),Index("ix_review_schedule_user_due","user_id","due_at"),
+                  Index("ix_review_schedule_due","due_at"))
+
+class LearningPath(Base):
+    __tablename__="learning_paths"
+    id=Column(Integer,primary_key=True,index=True); fingerprint=Column(String(64),unique=True,nullable=False)
+    inputs=Column(JSON); path=Column(JSON); created_at=Column(DateTime,default=datetime.utcnow)
+
+class UserLearningPath(Base):
+    __tablename__="user_learning_paths"
+    id=Column(Integer,primary_key=True,index=True); user_id=Column(Integer,ForeignKey("users.id"),unique=True,nullable=False)
+    fingerprint=Column(String(64),nullable=False); updated_at=Column(DateTime,default=datetime.utcnow)
+
+class BktParams(Base):
+    __tablename__="bkt_params"
+    id=Column(Integer,primary_key=True,index=True); topic=Column(String(150),unique=True,nullable=False)
+    p_init=Column(Float); p_learn=Column(Float); p_slip=Column(Float); p_guess=Column(Float)
+    n_obs=Column(Integer,default=0); log_lik=Column(Float); fitted_at=Column(DateTime,default=datetime.utcnow)
+
+class SchemaMeta(Base):
+    __tablename__="schema_meta"
+    key=Column(String(50),primary_key=True); value=Column(String(200)); updated_at=Column(DateTime,default=datetime.utcnow,onupdate=datetime.utcnow)
+
+class ArchivedBlob(Base):
+    __tablename__="archived_blobs"
+    hash=Column(String(64),primary_key=True); data=Column(LargeBinary,nullable=False); size=Column(Integer,nullable=False)
+    created_at=Column(DateTime,default=datetime.utcnow)
 
 class QuizResult(Base):
     __tablename__="quiz_results"
@@ -840,7 +1386,9 @@ class QuizResult(Base):
     topic=Column(String(150),nullable=False); question_type=Column(String(20)); question_data=Column(JSON)
     student_answer=Column(Text); correct_answer=Column(Text); is_correct=Column(Boolean)
     score=Column(Float,default=0.0); llm_explanation=Column(Text); attempted_at=Column(DateTime,default=datetime.utcnow)
+    question_ref=Column(String(64)); explanation_ref=Column(String(64))   # archived_blobs hashes once compacted
     user=relationship("User",back_populates="quiz_results")
+    __table_args__=(Index("ix_quiz_results_user_id_id","user_id","id"),)
 
 class LabLog(Base):
     __tablename__="lab_logs"
@@ -848,16 +1396,59 @@ class LabLog(Base):
     lab_type=Column(String(100)); session_id=Column(String(36)); decision_chain=Column(JSON)
     outcome=Column(String(50)); score=Column(Float,default=0.0); error_count=Column(Integer,default=0)
     started_at=Column(DateTime,default=datetime.utcnow); completed_at=Column(DateTime,nullable=True)
+    chain_ref=Column(String(64))
     user=relationship("User",back_populates="lab_logs")
+    __table_args__=(Index("ix_lab_logs_user_id_id","user_id","id"),)
 
 class CareerGoal(Base):
     __tablename__="career_goals"
     id=Column(Integer,primary_key=True,index=True); user_id=Column(Integer,ForeignKey("users.id"),unique=True,nullable=False)
     target_role=Column(SAEnum(BiotechRole),nullable=False); industry_skills=Column(JSON); roadmap=Column(JSON)
     mini_projects=Column(JSON); certifications=Column(JSON); readiness_score=Column(Float,default=0.0)
-    generated_at=Column(DateTime,default=datetime.utcnow)
+    generated_at=Column(DateTime,default=datetime.utcnow); skill_snapshot=Column(JSON)
     user=relationship("User",back_populates="career_goal")
 
+class JobOutbox(Base):
+    __tablename__="job_outbox"
+    id=Column(Integer,primary_key=True,index=True); kind=Column(String(50),nullable=False); payload=Column(JSON)
+    idem_key=Column(String(200),unique=True,nullable=True); status=Column(String(20),default="pending",nullable=False)
+    attempts=Column(Integer,default=0); run_after=Column(DateTime,default=datetime.utcnow); last_error=Column(Text)
+    created_at=Column(DateTime,default=datetime.utcnow); finished_at=Column(DateTime,nullable=True)
+    __table_args__=(Index("ix_job_outbox_status_run_after","status","run_after"),)
+
+class TutorMessage(Base):
+    __tablename__="tutor_messages"
+    id=Column(Integer,primary_key=True,index=True); user_id=Column(Integer,ForeignKey("users.id"),nullable=False)
+    role=Column(String(10),nullable=False); topic=Column(String(150)); content=Column(Text,nullable=False)
+    tokens=Column(Integer,default=0); created_at=Column(DateTime,default=datetime.utcnow)
+    __table_args__=(Index("ix_tutor_messages_user_id_id","user_id","id"),)
+
+class TipsSnapshot(Base):
+    # Latest improvement tips per user, keyed by the weak-topic set they were made for
+    __tablename__="tips_snapshots"
+    user_id=Column(Integer,ForeignKey("users.id"),primary_key=True); weak=Column(JSON,nullable=False)
+    tips=Column(JSON,nullable=False); updated_at=Column(DateTime,default=datetime.utcnow)
+
+class BankedQuestion(Base):
+    # Pre-generated context-free questions, shared by every worker process
+    __tablename__="question_bank"
+    id=Column(Integer,primary_key=True,index=True); topic=Column(String(150),nullable=False)
+    difficulty=Column(String(20),nullable=False); qtype=Column(String(20),nullable=False)
+    data=Column(JSON,nullable=False); created_at=Column(DateTime,default=datetime.utcnow)
+    __table_args__=(Index("ix_question_bank_key","topic","difficulty","qtype","id"),)
+
+class PendingQuestion(Base):
+    # Served but unanswered questions; the id is the question_id, unique across worker processes
+    __tablename__="pending_questions"
+    id=Column(Integer,primary_key=True,index=True); user_id=Column(Integer,ForeignKey("users.id"),nullable=False)
+    topic=Column(String(150),nullable=False); qtype=Column(String(20),nullable=False)
+    data=Column(JSON,nullable=False); created_at=Column(DateTime,default=datetime.utcnow)
+
+class TutorSummary(Base):
+    __tablename__="tutor_summaries"
+    id=Column(Integer,primary_key=True,index=True); user_id=Column(Integer,ForeignKey("users.id"),unique=True,nullable=False)
+    summary=Column(Text,default=""); covered_until_id=Column(Integer,default=0); updated_at=Column(DateTime,default=datetime.utcnow)
+
 class SkillScore(Base):
     __tablename__="skill_scores"
     id=Column(Integer,primary_key=True,index=True); user_id=Column(Integer,ForeignKey("users.id"),nullable=False)
@@ -869,6 +1460,15 @@ class SkillScore(Base):
 class UserRegister(BaseModel):
     name:str; email:EmailStr; password:str; institution:Optional[str]=None; level:DifficultyLevel=DifficultyLevel.beginner
 
+class RosterEntry(BaseModel):
+    name:str; email:EmailStr; password:Optional[str]=None; institution:Optional[str]=None; level:DifficultyLevel=DifficultyLevel.beginner
+
+class RosterRowResult(BaseModel):
+    row:int; email:Optional[str]=None; status:str; id:Optional[int]=None; password:Optional[str]=None; error:Optional[str]=None
+
+class RosterResponse(BaseModel):
+    created:int; existing:int; invalid:int; rows:List[RosterRowResult]
+
 class TokenResponse(BaseModel):
     access_token:str; token_type:str="bearer"
 
@@ -888,6 +1488,12 @@ class QuizRequest(BaseModel):
 class QuizQuestion(BaseModel):
     question_id:int; topic:str; type:str; question:str; options:Optional[List[str]]=None; scenario:Optional[str]=None
 
+class QuizSessionRequest(BaseModel):
+    topic:str; count:int=Field(10,ge=1,le=QUIZ_SESSION_MAX); question_types:Optional[List[QuestionType]]=None; difficulty:Optional[DifficultyLevel]=None
+
+class QuizSession(BaseModel):
+    topic:str; difficulty:str; questions:List[QuizQuestion]
+
 class QuizSubmit(BaseModel):
     question_id:int; student_answer:str
 
@@ -906,6 +1512,31 @@ class LabDecisionRequest(BaseModel):
 class LabDecisionResponse(BaseModel):
     result:str; error:Optional[str]=None; next_step:Optional[LabStepResponse]=None; completed:bool=False; score:Optional[float]=None
 
+class QuizHistoryItem(BaseModel):
+    id:int; topic:str; question_type:Optional[str]=None; student_answer:Optional[str]=None; correct_answer:Optional[str]=None
+    is_correct:Optional[bool]=None; score:float; attempted_at:datetime; question_data:Optional[dict]=None; llm_explanation:Optional[str]=None
+
+class QuizHistoryPage(BaseModel):
+    items:List[QuizHistoryItem]; next_cursor:Optional[int]=None
+
+class LabHistoryItem(BaseModel):
+    id:int; session_id:str; lab_type:Optional[str]=None; outcome:Optional[str]=None; score:float; error_count:int
+    started_at:datetime; completed_at:Optional[datetime]=None; decision_chain:Optional[list]=None
+
+class LabHistoryPage(BaseModel):
+    items:List[LabHistoryItem]; next_cursor:Optional[int]=None
+
+class TutorMessageOut(BaseModel):
+    id:int; role:str; topic:Optional[str]=None; content:str; created_at:datetime
+    model_config={"from_attributes":True}
+
+class ReviewItem(BaseModel):
+    topic:str; due_at:datetime; interval_days:float; repetitions:int; easiness:float
+    model_config={"from_attributes":True}
+
+class ReviewQueue(BaseModel):
+    due:List[ReviewItem]; next_due_at:Optional[datetime]=None
+
 class TopicAccuracy(BaseModel):
     topic:str; attempts:int; accuracy:float; level:str
 
@@ -914,208 +1545,1613 @@ class AnalyticsResponse(BaseModel):
     weak_topics:List[str]; strong_topics:List[str]; improvement_tips:List[str]; industry_readiness:float
 
 class CareerRequest(BaseModel):
-    target_role:BiotechRole
+    target_role:BiotechRole; regenerate:bool=False
 
 class SkillGap(BaseModel):
     skill:str; student_score:float; required_score:float; gap:float
 
 class CareerResponse(BaseModel):
     target_role:str; readiness_score:float; skill_gaps:List[SkillGap]; roadmap:List[str]; mini_projects:List[str]; certifications:List[str]
+    generated_at:Optional[datetime]=None; regenerated:bool=False
+    stale:bool=False   # regeneration failed and this is the last saved plan
 
 # ── SECURITY ───────────────────────────────────────────────────────────────────
-pwd_context=CryptContext(schemes=["bcrypt"],deprecated="auto")
+_pwd_context=None
+_hash_pool=None; _hash_pool_lock=threading.Lock()
 oauth2_scheme=OAuth2PasswordBearer(tokenUrl="/auth/login")
 
-def hash_password(p): return pwd_context.hash(p)
-def verify_password(p,h): return pwd_context.verify(p,h)
+def pwd_context():
+    # passlib + bcrypt and jose are imported on first use rather than at startup
+    global _pwd_context
+    if _pwd_context is None:
+        from passlib.context import CryptContext
+        _pwd_context=CryptContext(schemes=["bcrypt"],deprecated="auto")
+    return _pwd_context
+
+def hash_password(p): return pwd_context().hash(p)
+def verify_password(p,h): return pwd_context().verify(p,h)
+
+def hash_passwords(passwords):
+    # bcrypt is slow on purpose, so a roster is hashed across processes. The pool is
+    # spawned rather than forked because the server already runs threads.
+    global _hash_pool
+    procs=HASH_WORKERS or os.cpu_count() or 1
+    if procs<2 or len(passwords)<2: return [hash_password(p) for p in passwords]
+    with _hash_pool_lock:
+        if _hash_pool is None:
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+            _hash_pool=ProcessPoolExecutor(procs,mp_context=multiprocessing.get_context("spawn"))
+    return list(_hash_pool.map(hash_password,passwords,chunksize=max(1,len(passwords)//(procs*4))))
 
 def create_access_token(data):
+    from jose import jwt
     to_encode=data.copy(); to_encode["exp"]=datetime.utcnow()+timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINS)
     return jwt.encode(to_encode,SECRET_KEY,algorithm=ALGORITHM)
 
-def get_current_user(token:str=Depends(oauth2_scheme),db:Session=Depends(get_db)):
-    exc=HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,detail="Invalid credentials")
+def user_from_token(db,token):
+    from jose import jwt
     try: payload=jwt.decode(token,SECRET_KEY,algorithms=[ALGORITHM]); user_id=int(payload.get("sub"))
-    except: raise exc
-    user=db.query(User).filter(User.id==user_id).first()
-    if not user: raise exc
+    except: return None
+    return db.query(User).filter(User.id==user_id).first()
+
+def get_current_user(token:str=Depends(oauth2_scheme),db:Session=Depends(get_db)):
+    user=user_from_token(db,token)
+    if not user: raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,detail="Invalid credentials")
     return user
 
-# ── GROQ LLM ───────────────────────────────────────────────────────────────────
-llm_client = Groq(api_key=GROQ_API_KEY)
+def is_admin(u): return u.email.lower() in ADMIN_EMAILS
 
-def _llm(system, message, max_tokens=1024):
-    r = llm_client.chat.completions.create(
-        model=LLM_MODEL,
-        messages=[{"role":"system","content":system},{"role":"user","content":message}],
-        max_tokens=max_tokens, temperature=0.7
-    )
-    return r.choices[0].message.content
+def get_admin_user(u:User=Depends(get_current_user)):
+    if not is_admin(u): raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,detail="Admin access required")
+    return u
 
-def _llm_json(system, message):
+# ── GROQ LLM ───────────────────────────────────────────────────────────────────
+llm_client = None   # see get_llm_client
+_llm_client_lock = threading.Lock()
+
+def get_llm_client():
+    # Constructing Groq pulls in httpx/httpcore (~150ms); defer it to the first LLM call
+    global llm_client
+    if llm_client is None:
+        with _llm_client_lock:
+            if llm_client is None:
+                if LLM_STUB_MS is not None: llm_client = StubLLM(LLM_STUB_MS); return llm_client
+                from groq import Groq
+                llm_client = Groq(api_key=GROQ_API_KEY)
+    return llm_client
+
+class StubLLM:
+    # Stand-in for the Groq client (BIOMIND_LLM_STUB_MS) for load tests: waits the configured
+    # latency and answers with the JSON template the prompt asks for. The spec is a default
+    # latency plus optional per-model overrides, e.g. "50" or "2000,llama-3.1-8b-instant=150".
+    def __init__(self, spec):
+        self.latency = {}; self.default = 0.0; self.chat = SimpleNamespace(completions=self)
+        for part in str(spec).split(","):
+            model, _, ms = part.strip().rpartition("=")
+            if model: self.latency[model] = float(ms)/1000
+            elif ms: self.default = float(ms)/1000
+
+    def _answer(self, system, message):
+        if "Question formats:" in system:
+            if "Types in order: " not in message:   # llm_quiz: one object of the requested type
+                m = re.search(r"Generate (\w+) question for", message)
+                return QUIZ_FORMATS.get(m and m.group(1), QUIZ_FORMATS["mcq"])
+            types = message.rsplit("Types in order: ",1)[-1].split(", ")   # llm_quiz_set: one object per type
+            return json.dumps({"questions":[{**json.loads(QUIZ_FORMATS[t]),"question":f"Stub {t} question {i}?"} for i,t in enumerate(types) if t in QUIZ_FORMATS]})
+        m = re.search(r"Output ONLY (?:valid )?JSON(?: array)?: (.+)", system)
+        if m:
+            try: return json.dumps(json.loads(m.group(1)))
+            except ValueError: pass
+        return "Stub answer for: "+message[:200]
+
+    def create(self, model=None, messages=(), max_tokens=None, stream=False, **kw):
+        time.sleep(self.latency.get(model, self.default)); out = self._answer(messages[0]["content"], messages[-1]["content"])
+        usage = SimpleNamespace(prompt_tokens=sum(estimate_tokens(m["content"]) for m in messages), completion_tokens=estimate_tokens(out))
+        if not stream: return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=out))], usage=usage)
+        return iter([SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=out[i:i+16]))]) for i in range(0,len(out),16)]
+                    +[SimpleNamespace(choices=[], usage=usage)])
+
+def llm_route(prompt): return {**LLM_ROUTE_DEFAULT, **LLM_ROUTES.get(prompt, {})}
+
+def llm_cost(model, prompt_tokens, completion_tokens):
+    pin, pout = LLM_PRICES.get(model, (0.0, 0.0))
+    return (prompt_tokens*pin + completion_tokens*pout)/1e6
+
+class RouteStats:
+    # Recent latency and running cost per prompt type for /llm/routes
+    def __init__(self):
+        self.lock = threading.Lock(); self.calls = Counter(); self.hedged = Counter(); self.wins = Counter()
+        self.cost = defaultdict(float); self.latency = defaultdict(lambda: deque(maxlen=1000))
+        self.attempts = Counter(); self.tokens = Counter()   # (prompt, kind) -> tokens over all attempts
+
+    def record(self, prompt, secs, winner, hedged):
+        with self.lock:
+            self.calls[prompt] += 1; self.hedged[prompt] += hedged; self.wins[(prompt, winner)] += 1; self.latency[prompt].append(secs)
+
+    def add_usage(self, prompt, prompt_tokens, completion_tokens, cached_tokens, usd):
+        with self.lock:
+            self.cost[prompt] += usd; self.attempts[prompt] += 1
+            self.tokens[(prompt, "prompt")] += prompt_tokens; self.tokens[(prompt, "completion")] += completion_tokens
+            self.tokens[(prompt, "cached")] += cached_tokens
+
+    def report(self):
+        import numpy as np
+        with self.lock:
+            out = {}
+            for prompt in sorted(set(LLM_ROUTES) | set(self.calls)):
+                lat = np.asarray(self.latency[prompt]) if self.latency[prompt] else None
+                n = self.attempts[prompt]; tpl = PROMPTS.get(prompt)
+                out[prompt] = {"route": llm_route(prompt), "calls": self.calls[prompt], "hedged": self.hedged[prompt],
+                               "prompt_version": tpl and tpl.version, "prefix_tokens": tpl and tpl.prefix_tokens,
+                               "avg_prompt_tokens": round(self.tokens[(prompt, "prompt")]/n, 1) if n else None,
+                               "avg_completion_tokens": round(self.tokens[(prompt, "completion")]/n, 1) if n else None,
+                               "cached_share": round(self.tokens[(prompt, "cached")]/max(self.tokens[(prompt, "prompt")], 1), 3),
+                               "wins": {m: n for (p, m), n in self.wins.items() if p == prompt},
+                               "p50_ms": round(float(np.percentile(lat, 50))*1000, 1) if lat is not None else None,
+                               "p95_ms": round(float(np.percentile(lat, 95))*1000, 1) if lat is not None else None,
+                               "cost_usd": round(self.cost[prompt], 6)}
+            return out
+
+route_stats = RouteStats()
+_hedge_pool = ThreadPoolExecutor(LLM_HEDGE_WORKERS, thread_name_prefix="biomind-hedge")
+
+def _llm_attempt(prompt, model, system, message, max_tokens, temperature, on_token, won):
+    # One completion against one model. won(model) is True for the attempt whose answer is used:
+    # a streamed attempt claims it with its first token and a losing stream stops reading.
+    t0 = time.perf_counter(); outcome = "error"
+    with span("llm.attempt", **{"llm.model": model}) as sp:
+        try:
+            r = get_llm_client().chat.completions.create(
+                model=model,
+                messages=[{"role":"system","content":system},{"role":"user","content":message}],
+                max_tokens=max_tokens, temperature=temperature, stream=on_token is not None
+            )
+            if on_token is None:
+                content, usage = r.choices[0].message.content, getattr(r, "usage", None)
+            else:
+                parts = []; usage = None
+                for chunk in r:
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if delta:
+                        if not won(model):
+                            getattr(r, "close", lambda: None)()
+                            usage = SimpleNamespace(prompt_tokens=estimate_tokens(system+message), completion_tokens=estimate_tokens("".join(parts)))
+                            content = None; break
+                        parts.append(delta); on_token(delta)
+                    # Groq reports usage on the last chunk under x_groq
+                    usage = getattr(chunk, "usage", None) or getattr(getattr(chunk, "x_groq", None), "usage", None) or usage
+                else: content = "".join(parts)
+            outcome = "won" if content is not None and won(model) else "lost"
+        except Exception:
+            LLM_FAILURES.inc(prompt=prompt, reason="api"); raise
+        finally:
+            sp["llm.outcome"] = outcome; LLM_ATTEMPT_LATENCY.observe(time.perf_counter()-t0, prompt=prompt, model=model, outcome=outcome)
+        if usage:
+            pt, ct = usage.prompt_tokens or 0, usage.completion_tokens or 0
+            cached = getattr(getattr(usage, "prompt_tokens_details", None), "cached_tokens", None) or 0   # prefix-cache hits
+            LLM_TOKENS.inc(pt, prompt=prompt, kind="prompt"); LLM_TOKENS.inc(ct, prompt=prompt, kind="completion")
+            LLM_TOKENS.inc(cached, prompt=prompt, kind="cached")
+            usd = llm_cost(model, pt, ct); LLM_COST.inc(usd, prompt=prompt, model=model); route_stats.add_usage(prompt, pt, ct, cached, usd)
+            sp["llm.prompt_tokens"] = pt; sp["llm.completion_tokens"] = ct; sp["llm.cached_tokens"] = cached; sp["llm.cost_usd"] = usd
+        return content if outcome == "won" else None
+
+def _llm(system, message, max_tokens=None, on_token=None):
+    # Routed by prompt type (LLM_ROUTES). If the primary has not answered within the SLO, or
+    # fails, the same request goes to the fallback model and whichever answers first wins.
+    # on_token switches to a streamed completion and receives each content delta as it arrives.
+    prompt = _llm_prompt.get(); route = llm_route(prompt); t0 = time.perf_counter()
+    budget = max_tokens or route["max_tokens"]; winner = []; lock = threading.Lock()
+    def won(model):
+        with lock:
+            if not winner: winner.append(model)
+            return winner[0] == model
+    tpl = PROMPTS.get(prompt)
+    with span(f"llm.{prompt}", **{"llm.prompt": prompt, "llm.prompt_version": tpl and tpl.version, "llm.model": route["model"], "llm.max_tokens": budget, "llm.retries": 0,
+                                  "llm.stream": on_token is not None, "llm.slo_s": route["slo"]}) as sp:
+        args = (system, message, budget, route["temperature"], on_token, won)
+        try: content, hedged = _llm_routed(prompt, route, args, sp)
+        finally: LLM_LATENCY.observe(time.perf_counter()-t0, prompt=prompt)
+        LLM_CALLS.inc(prompt=prompt); sp["llm.model"] = winner[0] if winner else route["model"]; sp["llm.hedged"] = hedged
+        route_stats.record(prompt, time.perf_counter()-t0, sp["llm.model"], hedged)
+        return content
+
+def _llm_routed(prompt, route, args, sp):
+    if not route["fallback"]:
+        content = _llm_attempt(prompt, route["model"], *args); hedged = False
+    else:
+        ctx = copy_context()
+        futs = {_hedge_pool.submit(ctx.copy().run, _llm_attempt, prompt, route["model"], *args): route["model"]}
+        done, _ = wait(futs, timeout=route["slo"])
+        hedged = not done or next(iter(done)).exception() is not None
+        if hedged:
+            LLM_HEDGES.inc(prompt=prompt, reason="slo" if not done else "error"); sp["llm.retries"] = 1
+            futs[_hedge_pool.submit(ctx.copy().run, _llm_attempt, prompt, route["fallback"], *args)] = route["fallback"]
+        content = None; err = None
+        for f in as_completed(futs):
+            if f.exception() is not None: err = f.exception(); continue
+            if f.result() is not None: content = f.result(); break
+        if content is None: raise err or RuntimeError("no LLM attempt produced an answer")
+    return content, hedged
+
+def estimate_tokens(text):
+    # ~4 characters per token for English with Llama-family tokenizers
+    return (len(text or "")+3)//4
+
+def clip_tokens(text, cap):
+    return text if estimate_tokens(text) <= cap else text[:cap*4].rsplit(" ",1)[0]+" ..."
+
+def _llm_json(system, message, max_tokens=None, on_token=None):
+    try:
+        raw = _llm(system, message, max_tokens, on_token)
+    except Exception as e:
+        print(f"[LLM error] {e}")
+        return {}
     try:
-        raw = _llm(system, message)
         cleaned = raw.strip().removeprefix("```json").removeprefix("```").removesuffix("```").strip()
         # Find JSON object in response
+        if cleaned.startswith("["): return json_loads(cleaned)
         start = cleaned.find("{")
         end = cleaned.rfind("}") + 1
         if start >= 0 and end > start:
             cleaned = cleaned[start:end]
-        return json.loads(cleaned)
+        return json_loads(cleaned)
     except Exception as e:
+        LLM_FAILURES.inc(prompt=_llm_prompt.get(), reason="parse")
         print(f"[LLM error] {e}")
         return {}
 
-def llm_lesson(topic, difficulty, name, weak):
-    return _llm_json(
-        f"You are an expert biotechnology educator. Student: {name} | Level: {difficulty.upper()}\n"
-        f"Weak areas: {', '.join(weak) or 'none'}\n"
+class JsonFieldStream:
+    # Pulls top-level string fields out of a JSON object while it is still being generated
+    # and calls emit(field, text) with each newly decoded piece
+    def __init__(self, fields, emit):
+        self.buf = ""; self.emit = emit; self.state = {f: [None, 0, False] for f in fields}   # value offset, chars sent, closed
+
+    def __call__(self, chunk):
+        self.buf += chunk
+        for f, st in self.state.items():
+            if st[2]: continue
+            if st[0] is None:
+                m = re.search(rf'"{f}"\s*:\s*"', self.buf)
+                if not m: continue
+                st[0] = m.end()
+            body = re.match(r'(?:[^"\\]|\\.)*', self.buf[st[0]:]).group()
+            try: value = json.loads(f'"{body}"')
+            except ValueError: continue   # half of a \uXXXX escape; wait for the rest
+            if len(value) > st[1]: self.emit(f, value[st[1]:]); st[1] = len(value)
+            st[2] = self.buf[st[0]+len(body):st[0]+len(body)+1] == '"'
+
+# ── PROMPT TEMPLATES ──────────────────────────────────────────────────────────
+# The system message is fixed text per prompt type (instructions, then the output schema) and
+# never carries per-student values, so every call of a type starts with the same tokens and the
+# provider can serve them from its prefix cache. Per-call values go in the user message, context
+# first and the request last; fields listed in clip are cut to a token cap before formatting.
+# Bump version whenever the wording changes.
+class PromptTemplate:
+    def __init__(self, version, system, user, clip=None):
+        self.version = version; self.system = system; self.user = user; self.clip = clip or {}
+        self.prefix_tokens = estimate_tokens(system)
+
+    def render(self, **kw):
+        for k, cap in self.clip.items(): kw[k] = clip_tokens(str(kw[k]), cap)
+        return self.system, self.user.format(**kw)
+
+def render_prompt(**kw):
+    # Renders the template of the prompt type set by @llm_prompt
+    return PROMPTS[_llm_prompt.get()].render(**kw)
+
+QUIZ_FORMATS={"mcq":'{"type":"mcq","question":"...","options":["A","B","C","D"],"answer_index":0,"explanation":"..."}',
+      "short":'{"type":"short","question":"...","sample_answer":"...","key_points":["..."]}',
+      "scenario":'{"type":"scenario","scenario":"...","question":"...","options":["A","B","C","D"],"answer_index":0,"explanation":"..."}'}
+
+# Shared by llm_quiz and llm_quiz_set so both reuse one cached prefix
+ASSESSMENT_SYSTEM = ("You are a biotechnology assessment specialist. Pitch questions at the given difficulty and "
+                     "probe the student's recent mistakes. answer_index MUST be integer 0-3.\n"
+                     "Question formats:\n" + "\n".join(f"{t}: {f}" for t, f in QUIZ_FORMATS.items()) + "\n")
+
+PROMPTS = {
+    "llm_lesson": PromptTemplate(2,
+        "You are an expert biotechnology educator. Pitch the lesson at the student's level and connect it to their weak areas.\n"
         'Output ONLY valid JSON: {"content":"lesson text","summary":"3 bullet points","real_example":"1 example"}',
-        f"Teach me about: {topic}")
+        "Student: {name} | Level: {level}\nWeak areas: {weak}\n\nTeach me about: {topic}", clip={"weak": 60}),
+    "llm_answer": PromptTemplate(2,
+        "You are an expert biotechnology tutor. Answer the student's question clearly in under 250 words, at their level.",
+        "Topic: {topic} | Level: {level}\n{context}Student question: {question}"),
+    "llm_summarize": PromptTemplate(1,
+        "Update the running summary of a biotech tutoring conversation. Keep what the student asked, "
+        "what was explained and any misconceptions. At most 150 words.",
+        "Current summary:\n{summary}\n\nNew turns:\n{turns}"),
+    "llm_quiz_set": PromptTemplate(2,
+        ASSESSMENT_SYSTEM + 'Questions must not repeat. Output ONLY valid JSON: {"questions":[...]} with one object per requested type, in order.',
+        "Topic: {topic} | Difficulty: {level}\nRecent mistakes: {wrongs}\n\nGenerate {n} questions for: {topic}. Types in order: {types}",
+        clip={"wrongs": 80}),
+    "llm_quiz": PromptTemplate(2,
+        ASSESSMENT_SYSTEM + "Output ONLY valid JSON: one object in the format of the requested type.",
+        "Topic: {topic} | Difficulty: {level}\nRecent mistakes: {wrongs}\n\nGenerate {qtype} question for: {topic}",
+        clip={"wrongs": 80}),
+    "llm_explain": PromptTemplate(1,
+        "You are a biotech tutor. Explain why the student answer is wrong in 2-3 sentences. Be kind.",
+        "Topic:{topic}\nQuestion:{question}\nCorrect:{correct}\nStudent:{student}"),
+    "llm_followup": PromptTemplate(1,
+        "Generate ONE short follow-up question to reinforce the concept.",
+        "Topic:{topic}. Concept:{concept}"),
+    "llm_start_lab": PromptTemplate(2,
+        "You are a virtual lab instructor. Open the simulation with the first bench situation at the student's level and offer four choices.\n"
+        'Output ONLY valid JSON: {"scenario":"lab scene","choices":["A","B","C","D"]}',
+        "Lab: {lab_type} | Level: {level}\n\nStart {lab_type} simulation"),
+    "llm_lab_decision": PromptTemplate(2,
+        "You are a virtual lab instructor. Describe what the student's choice led to, name any error, and set the next situation. "
+        "Set is_final=true when done.\n"
+        'Output ONLY valid JSON: {"result":"what happened","error":null,"scenario":"next situation","choices":["A","B","C","D"],"is_final":false}',
+        "Lab: {lab_type} | Level: {level} | Step: {step}\nHistory: {chain}\n\nStudent chose: {choice}"),
+    "llm_career": PromptTemplate(2,
+        "Biotech career advisor. Compare the student's skills and topic accuracy with the target role and plan the next steps.\n"
+        'Output ONLY valid JSON: {"industry_required_skills":{"skill":0},"roadmap":["step1","step2","step3","step4","step5"],"mini_projects":["p1","p2","p3"],"certifications":["c1","c2"],"readiness_score":65.0}',
+        "Student: {name} | Role: {role}\nSkills: {skills}\nTopics: {topics}\n\nGenerate career roadmap for {role}",
+        clip={"topics": 300}),
+    "llm_tips": PromptTemplate(1,
+        'Generate 3-4 improvement tips. Output ONLY JSON array: ["tip1","tip2","tip3"]',
+        "Weak:{weak}. Level:{level}", clip={"weak": 60}),
+    "llm_path": PromptTemplate(2,
+        "Biotech curriculum designer. Plan six weeks that shore up the weak topics and build on the strong ones for the target role.\n"
+        'Output ONLY valid JSON: {"weeks":[{"week":"Week 1-2","focus":"theme","topics":["t1","t2","t3"],"priority":"high"}],"milestone":"goal"}',
+        "Level: {level} | Role: {role}\nWeak: {weak}\nStrong: {strong}\n\nGenerate 6-week learning path"),
+}
 
+@llm_prompt
+def llm_lesson(topic, difficulty, name, weak):
+    return _llm_json(*render_prompt(name=name, level=difficulty.upper(), weak=", ".join(weak) or "none", topic=topic))
+
+@llm_prompt
+def llm_answer(topic, difficulty, question, context=""):
+    # Without context the answer is student-independent and shareable via the semantic cache
+    return _llm(*render_prompt(topic=topic, level=difficulty.upper(), context=f"{context}\n\n" if context else "", question=question))
+
+@llm_prompt
+def llm_summarize(summary, turns):
+    return _llm(*render_prompt(summary=summary or "(none)", turns=turns))
+
+@llm_prompt
+def llm_quiz_set(topic, difficulty, qtypes, wrongs):
+    # One completion for several questions: the system prompt and mistakes context are paid once
+    raw=_llm_json(*render_prompt(topic=topic, level=difficulty.upper(), wrongs=", ".join(wrongs) or "none",
+                                 n=len(qtypes), types=", ".join(qtypes)),
+                  max_tokens=QUIZ_TOKENS_PER_QUESTION*len(qtypes)+100)
+    qs=raw.get("questions") if isinstance(raw,dict) else None
+    return [q for q in qs if isinstance(q,dict)] if isinstance(qs,list) else []
+
+def valid_question(q):
+    if not q.get("question") or q.get("type") not in QUIZ_FORMATS: return False
+    if q["type"]=="short": return bool(q.get("sample_answer"))
+    return isinstance(q.get("options"),list) and len(q["options"])==4 and isinstance(q.get("answer_index"),int) and 0<=q["answer_index"]<=3
+
+@llm_prompt
 def llm_quiz(topic, difficulty, qtype, wrongs):
-    fmts={"mcq":'{"type":"mcq","question":"...","options":["A","B","C","D"],"answer_index":0,"explanation":"..."}',
-          "short":'{"type":"short","question":"...","sample_answer":"...","key_points":["..."]}',
-          "scenario":'{"type":"scenario","scenario":"...","question":"...","options":["A","B","C","D"],"answer_index":0,"explanation":"..."}'}
-    return _llm_json(
-        f"You are a biotechnology assessment specialist. Difficulty: {difficulty.upper()} | Topic: {topic}\n"
-        f"Recent mistakes: {', '.join(wrongs) or 'none'}\nanswer_index MUST be integer 0-3.\n"
-        f"Output ONLY valid JSON: {fmts[qtype]}",
-        f"Generate {qtype} question for: {topic}")
+    return _llm_json(*render_prompt(topic=topic, level=difficulty.upper(), wrongs=", ".join(wrongs) or "none", qtype=qtype))
 
+@llm_prompt
 def llm_explain(question, correct, student, topic):
-    return _llm("You are a biotech tutor. Explain why the student answer is wrong in 2-3 sentences. Be kind.",
-                f"Topic:{topic}\nQuestion:{question}\nCorrect:{correct}\nStudent:{student}", max_tokens=250)
+    return _llm(*render_prompt(topic=topic, question=question, correct=correct, student=student))
 
+@llm_prompt
 def llm_followup(topic, concept):
-    return _llm("Generate ONE short follow-up question to reinforce the concept.",
-                f"Topic:{topic}. Concept:{concept}", max_tokens=120)
+    return _llm(*render_prompt(topic=topic, concept=concept))
 
-def llm_start_lab(lab_type, level):
-    return _llm_json(
-        f"You are a virtual lab instructor for {lab_type}. Level: {level.upper()}\n"
-        'Output ONLY valid JSON: {"scenario":"lab scene","choices":["A","B","C","D"]}',
-        f"Start {lab_type} simulation")
+@llm_prompt
+def llm_start_lab(lab_type, level, on_delta=None):
+    return _llm_json(*render_prompt(lab_type=lab_type, level=level.upper()),
+                     on_token=on_delta and JsonFieldStream(("scenario",), on_delta))
 
-def llm_lab_decision(lab_type, level, choice, step, history):
-    chain = " -> ".join([f"Step {d['step']}: {d['choice']}" for d in history])
-    return _llm_json(
-        f"Lab:{lab_type} Level:{level.upper()} Step:{step} History:{chain}\n"
-        'Output ONLY valid JSON: {"result":"what happened","error":null,"scenario":"next situation","choices":["A","B","C","D"],"is_final":false}\n'
-        "Set is_final=true when done.",
-        f"Student chose: {choice}")
+@llm_prompt
+def llm_lab_decision(lab_type, level, choice, step, history, on_delta=None):
+    chain = " -> ".join([f"Step {d['step']}: {d['choice']}" for d in history]) or "none"
+    return _llm_json(*render_prompt(lab_type=lab_type, level=level.upper(), step=step, chain=chain, choice=choice),
+                     on_token=on_delta and JsonFieldStream(("result", "scenario"), on_delta))
 
+@llm_prompt
 def llm_career(name, role, skills, topics):
-    return _llm_json(
-        f"Biotech career advisor. Student:{name} | Role:{role}\nSkills:{json.dumps(skills)} | Topics:{json.dumps(topics)}\n"
-        'Output ONLY valid JSON: {"industry_required_skills":{"skill":0},"roadmap":["step1","step2","step3","step4","step5"],"mini_projects":["p1","p2","p3"],"certifications":["c1","c2"],"readiness_score":65.0}',
-        f"Generate career roadmap for {role}")
+    return _llm_json(*render_prompt(name=name, role=role, skills=json.dumps(skills), topics=json.dumps(topics)))
 
+@llm_prompt
 def llm_tips(weak, level):
-    raw = _llm_json('Generate 3-4 improvement tips. Output ONLY JSON array: ["tip1","tip2","tip3"]',
-                    f"Weak:{', '.join(weak)}. Level:{level}")
+    raw = _llm_json(*render_prompt(weak=", ".join(weak), level=level))
     if isinstance(raw, list): return raw
     if isinstance(raw, dict):
         for v in raw.values():
             if isinstance(v, list): return v
     return []
 
+@llm_prompt
 def llm_path(level, role, weak, strong):
-    return _llm_json(
-        f"Biotech curriculum designer. Level:{level} Role:{role} Weak:{weak} Strong:{strong}\n"
-        'Output ONLY valid JSON: {"weeks":[{"week":"Week 1-2","focus":"theme","topics":["t1","t2","t3"],"priority":"high"}],"milestone":"goal"}',
-        "Generate 6-week learning path")
+    return _llm_json(*render_prompt(level=level, role=role, weak=", ".join(weak) or "none", strong=", ".join(strong) or "none"))
 
 # ── ANALYTICS ──────────────────────────────────────────────────────────────────
 def get_breakdown(db,uid): return [{"topic":m.topic_name,"attempts":m.attempts,"accuracy":round(m.accuracy,3),"level":m.current_level.value} for m in db.query(TopicMastery).filter(TopicMastery.user_id==uid,TopicMastery.attempts>0).all()]
-def weak_topics(db,uid):   return [m.topic_name for m in db.query(TopicMastery).filter(TopicMastery.user_id==uid,TopicMastery.attempts>0,TopicMastery.accuracy<WEAK_THRESHOLD).all()]
-def strong_topics(db,uid): return [m.topic_name for m in db.query(TopicMastery).filter(TopicMastery.user_id==uid,TopicMastery.accuracy>=STRONG_THRESHOLD).all()]
+def weak_topics(db,uid):   return [t for (t,) in db.query(TopicMastery.topic_name).filter(TopicMastery.user_id==uid,TopicMastery.attempts>0,TopicMastery.p_known<WEAK_THRESHOLD)]
+def strong_topics(db,uid): return [t for (t,) in db.query(TopicMastery.topic_name).filter(TopicMastery.user_id==uid,TopicMastery.p_known>=STRONG_THRESHOLD)]
 def overall_acc(db,uid):
-    r=db.query(func.sum(func.cast(QuizResult.is_correct,Integer)).label("c"),func.count(QuizResult.id).label("t")).filter(QuizResult.user_id==uid).first()
-    return round((r.c or 0)/r.t,3) if r and r.t else 0.0
+    r=db.query(func.sum(func.cast(QuizResult.is_correct,Integer)).label("c"),func.count(QuizResult.id).label("n")).filter(QuizResult.user_id==uid).first()
+    return round((r.c or 0)/r.n,3) if r and r.n else 0.0
 
 
 def readiness(db,uid,role):
-    bm=INDUSTRY_BENCHMARKS.get(role,{})
-    scores={s.skill_name:s.score for s in db.query(SkillScore).filter(SkillScore.user_id==uid).all()}
-    topic_acc={m.topic_name:m.accuracy*100 for m in db.query(TopicMastery).filter(TopicMastery.user_id==uid).all()}
-    ratios=[min(scores.get(sk,topic_acc.get(sk,0))/req,1.0) for sk,req in bm.items()]
-    return round((sum(ratios)/len(ratios))*100,1) if ratios else 0.0
+    return readiness_all(skill_vector(db,uid)).get(role,0.0)
 
 def skill_gaps(db,uid,role):
-    bm=INDUSTRY_BENCHMARKS.get(role,{})
-    scores={s.skill_name:s.score for s in db.query(SkillScore).filter(SkillScore.user_id==uid).all()}
-    topic_acc={m.topic_name:m.accuracy*100 for m in db.query(TopicMastery).filter(TopicMastery.user_id==uid).all()}
-    return sorted([{"skill":sk,"student_score":scores.get(sk,topic_acc.get(sk,0)),"required_score":req,"gap":max(0,req-scores.get(sk,topic_acc.get(sk,0)))} for sk,req in bm.items()],key=lambda x:x["gap"],reverse=True)
+    return gaps_for(skill_vector(db,uid),role)
 
 def update_mastery(db,uid,topic,correct):
     m=db.query(TopicMastery).filter(TopicMastery.user_id==uid,TopicMastery.topic_name==topic).first()
-    if not m: m=TopicMastery(user_id=uid,topic_name=topic,attempts=0,correct=0); db.add(m)
+    prm=bkt_params(db,topic)
+    if not m: m=TopicMastery(user_id=uid,topic_name=topic,attempts=0,correct=0,p_known=prm["p_init"]); db.add(m)
     m.attempts+=1
     if correct: m.correct+=1
     m.accuracy=m.correct/m.attempts
-    if m.accuracy>=0.80 and m.attempts>=5:
-        if m.current_level==DifficultyLevel.beginner: m.current_level=DifficultyLevel.intermediate
-        elif m.current_level==DifficultyLevel.intermediate: m.current_level=DifficultyLevel.advanced
-    elif m.accuracy<0.40 and m.attempts>=3:
-        if m.current_level==DifficultyLevel.advanced: m.current_level=DifficultyLevel.intermediate
-        elif m.current_level==DifficultyLevel.intermediate: m.current_level=DifficultyLevel.beginner
-    db.commit()
+    m.p_known=bkt_step(m.p_known if m.p_known is not None else prm["p_init"],correct,prm)
+    m.current_level=level_for(m.p_known,m.current_level or DifficultyLevel.beginner)
+    db.commit(); refresh_learning_path(db,uid)
+
+def add_xp(db,uid,pts):
+    # Atomic increment: several XP jobs for one user may run concurrently
+    db.query(User).filter(User.id==uid).update({User.xp_points:User.xp_points+pts},synchronize_session=False)
+    xp=db.query(User.xp_points).filter(User.id==uid).scalar() or 0
+    if xp>=600: db.query(User).filter(User.id==uid).update({User.level:DifficultyLevel.advanced},synchronize_session=False)
+    elif xp>=200: db.query(User).filter(User.id==uid).update({User.level:DifficultyLevel.intermediate},synchronize_session=False)
+    db.commit(); refresh_learning_path(db,uid)
+
+# ── KNOWLEDGE TRACING ─────────────────────────────────────────────────────────
+# Bayesian knowledge tracing: TopicMastery.p_known is P(topic learned), moved
+# in O(1) per answer. Per-topic parameters are refit offline by grid search
+# over the whole QuizResult table (python biotechpro1.py bkt-recalibrate).
+_bkt_cache:dict={}
+
+def bkt_params(db,topic):
+    hit=_bkt_cache.get(topic)
+    if hit and time.monotonic()-hit[0]<BKT_PARAMS_TTL: return hit[1]
+    row=db.query(BktParams).filter(BktParams.topic==topic).first()
+    prm={k:getattr(row,k) for k in BKT_DEFAULTS} if row else dict(BKT_DEFAULTS)
+    _bkt_cache[topic]=(time.monotonic(),prm); return prm
+
+def bkt_step(p,correct,prm):
+    slip,guess=prm["p_slip"],prm["p_guess"]
+    post=p*(1-slip)/(p*(1-slip)+(1-p)*guess) if correct else p*slip/(p*slip+(1-p)*(1-guess))
+    return post+(1-post)*prm["p_learn"]
+
+def level_for(p,current):
+    # Boundaries at or below the current level sit BKT_HYSTERESIS lower, so one miss does not demote
+    cur=list(DifficultyLevel).index(current)
+    n=sum(p>=(b-BKT_HYSTERESIS if i<cur else b) for i,b in enumerate((BKT_INTERMEDIATE,BKT_ADVANCED)))
+    return list(DifficultyLevel)[n]
+
+def topic_level(db,uid,topic):
+    return db.query(TopicMastery.current_level).filter(TopicMastery.user_id==uid,TopicMastery.topic_name==topic).scalar()
+
+def _bkt_grid():
+    import numpy as np
+    g=np.array(np.meshgrid([0.1,0.3,0.5,0.7],[0.05,0.1,0.2,0.3,0.4],[0.05,0.1,0.2,0.3],[0.1,0.2,0.3,0.4],indexing="ij")).reshape(4,-1)
+    return dict(zip(("p_init","p_learn","p_slip","p_guess"),g))
+
+def bkt_forward(obs,mask,prm):
+    # obs/mask: (sequences x steps); prm values: (grid,). Returns log-lik per grid point and final p_known (seq x grid)
+    import numpy as np
+    p=np.broadcast_to(prm["p_init"],(obs.shape[0],len(prm["p_init"]))).copy(); ll=np.zeros(p.shape[1])
+    slip,guess,learn=prm["p_slip"],prm["p_guess"],prm["p_learn"]
+    for t in range(obs.shape[1]):
+        o=obs[:,t,None]; m=mask[:,t,None]
+        pc=p*(1-slip)+(1-p)*guess
+        ll+=np.where(m,np.log(np.where(o,pc,1-pc)),0.0).sum(0)
+        post=np.where(o,p*(1-slip)/pc,p*slip/(1-pc))
+        p=np.where(m,post+(1-post)*learn,p)
+    return ll,p
+
+def _sequences(users,correct):
+    # Rows arrive ordered by user then id; left-align each user's answers in a padded matrix
+    import numpy as np
+    starts=np.flatnonzero(np.r_[True,users[1:]!=users[:-1]]); lens=np.diff(np.r_[starts,len(users)])
+    keep=np.minimum(lens,BKT_MAX_STEPS); T=int(keep.max())
+    obs=np.zeros((len(starts),T),dtype=bool); mask=np.zeros_like(obs)
+    for i,(s0,n,k) in enumerate(zip(starts,lens,keep)): obs[i,:k]=correct[s0+n-k:s0+n]; mask[i,:k]=True
+    return users[starts],obs,mask
+
+def recalibrate_bkt(db):
+    import numpy as np
+    grid=_bkt_grid(); report={}
+    topics=[t for (t,) in db.query(QuizResult.topic).group_by(QuizResult.topic).having(func.count(QuizResult.id)>=BKT_MIN_OBS)]
+    for topic in topics:
+        rows=db.execute(select(QuizResult.user_id,QuizResult.is_correct).where(QuizResult.topic==topic)
+                        .order_by(QuizResult.user_id,QuizResult.id).execution_options(yield_per=EXPORT_CHUNK)).all()
+        users=np.fromiter((r[0] for r in rows),dtype=np.int64,count=len(rows)); correct=np.fromiter((bool(r[1]) for r in rows),dtype=bool,count=len(rows))
+        uids,obs,mask=_sequences(users,correct)
+        ll,p=bkt_forward(obs,mask,grid); best=int(ll.argmax()); prm={k:float(v[best]) for k,v in grid.items()}
+        row=db.query(BktParams).filter(BktParams.topic==topic).first() or BktParams(topic=topic)
+        for k,v in prm.items(): setattr(row,k,v)
+        row.n_obs=len(rows); row.log_lik=float(ll[best]); row.fitted_at=datetime.utcnow(); db.add(row)
+        known=dict(zip(uids.tolist(),p[:,best].tolist()))
+        ms=db.query(TopicMastery.id,TopicMastery.user_id,TopicMastery.current_level).filter(TopicMastery.topic_name==topic).all()
+        db.bulk_update_mappings(TopicMastery,[{"id":i,"p_known":known[u],"current_level":level_for(known[u],lvl or DifficultyLevel.beginner)} for i,u,lvl in ms if u in known])
+        db.commit(); _bkt_cache.pop(topic,None); report[topic]={**prm,"n_obs":len(rows),"learners":len(uids)}
+    return report
+
+def backfill_p_known(db):
+    # p_known was added to an existing table: replay each learner's stored answers through
+    # the forward pass instead of leaving everyone at p_init. current_level is kept as stored.
+    import numpy as np
+    for (topic,) in db.query(TopicMastery.topic_name).distinct():
+        rows=db.execute(select(QuizResult.user_id,QuizResult.is_correct).where(QuizResult.topic==topic)
+                        .order_by(QuizResult.user_id,QuizResult.id)).all()
+        known={}
+        if rows:
+            users=np.fromiter((r[0] for r in rows),dtype=np.int64,count=len(rows)); correct=np.fromiter((bool(r[1]) for r in rows),dtype=bool,count=len(rows))
+            uids,obs,mask=_sequences(users,correct)
+            _,p=bkt_forward(obs,mask,{k:np.array([v]) for k,v in bkt_params(db,topic).items()})
+            known=dict(zip(uids.tolist(),p[:,0].tolist()))
+        # Learners with no surviving answer rows fall back to their lifetime accuracy
+        ms=db.query(TopicMastery.id,TopicMastery.user_id,TopicMastery.accuracy).filter(TopicMastery.topic_name==topic).all()
+        db.bulk_update_mappings(TopicMastery,[{"id":i,"p_known":known.get(u,acc or 0.0)} for i,u,acc in ms])
+        db.commit()
+
+def run_bkt_recalibrate():
+    init_schema(); db=SessionLocal(); t0=time.perf_counter()
+    try: print(json.dumps(recalibrate_bkt(db),indent=2)); print(f"refit in {time.perf_counter()-t0:.2f}s")
+    finally: db.close()
+
+# ── REVIEW SCHEDULER ──────────────────────────────────────────────────────────
+# SM-2 spaced repetition per (user, topic). The review_schedule table is the
+# source of truth ("what is due now" is one (user_id, due_at) range scan);
+# DueQueue polls that table each tick for rows that fell due since the last
+# one, so every worker sees reviews scheduled by any worker and keeps no heap.
+def sm2(row,correct,now):
+    q=4 if correct else 1
+    if not correct:
+        row.repetitions=0; row.interval_days=REVIEW_RELEARN_MINUTES/1440
+    elif row.repetitions and row.due_at and now<row.due_at:
+        return row   # answering again before it is due does not earn a longer interval
+    else:
+        row.interval_days=1.0 if row.repetitions==0 else 6.0 if row.repetitions==1 else row.interval_days*row.easiness
+        row.repetitions+=1
+    row.easiness=max(REVIEW_EASE_MIN,row.easiness+0.1-(5-q)*(0.08+(5-q)*0.02))
+    row.due_at=now+timedelta(days=row.interval_days); row.last_reviewed_at=now
+    return row
+
+def schedule_review(db,uid,topic,correct):
+    now=datetime.utcnow()
+    row=db.query(ReviewSchedule).filter(ReviewSchedule.user_id==uid,ReviewSchedule.topic==topic).first()
+    if not row: row=ReviewSchedule(user_id=uid,topic=topic,easiness=REVIEW_EASE_INIT,interval_days=0.0,repetitions=0,due_at=now); db.add(row)
+    sm2(row,correct,now); db.commit()
+
+def due_reviews(db,uid,limit,now=None):
+    return db.query(ReviewSchedule).filter(ReviewSchedule.user_id==uid,ReviewSchedule.due_at<=(now or datetime.utcnow())).order_by(ReviewSchedule.due_at).limit(limit).all()
+
+class DueQueue:
+    # Each worker polls on its own, so a topic can be announced once per worker a student polls
+    def __init__(self):
+        self.since=None; self.lock=threading.Lock(); self.inbox=defaultdict(set)
+        self.halt=threading.Event(); self.thread=None
+
+    def pop_due(self,db,now=None):
+        # Rows whose due_at passed since the previous poll; the first poll takes everything overdue
+        now=now or datetime.utcnow(); out=defaultdict(list)
+        q=select(ReviewSchedule.user_id,ReviewSchedule.topic).where(ReviewSchedule.due_at<=now)
+        if self.since is not None: q=q.where(ReviewSchedule.due_at>self.since)
+        for u,t in db.execute(q.execution_options(yield_per=EXPORT_CHUNK)): out[u].append(t)
+        self.since=now; return out
+
+    def notify(self,batch):
+        with self.lock:
+            for uid,topics in batch.items(): self.inbox[uid].update(topics)
+
+    def take(self,uid):
+        with self.lock: return sorted(self.inbox.pop(uid,()))
+
+    def tick(self):
+        db=SessionLocal()
+        try: batch=self.pop_due(db)
+        finally: db.close()
+        if batch: self.notify(batch)
+
+    def start(self):
+        self.since=None; self.tick()
+        self.halt.clear(); self.thread=threading.Thread(target=self._loop,name="biomind-reviews",daemon=True); self.thread.start()
+
+    def stop(self):
+        if self.thread: self.halt.set(); self.thread.join(5); self.thread=None
+
+    def _loop(self):
+        while not self.halt.wait(REVIEW_TICK_SECS):
+            try: self.tick()
+            except Exception as e: print(f"[reviews] {e}")
+
+due_queue=DueQueue()
+
+# ── LEARNING PATHS ────────────────────────────────────────────────────────────
+# A 6-week path depends only on (level, role, weak set, strong set). Paths are
+# stored once per fingerprint of those inputs and shared by every user with
+# the same inputs; the LLM runs only when a user's fingerprint moves.
+def path_inputs(db,uid):
+    level,role=db.query(User.level,CareerGoal.target_role).outerjoin(CareerGoal,CareerGoal.user_id==User.id).filter(User.id==uid).one()
+    return [level.value,role.value if role else "researcher",sorted(weak_topics(db,uid)),sorted(strong_topics(db,uid))]
+
+def path_fingerprint(inputs):   # includes the prompt version so a reworded template regenerates paths
+    return hashlib.sha256(json.dumps([PROMPTS["llm_path"].version, *inputs]).encode()).hexdigest()
+
+def stored_path(db,fp): return db.query(LearningPath).filter(LearningPath.fingerprint==fp).first()
+
+def generate_path(db,fp,inputs):
+    data=llm_path(*inputs)
+    if not data.get("weeks"): return None
+    try: db.add(LearningPath(fingerprint=fp,inputs=inputs,path=data)); db.commit()
+    except IntegrityError: db.rollback()   # another worker stored the same fingerprint first
+    return stored_path(db,fp)
+
+def point_user_path(db,uid,fp):
+    ptr=db.query(UserLearningPath).filter(UserLearningPath.user_id==uid).first()
+    if not ptr: ptr=UserLearningPath(user_id=uid,fingerprint=fp); db.add(ptr)
+    ptr.fingerprint=fp; ptr.updated_at=datetime.utcnow(); db.commit()
+
+def refresh_learning_path(db,uid):
+    # Called after mastery/XP changes; only users who have opened their path are kept fresh
+    ptr=db.query(UserLearningPath).filter(UserLearningPath.user_id==uid).first()
+    if not ptr: return
+    fp=path_fingerprint(path_inputs(db,uid))
+    if fp==ptr.fingerprint: return
+    if stored_path(db,fp): point_user_path(db,uid,fp)
+    else: enqueue(db,"learning_path",{"user_id":uid},key=f"path:{uid}:{fp}")
+
+# ── READINESS ENGINE ──────────────────────────────────────────────────────────
+# Benchmarks are a dense (roles x skills) matrix; a student is a skill vector
+# over the same columns, so every role is scored in one broadcast.
+BENCH_ROLES  = list(INDUSTRY_BENCHMARKS)
+BENCH_SKILLS = sorted({sk for bm in INDUSTRY_BENCHMARKS.values() for sk in bm})
+_SKILL_IDX   = {sk:i for i,sk in enumerate(BENCH_SKILLS)}
+_ROLE_IDX    = {r:i for i,r in enumerate(BENCH_ROLES)}
+_ROLE_COLS   = {r:[_SKILL_IDX[sk] for sk in bm] for r,bm in INDUSTRY_BENCHMARKS.items()}
+
+@lru_cache(maxsize=None)
+def bench_arrays():
+    # Built on first use so importing the module does not pull in numpy.
+    # Returns the benchmark matrix, its nonzero mask, 1/benchmark and skills per role.
+    import numpy as np
+    m=np.zeros((len(BENCH_ROLES),len(BENCH_SKILLS)))
+    for r,cols in _ROLE_COLS.items(): m[_ROLE_IDX[r],cols]=list(INDUSTRY_BENCHMARKS[r].values())
+    mask=m>0
+    return m,mask,np.divide(1.0,m,out=np.zeros_like(m),where=mask),np.maximum(mask.sum(1),1)
+
+def skill_vector(db,uid):
+    # SkillScore overrides topic accuracy for the same name, as before
+    import numpy as np
+    v=np.zeros(len(BENCH_SKILLS))
+    for name,acc in db.query(TopicMastery.topic_name,TopicMastery.accuracy).filter(TopicMastery.user_id==uid,TopicMastery.topic_name.in_(BENCH_SKILLS)):
+        v[_SKILL_IDX[name]]=(acc or 0.0)*100
+    for name,score in db.query(SkillScore.skill_name,SkillScore.score).filter(SkillScore.user_id==uid,SkillScore.skill_name.in_(BENCH_SKILLS)):
+        v[_SKILL_IDX[name]]=score or 0.0
+    return v
+
+def readiness_matrix(V):
+    # V: (users x skills) -> (users x roles) readiness in percent
+    import numpy as np
+    _,_,inv,n=bench_arrays(); ratios=np.minimum(V[:,None,:]*inv[None,:,:],1.0)
+    return np.round(ratios.sum(2)/n*100,1)
+
+def gap_matrix(V):
+    # V: (users x skills) -> (users x roles x skills) points below benchmark
+    import numpy as np
+    m,mask,_,_=bench_arrays()
+    return np.maximum(m[None,:,:]-V[:,None,:],0.0)*mask
+
+def readiness_all(v):
+    return dict(zip(BENCH_ROLES,readiness_matrix(v[None,:])[0].tolist()))
+
+def gaps_for(v,role):
+    import numpy as np
+    if role not in _ROLE_IDX: return []
+    cols=_ROLE_COLS[role]; req=bench_arrays()[0][_ROLE_IDX[role],cols]; have=v[cols]; gap=np.maximum(req-have,0.0)
+    return sorted([{"skill":BENCH_SKILLS[c],"student_score":float(h),"required_score":float(r),"gap":float(g)} for c,h,r,g in zip(cols,have,req,gap)],key=lambda x:x["gap"],reverse=True)
+
+def cohort_vectors(db,uids=None):
+    # Two set-based queries for the whole cohort instead of two per user
+    import numpy as np
+    if uids is None: uids=[i for (i,) in db.query(User.id).order_by(User.id)]
+    uids=np.asarray(uids,dtype=np.int64); row={u:i for i,u in enumerate(uids.tolist())}
+    V=np.zeros((len(uids),len(BENCH_SKILLS)))
+    for model,name_col,val_col,scale in ((TopicMastery,TopicMastery.topic_name,TopicMastery.accuracy,100.0),(SkillScore,SkillScore.skill_name,SkillScore.score,1.0)):
+        q=db.query(model.user_id,name_col,val_col).filter(name_col.in_(BENCH_SKILLS))
+        if len(uids)<=1000: q=q.filter(model.user_id.in_(uids.tolist()))
+        rs=[(row[u],_SKILL_IDX[n],(x or 0.0)*scale) for u,n,x in q if u in row]
+        if rs: r,c,x=map(np.asarray,zip(*rs)); V[r,c]=x
+    return uids,V
+
+def cohort_readiness(db,uids=None):
+    uids,V=cohort_vectors(db,uids)
+    return uids,readiness_matrix(V)
+
+# ── COHORT REPORTS ────────────────────────────────────────────────────────────
+# Offline job: streams the hot tables column-only in chunks and writes small
+# columnar files; /analytics/cohort only ever reads those files.
+COHORT_TABLES = ("cohorts","accuracy_distribution","topics","labs","level_transitions")
+_LEVELS       = [l.value for l in DifficultyLevel]
+
+def _cohort_of(inst): return (inst or "").strip() or "unassigned"
+
+def _chunks(q,n=COHORT_CHUNK):
+    it=iter(q.yield_per(n))
+    while rows:=list(itertools.islice(it,n)): yield rows
+
+def _arrow():
+    # pyarrow is optional and slow to import; only report builds need it
+    try: import pyarrow as pa, pyarrow.parquet as pq
+    except ImportError: return None,None
+    return pa,pq
+
+def _write_table(out_dir,name,rows,cols):
+    pa,pq=_arrow()
+    with open(os.path.join(out_dir,f"{name}.csv"),"w",newline="") as f:
+        w=csv.DictWriter(f,fieldnames=cols); w.writeheader(); w.writerows(rows)
+    if pa: pq.write_table(pa.Table.from_pylist(rows) if rows else pa.table({c:[] for c in cols}),os.path.join(out_dir,f"{name}.parquet"))
+
+def build_cohort_report(db,out_dir=None):
+    import numpy as np
+    out_dir=out_dir or COHORT_DIR
+    users={uid:_cohort_of(inst) for uid,inst in db.query(User.id,User.institution)}
+    uids,ready=cohort_readiness(db,list(users))
+    row={u:i for i,u in enumerate(uids.tolist())}; cohort_of_row=[users[u] for u in uids.tolist()]
+    att=np.zeros(len(uids)); cor=np.zeros(len(uids)); topic=Counter(); topic_ok=Counter(); learners=defaultdict(set)
+
+    for rows in _chunks(db.query(QuizResult.user_id,QuizResult.topic,QuizResult.is_correct)):
+        rows=[r for r in rows if r[0] in row]
+        if not rows: continue
+        idx=np.fromiter((row[r[0]] for r in rows),dtype=np.int64,count=len(rows))
+        ok=np.fromiter((bool(r[2]) for r in rows),dtype=np.float64,count=len(rows))
+        np.add.at(att,idx,1.0); np.add.at(cor,idx,ok)
+        for (u,t,c),good in zip(rows,ok):
+            k=(users[u],t); topic[k]+=1; topic_ok[k]+=good; learners[k].add(u)
+
+    levels=Counter(); transitions=Counter(); snapshot={}
+    prev_path=os.path.join(out_dir,"topic_levels.csv"); prev={}
+    if os.path.exists(prev_path):
+        with open(prev_path,newline="") as f: prev={(int(r["user_id"]),r["topic"]):r["level"] for r in csv.DictReader(f)}
+    for rows in _chunks(db.query(TopicMastery.user_id,TopicMastery.topic_name,TopicMastery.current_level)):
+        for u,t,lvl in rows:
+            if u not in users or lvl is None: continue
+            lvl=lvl.value; c=users[u]; levels[(c,t,lvl)]+=1; snapshot[(u,t)]=lvl
+            before=prev.get((u,t))
+            if before and before!=lvl: transitions[(c,t,before,lvl)]+=1
+
+    labs=defaultdict(lambda:{"sessions":0,"completed":0,"errors":0,"with_errors":0,"score":0.0})
+    for rows in _chunks(db.query(LabLog.user_id,LabLog.lab_type,LabLog.error_count,LabLog.completed_at,LabLog.score)):
+        for u,lt,errs,done,score in rows:
+            if u not in users: continue
+            a=labs[(users[u],lt)]; a["sessions"]+=1; a["errors"]+=errs or 0; a["with_errors"]+=bool(errs)
+            if done: a["completed"]+=1; a["score"]+=score or 0.0
+
+    by_cohort=defaultdict(list)
+    for i,c in enumerate(cohort_of_row): by_cohort[c].append(i)
+    bins=np.linspace(0.0,1.0,11); cohorts=[]; dist=[]
+    for c,ix in sorted(by_cohort.items()):
+        ix=np.asarray(ix); active=ix[att[ix]>0]; acc=cor[active]/att[active]
+        q=np.percentile(acc,[25,50,75]).round(3).tolist() if len(acc) else [0.0,0.0,0.0]
+        rec={"cohort":c,"users":len(ix),"active_users":len(active),"quiz_attempts":int(att[ix].sum()),
+             "accuracy":round(float(cor[ix].sum()/att[ix].sum()),3) if att[ix].sum() else 0.0,
+             "accuracy_p25":q[0],"accuracy_p50":q[1],"accuracy_p75":q[2]}
+        rec.update({f"readiness_{r}":round(float(ready[ix,j].mean()),1) for j,r in enumerate(BENCH_ROLES)})
+        cohorts.append(rec)
+        hist,_=np.histogram(acc,bins=bins)
+        dist+=[{"cohort":c,"bucket_lo":round(float(lo),1),"bucket_hi":round(float(hi),1),"users":int(n)} for lo,hi,n in zip(bins[:-1],bins[1:],hist)]
+
+    topics=[{"cohort":c,"topic":t,"attempts":n,"correct":int(topic_ok[(c,t)]),"accuracy":round(topic_ok[(c,t)]/n,3),"learners":len(learners[(c,t)]),
+             **{l:levels[(c,t,l)] for l in _LEVELS}} for (c,t),n in sorted(topic.items())]
+    lab_rows=[{"cohort":c,"lab_type":lt,"sessions":a["sessions"],"completed":a["completed"],"errors":a["errors"],
+               "error_rate":round(a["with_errors"]/a["sessions"],3),"mean_score":round(a["score"]/a["completed"],1) if a["completed"] else 0.0}
+              for (c,lt),a in sorted(labs.items())]
+    trans=[{"cohort":c,"topic":t,"from_level":a,"to_level":b,"users":n} for (c,t,a,b),n in sorted(transitions.items())]
+
+    # Write into a scratch dir and swap files in so readers never see a half-written report
+    os.makedirs(out_dir,exist_ok=True); tmp=tempfile.mkdtemp(dir=out_dir)
+    schema={"cohorts":list(cohorts[0]) if cohorts else ["cohort"],"accuracy_distribution":["cohort","bucket_lo","bucket_hi","users"],
+            "topics":["cohort","topic","attempts","correct","accuracy","learners",*_LEVELS],
+            "labs":["cohort","lab_type","sessions","completed","errors","error_rate","mean_score"],
+            "level_transitions":["cohort","topic","from_level","to_level","users"]}
+    for name,rows in zip(COHORT_TABLES,(cohorts,dist,topics,lab_rows,trans)): _write_table(tmp,name,rows,schema[name])
+    _write_table(tmp,"topic_levels",[{"user_id":u,"topic":t,"level":l} for (u,t),l in snapshot.items()],["user_id","topic","level"])
+    manifest={"generated_at":datetime.utcnow().isoformat(),"formats":["csv"]+(["parquet"] if _arrow()[0] else []),
+              "tables":{n:len(r) for n,r in zip(COHORT_TABLES,(cohorts,dist,topics,lab_rows,trans))}}
+    with open(os.path.join(tmp,"manifest.json"),"w") as f: json.dump(manifest,f)
+    for name in os.listdir(tmp): os.replace(os.path.join(tmp,name),os.path.join(out_dir,name))
+    os.rmdir(tmp)
+    return manifest
+
+def _num(x):
+    for cast in (int,float):
+        try: return cast(x)
+        except ValueError: pass
+    return x
+
+_cohort_cache:dict={}
+
+def load_cohort_report(out_dir=None):
+    out_dir=out_dir or COHORT_DIR; path=os.path.join(out_dir,"manifest.json")
+    if not os.path.exists(path): return None
+    key=(out_dir,os.path.getmtime(path))
+    if _cohort_cache.get("key")!=key:
+        with open(path) as f: report={"manifest":json.load(f)}
+        for name in COHORT_TABLES:
+            with open(os.path.join(out_dir,f"{name}.csv"),newline="") as f:
+                report[name]=[{k:_num(v) for k,v in r.items()} for r in csv.DictReader(f)]
+        _cohort_cache.update(key=key,report=report)
+    return _cohort_cache["report"]
+
+def run_cohort_report():
+    init_schema(); db=SessionLocal()
+    try: print(json.dumps(build_cohort_report(db),indent=2))
+    finally: db.close()
 
-def add_xp(db,user,pts):
-    user.xp_points+=pts
-    if user.xp_points>=600: user.level=DifficultyLevel.advanced
-    elif user.xp_points>=200: user.level=DifficultyLevel.intermediate
+# ── HISTORY ───────────────────────────────────────────────────────────────────
+# Column-level selects so the JSON/text blobs are only read when asked for.
+QUIZ_COLS = (QuizResult.id,QuizResult.topic,QuizResult.question_type,QuizResult.student_answer,QuizResult.correct_answer,
+             QuizResult.is_correct,QuizResult.score,QuizResult.attempted_at)
+QUIZ_FULL = QUIZ_COLS+(QuizResult.question_data,QuizResult.llm_explanation,QuizResult.question_ref,QuizResult.explanation_ref)
+LAB_COLS  = (LabLog.id,LabLog.session_id,LabLog.lab_type,LabLog.outcome,LabLog.score,LabLog.error_count,LabLog.started_at,LabLog.completed_at)
+LAB_FULL  = LAB_COLS+(LabLog.decision_chain,LabLog.chain_ref)
+
+def history_page(db,model,cols,uid,limit,before=None):
+    # Keyset pagination on (user_id, id): each page is one index range scan
+    q=select(*cols).where(model.user_id==uid)
+    if before: q=q.where(model.id<before)
+    rows=rehydrate(db,model,[dict(r) for r in db.execute(q.order_by(model.id.desc()).limit(limit+1)).mappings()])
+    return {"items":rows[:limit],"next_cursor":rows[limit-1]["id"] if len(rows)>limit else None}
+
+def recent_wrongs(db,uid,topic,n=3):
+    # Only the answer column: walks the (user_id, id) index without reading payloads
+    return list(db.scalars(select(QuizResult.correct_answer).where(QuizResult.user_id==uid,QuizResult.topic==topic,QuizResult.is_correct==False)
+                           .order_by(QuizResult.id.desc()).limit(n)))
+
+def stream_ndjson(model,cols,uid):
+    # Owns its session: the response outlives the request's get_db() scope
+    db=SessionLocal()
+    try:
+        q=select(*cols).where(model.user_id==uid).order_by(model.id).execution_options(yield_per=EXPORT_CHUNK)
+        for part in db.execute(q).mappings().partitions():
+            yield "".join(json_dumps(r)+"\n" for r in rehydrate(db,model,[dict(r) for r in part]))
+    finally: db.close()
+
+# ── ARCHIVE ───────────────────────────────────────────────────────────────────
+# Rows older than ARCHIVE_AFTER_DAYS keep their small columns (answers, scores,
+# timestamps) in place, so every aggregate still reads the same rows, but their
+# LLM payloads move to archived_blobs: zlib-compressed and stored once per
+# content hash, so a pooled question answered by many students is kept once.
+# History reads put the payloads back. Compaction is not scheduled in-process;
+# run it offline, e.g. from cron (python biotechpro1.py compact).
+ARCHIVE_FIELDS = {QuizResult: (("question_data","question_ref"),("llm_explanation","explanation_ref")),
+                  LabLog:     (("decision_chain","chain_ref"),)}
+
+def blob_key(value):
+    # Hash of the key-sorted form; the stored copy keeps the original key order
+    canon=json.dumps(value,sort_keys=True,separators=(",",":"),ensure_ascii=False).encode()
+    return hashlib.sha256(canon).hexdigest(),json.dumps(value,separators=(",",":"),ensure_ascii=False).encode()
+
+def load_blobs(db,hashes):
+    hashes=list({h for h in hashes if h}); out={}
+    for i in range(0,len(hashes),EXPORT_CHUNK):
+        for h,data in db.execute(select(ArchivedBlob.hash,ArchivedBlob.data).where(ArchivedBlob.hash.in_(hashes[i:i+EXPORT_CHUNK]))):
+            out[h]=json_loads(zlib.decompress(data))
+    return out
+
+def rehydrate(db,model,rows):
+    # rows are dicts from a *_FULL select: swap each archive ref for its payload
+    pairs=ARCHIVE_FIELDS[model]
+    if not rows or pairs[0][1] not in rows[0]: return rows
+    blobs=load_blobs(db,(r[ref] for r in rows for _,ref in pairs))
+    for r in rows:
+        for field,ref in pairs:
+            h=r.pop(ref)
+            if h: r[field]=blobs[h]
+    return rows
+
+def archive_rows(db,model,age,cutoff):
+    pairs=ARCHIVE_FIELDS[model]; cols=[getattr(model,f) for f,_ in pairs]; t=model.__table__
+    upd=t.update().where(t.c.id==bindparam("b_id")).values({f:null() for f,_ in pairs}|{ref:bindparam("b_"+ref) for _,ref in pairs})
+    st={"rows":0,"payloads":0,"payload_bytes":0,"new_blobs":0,"stored_bytes":0,"dedup_hits":0}; last=0
+    while True:
+        # SQL NULL once processed; rows written without a payload hold JSON null and are cleared too
+        batch=db.execute(select(model.id,*cols).where(model.id>last,age<cutoff,or_(*[c.isnot(None) for c in cols]))
+                         .order_by(model.id).limit(EXPORT_CHUNK)).all()
+        if not batch: return st
+        last=batch[-1][0]; fresh={}; params=[]
+        for row in batch:
+            p={"b_id":row[0]}
+            for (field,ref),value in zip(pairs,row[1:]):
+                p["b_"+ref]=None
+                if value is None: continue
+                h,raw=blob_key(value); p["b_"+ref]=h; fresh.setdefault(h,raw)
+                st["payloads"]+=1; st["payload_bytes"]+=len(raw)
+            params.append(p)
+        have=set(db.scalars(select(ArchivedBlob.hash).where(ArchivedBlob.hash.in_(list(fresh))))) if fresh else set()
+        new=[{"hash":h,"data":zlib.compress(raw,9),"size":len(raw),"created_at":datetime.utcnow()} for h,raw in fresh.items() if h not in have]
+        if new: db.execute(ArchivedBlob.__table__.insert(),new)
+        db.execute(upd,params); db.commit()
+        st["rows"]+=len(batch); st["new_blobs"]+=len(new); st["stored_bytes"]+=sum(len(b["data"]) for b in new)
+        st["dedup_hits"]=st["payloads"]-st["new_blobs"]
+
+def db_bytes(db):
+    dialect=get_engine().dialect.name
+    if dialect=="sqlite": return db.execute(text("PRAGMA page_count")).scalar()*db.execute(text("PRAGMA page_size")).scalar()
+    if dialect=="postgresql": return db.execute(text("SELECT pg_database_size(current_database())")).scalar()
+    return None
+
+def history_totals(db):
+    # Whatever compaction does, these must come out the same
+    q=db.execute(select(func.count(QuizResult.id),func.sum(QuizResult.score),func.sum(func.cast(QuizResult.is_correct,Integer)))).one()
+    l=db.execute(select(func.count(LabLog.id),func.sum(LabLog.score),func.sum(LabLog.error_count))).one()
+    return {"quiz_rows":q[0],"quiz_score":q[1],"quiz_correct":q[2],"lab_rows":l[0],"lab_score":l[1],"lab_errors":l[2]}
+
+def hot_probe(db,users=20,reps=3):
+    # ms per call of the hot read paths, best of reps; table scans widen as payloads fill pages
+    uids=list(db.scalars(select(User.id).order_by(User.id).limit(users)))
+    def best(fn):
+        times=[]
+        for _ in range(reps): t0=time.perf_counter(); fn(); times.append(time.perf_counter()-t0)
+        return round(min(times)*1000,2)
+    return {"topic_scan":best(lambda: db.execute(select(QuizResult.topic,func.count(QuizResult.id),func.avg(QuizResult.score)).group_by(QuizResult.topic)).all()),
+            "lab_scan":best(lambda: db.execute(select(LabLog.lab_type,func.avg(LabLog.score)).group_by(LabLog.lab_type)).all()),
+            "overall_accuracy":best(lambda: [overall_acc(db,u) for u in uids]),
+            "quiz_history_page":best(lambda: [history_page(db,QuizResult,QUIZ_COLS,u,HISTORY_PAGE_MAX) for u in uids]),
+            "recent_wrongs":best(lambda: [recent_wrongs(db,u,"PCR") for u in uids])}
+
+def compact_history(db,days=ARCHIVE_AFTER_DAYS):
+    cutoff=datetime.utcnow()-timedelta(days=days)
+    totals,size0,probe0=history_totals(db),db_bytes(db),hot_probe(db)
+    report={"cutoff":cutoff.isoformat(),
+            "quiz_results":archive_rows(db,QuizResult,QuizResult.attempted_at,cutoff),
+            "lab_logs":archive_rows(db,LabLog,func.coalesce(LabLog.completed_at,LabLog.started_at),cutoff)}
+    db.close()
+    # Emptied pages only go back to the filesystem (SQLite) or the free space map (PostgreSQL) after a vacuum
+    with get_engine().connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if conn.dialect.name=="sqlite": conn.exec_driver_sql("VACUUM"); conn.exec_driver_sql("ANALYZE")
+        elif conn.dialect.name=="postgresql": conn.exec_driver_sql("VACUUM ANALYZE quiz_results, lab_logs")
+    size1,probe1=db_bytes(db),hot_probe(db)
+    report.update(bytes_before=size0,bytes_after=size1,reclaimed_bytes=size0-size1 if size0 is not None else None,
+                  aggregates_unchanged=history_totals(db)==totals,probe_ms_before=probe0,probe_ms_after=probe1,
+                  speedup={k:round(probe0[k]/probe1[k],2) if probe1[k] else None for k in probe0})
+    return report
+
+def run_compact():
+    init_schema(); db=SessionLocal()
+    try: print(json.dumps(compact_history(db),indent=2))
+    finally: db.close()
+
+# ── LLM FAN-OUT ───────────────────────────────────────────────────────────────
+_llm_pool=ThreadPoolExecutor(LLM_FANOUT_WORKERS,thread_name_prefix="biomind-llm")
+
+def fan_out(fn,arg_lists):
+    # Each task gets its own context copy so prompt tags and trace spans follow it
+    futures=[_llm_pool.submit(copy_context().run,fn,*args) for args in arg_lists]
+    return [f.result() for f in futures]
+
+# ── SEMANTIC CACHE ────────────────────────────────────────────────────────────
+# Free-form tutor questions are embedded locally (signed feature hashing of
+# word unigrams/bigrams and character trigrams, no network) and matched by
+# cosine similarity against earlier answers for the same topic and level.
+_WORD = re.compile(r"[a-z0-9]+")
+
+def _features(text):
+    words=_WORD.findall(text.lower()); joined=" ".join(words)
+    yield from words
+    yield from (f"{a} {b}" for a,b in zip(words,words[1:]))
+    yield from (f"#{joined[i:i+3]}" for i in range(max(len(joined)-2,0)))
+
+def embed(text,dim=EMBED_DIM):
+    import numpy as np
+    v=np.zeros(dim,dtype=np.float32)
+    for f in _features(text):
+        h=zlib.crc32(f.encode()); v[h%dim]+=1.0 if h&0x80000000 else -1.0
+    v=np.sign(v)*np.sqrt(np.abs(v)); n=np.linalg.norm(v)   # damp repeats equally for either hash sign
+    return v/n if n else v
+
+class SemanticCache:
+    def __init__(self,dim=EMBED_DIM,threshold=SEMANTIC_THRESHOLD,capacity=SEMANTIC_SCOPE_CAPACITY):
+        self.dim=dim; self.threshold=threshold; self.capacity=capacity; self.scopes={}; self.lock=threading.Lock()
+
+    def lookup(self,scope,vec):
+        with self.lock:
+            sc=self.scopes.get(scope)
+            if not sc or not sc["n"]: return None
+            sims=sc["vecs"][:sc["n"]]@vec; i=int(sims.argmax())
+            return (sc["answers"][i],float(sims[i])) if sims[i]>=self.threshold else None
+
+    def add(self,scope,vec,answer):
+        import numpy as np
+        with self.lock:
+            sc=self.scopes.setdefault(scope,{"vecs":np.zeros((self.capacity,self.dim),dtype=np.float32),"answers":[None]*self.capacity,"n":0,"next":0})
+            i=sc["next"]; sc["vecs"][i]=vec; sc["answers"][i]=answer   # oldest entry is overwritten once full
+            sc["next"]=(i+1)%self.capacity; sc["n"]=min(sc["n"]+1,self.capacity)
+
+answer_cache=SemanticCache()
+
+# A question that points back at the conversation ("why is that?", "say it again") needs it;
+# anything else, the quick-action chips included, stands on its own within topic and level
+_FOLLOWUP = re.compile(r"\b(it|its|that|this|these|those|they|them|above|again|earlier|previous|more|you said|your answer)\b|^\W*(why|how|really)\W*$",re.I)
+
+def is_followup(question): return bool(_FOLLOWUP.search(question))
+
+def tutor_answer(topic,difficulty,question,context=""):
+    # Standalone questions are answered from a context-free prompt, so the answer can be shared
+    # through the cache; only genuine follow-ups see (and stay private to) the conversation
+    if context and is_followup(question):
+        SEMANTIC_LOOKUPS.inc(result="bypass"); return llm_answer(topic,difficulty,question,context)
+    scope=(topic.strip().lower(),difficulty); vec=embed(question)
+    hit=answer_cache.lookup(scope,vec)
+    if hit: SEMANTIC_LOOKUPS.inc(result="hit"); return hit[0]
+    SEMANTIC_LOOKUPS.inc(result="miss")
+    answer=llm_answer(topic,difficulty,question)
+    if answer: answer_cache.add(scope,vec,answer)
+    return answer
+
+# ── TUTOR MEMORY ──────────────────────────────────────────────────────────────
+# The last TUTOR_VERBATIM_TURNS messages go into the prompt word for word;
+# everything older is folded into a running summary by a background job, so
+# the context stays under CONTEXT_TOKEN_BUDGET however long the chat gets.
+def _turn_line(m): return f"{'Student' if m.role=='user' else 'Tutor'} [{m.topic}]: {clip_tokens(m.content,TURN_TOKEN_CAP)}"
+
+def build_context(db,uid,budget=CONTEXT_TOKEN_BUDGET):
+    summ=db.query(TutorSummary).filter(TutorSummary.user_id==uid).first(); after=summ.covered_until_id if summ else 0
+    recent=db.query(TutorMessage).filter(TutorMessage.user_id==uid,TutorMessage.id>after).order_by(TutorMessage.id.desc()).limit(TUTOR_VERBATIM_TURNS).all()
+    head=f"Summary of earlier conversation:\n{clip_tokens(summ.summary,SUMMARY_TOKEN_CAP)}" if summ and summ.summary else ""
+    used=estimate_tokens(head); lines=[]
+    for m in recent:   # newest first, so the budget drops the oldest turns
+        line=_turn_line(m); t=estimate_tokens(line)
+        if used+t>budget: break
+        lines.append(line); used+=t
+    if not lines and not head: return ""
+    return "\n\n".join(x for x in (head,"Recent conversation:\n"+"\n".join(reversed(lines)) if lines else "") if x)
+
+def record_turn(db,uid,topic,question,answer):
+    db.add_all([TutorMessage(user_id=uid,role="user",topic=topic,content=question,tokens=estimate_tokens(question)),
+                TutorMessage(user_id=uid,role="assistant",topic=topic,content=answer,tokens=estimate_tokens(answer))])
+    db.commit()
+    ids=[i for (i,) in db.query(TutorMessage.id).filter(TutorMessage.user_id==uid).order_by(TutorMessage.id.desc()).limit(TUTOR_VERBATIM_TURNS+1)]
+    if len(ids)>TUTOR_VERBATIM_TURNS:
+        # ids[-1] has just left the verbatim window; fold everything up to it
+        enqueue(db,"tutor_summary",{"user_id":uid,"until_id":ids[-1]},key=f"tutor_summary:{uid}:{ids[-1]}")
+
+# ── JOB QUEUE ─────────────────────────────────────────────────────────────────
+# Side effects the user does not wait for go through a persistent outbox
+# (job_outbox) drained by a thread pool, so they survive restarts and retry.
+JOB_HANDLERS:dict={}
+
+def job(kind):
+    def deco(fn): JOB_HANDLERS[kind]=fn; return fn
+    return deco
+
+def enqueue(db,kind,payload,key=None,commit=True):
+    # key makes the job idempotent: a second enqueue with the same key is dropped
+    if key and db.query(JobOutbox.id).filter(JobOutbox.idem_key==key).first():
+        jobs.stats["deduped"]+=1; return False
+    db.add(JobOutbox(kind=kind,payload=payload,idem_key=key,status="pending"))
+    if commit:
+        try: db.commit()
+        except IntegrityError: db.rollback(); jobs.stats["deduped"]+=1; return False
+    jobs.stats["enqueued"]+=1; jobs.wake.set(); return True
+
+class JobQueue:
+    def __init__(self,workers=JOB_WORKERS):
+        self.workers=workers; self.wake=threading.Event(); self.halt=threading.Event()
+        self.lock=threading.Lock(); self.inflight=0; self.stats=Counter(); self.pool=None; self.thread=None; self.last_purge=0.0
+
+    def recover(self):
+        db=SessionLocal()
+        try:  # jobs claimed by a process that died mid-run go back to pending
+            db.query(JobOutbox).filter(JobOutbox.status=="running").update({JobOutbox.status:"pending"},synchronize_session=False); db.commit()
+        finally: db.close()
+
+    def start(self,recover=True):
+        # With several workers only the launcher recovers, before forking; a worker doing it
+        # would requeue jobs its siblings are still running
+        if recover: self.recover()
+        self.halt.clear(); self.pool=ThreadPoolExecutor(self.workers,thread_name_prefix="biomind-job")
+        self.thread=threading.Thread(target=self._loop,name="biomind-jobs",daemon=True); self.thread.start()
+
+    def stop(self,timeout=30.0):
+        if not self.thread: return
+        self.halt.set(); self.wake.set(); self.thread.join(timeout); self.pool.shutdown(wait=True); self.thread=None
+
+    def _loop(self):
+        while not self.halt.is_set():
+            with self.lock: free=self.workers-self.inflight
+            claimed=self._claim(free) if free>0 else []
+            for jid in claimed: self.pool.submit(self._run,jid)
+            if time.monotonic()-self.last_purge>3600: self._purge()
+            if not claimed: self.wake.wait(JOB_POLL_SECS); self.wake.clear()
+
+    def _claim(self,n):
+        db=SessionLocal(); out=[]
+        try:
+            ids=[i for (i,) in db.query(JobOutbox.id).filter(JobOutbox.status=="pending",JobOutbox.run_after<=datetime.utcnow()).order_by(JobOutbox.id).limit(n)]
+            for i in ids:
+                if db.query(JobOutbox).filter(JobOutbox.id==i,JobOutbox.status=="pending").update({JobOutbox.status:"running",JobOutbox.attempts:JobOutbox.attempts+1},synchronize_session=False):
+                    out.append(i)
+            db.commit()
+        except Exception as e: db.rollback(); print(f"[job queue] claim failed: {e}")
+        finally: db.close()
+        with self.lock: self.inflight+=len(out)
+        return out
+
+    def _run(self,jid):
+        db=SessionLocal()
+        try:
+            j=db.get(JobOutbox,jid)
+            try:
+                JOB_HANDLERS[j.kind](db,j.payload or {})
+                j.status="done"; j.finished_at=datetime.utcnow(); db.commit(); self.stats["done"]+=1
+            except Exception as e:
+                db.rollback(); j=db.get(JobOutbox,jid); j.last_error=str(e)[:500]
+                if j.attempts>=JOB_MAX_ATTEMPTS: j.status="failed"; j.finished_at=datetime.utcnow(); self.stats["failed"]+=1
+                else: j.status="pending"; j.run_after=datetime.utcnow()+timedelta(seconds=JOB_BACKOFF_SECS*2**(j.attempts-1)); self.stats["retried"]+=1
+                db.commit(); print(f"[job {j.kind}#{jid}] {e}")
+        finally:
+            db.close()
+            with self.lock: self.inflight-=1
+            self.wake.set()
+
+    def _purge(self):
+        self.last_purge=time.monotonic(); db=SessionLocal()
+        try:
+            db.query(JobOutbox).filter(JobOutbox.status=="done",JobOutbox.finished_at<datetime.utcnow()-timedelta(hours=JOB_RETENTION_HOURS)).delete(synchronize_session=False)
+            db.query(PendingQuestion).filter(PendingQuestion.created_at<datetime.utcnow()-timedelta(hours=PENDING_QUESTION_HOURS)).delete(synchronize_session=False); db.commit()
+        finally: db.close()
+
+    def metrics(self,db):
+        depth={k:n for k,n in db.query(JobOutbox.kind,func.count(JobOutbox.id)).filter(JobOutbox.status=="pending").group_by(JobOutbox.kind)}
+        by_status={st:n for st,n in db.query(JobOutbox.status,func.count(JobOutbox.id)).group_by(JobOutbox.status)}
+        with self.lock: inflight=self.inflight
+        return {"queue_depth":sum(depth.values()),"depth_by_kind":depth,"by_status":by_status,"inflight":inflight,"workers":self.workers,"counters":dict(self.stats)}
+
+jobs=JobQueue()
+
+def tips_snapshot(db,uid): return db.get(TipsSnapshot,uid)
+
+def refresh_tips(db,uid):
+    weak=sorted(weak_topics(db,uid)); snap=tips_snapshot(db,uid)
+    if snap and snap.weak==weak: return snap.tips
+    level=db.query(User.level).filter(User.id==uid).scalar()
+    tips=llm_tips(weak,level.value) if weak else []
+    if not snap: snap=TipsSnapshot(user_id=uid); db.add(snap)
+    snap.weak=weak; snap.tips=tips; snap.updated_at=datetime.utcnow()
+    try: db.commit()
+    except IntegrityError: db.rollback()   # another worker stored this user's first snapshot meanwhile
+    return tips
+
+def _bank(db,topic,diff,qtype):
+    return db.query(BankedQuestion).filter(BankedQuestion.topic==topic,BankedQuestion.difficulty==diff,BankedQuestion.qtype==qtype)
+
+def bank_depth(db,topic,diff,qtype): return _bank(db,topic,diff,qtype).count()
+
+def bank_pop(db,topic,diff,qtype):
+    for _ in range(3):
+        row=_bank(db,topic,diff,qtype).with_entities(BankedQuestion.id,BankedQuestion.data).order_by(BankedQuestion.id).first()
+        if not row: return None
+        # Two workers can read the same head row; only the one whose delete lands serves it
+        if db.query(BankedQuestion).filter(BankedQuestion.id==row.id).delete(synchronize_session=False):
+            db.commit(); return row.data
+        db.rollback()
+    return None
+
+@job("xp")
+def _job_xp(db,p): add_xp(db,p["user_id"],p["pts"])
+
+@job("analytics_refresh")
+def _job_analytics_refresh(db,p): refresh_tips(db,p["user_id"])
+
+@job("bank_refill")
+def _job_bank_refill(db,p):
+    key=(p["topic"],p["difficulty"],p["qtype"]); have=bank_depth(db,*key)
+    if not have and db.query(BankedQuestion.topic,BankedQuestion.difficulty,BankedQuestion.qtype).distinct().count()>=QUESTION_BANK_KEYS: return
+    for _ in range(QUESTION_BANK_DEPTH-have):
+        data=llm_quiz(p["topic"],p["difficulty"],p["qtype"],[])
+        if not data.get("question"): raise RuntimeError("empty question from LLM")
+        db.add(BankedQuestion(topic=p["topic"],difficulty=p["difficulty"],qtype=p["qtype"],data=data)); db.commit()
+
+@job("tutor_summary")
+def _job_tutor_summary(db,p):
+    summ=db.query(TutorSummary).filter(TutorSummary.user_id==p["user_id"]).first()
+    if not summ: summ=TutorSummary(user_id=p["user_id"],summary="",covered_until_id=0); db.add(summ)
+    if (summ.covered_until_id or 0)>=p["until_id"]: return
+    msgs=db.query(TutorMessage).filter(TutorMessage.user_id==p["user_id"],TutorMessage.id>(summ.covered_until_id or 0),TutorMessage.id<=p["until_id"]).order_by(TutorMessage.id).all()
+    if msgs:
+        summ.summary=clip_tokens(llm_summarize(summ.summary,"\n".join(_turn_line(m) for m in msgs)).strip(),SUMMARY_TOKEN_CAP)
+        summ.covered_until_id=msgs[-1].id; summ.updated_at=datetime.utcnow()
     db.commit()
 
+@job("learning_path")
+def _job_learning_path(db,p):
+    inputs=path_inputs(db,p["user_id"]); fp=path_fingerprint(inputs)
+    if stored_path(db,fp) or generate_path(db,fp,inputs): point_user_path(db,p["user_id"],fp)
+    else: raise RuntimeError("empty learning path from LLM")
+
+def save_career_goal(db,p):
+    goal=db.query(CareerGoal).filter(CareerGoal.user_id==p["user_id"]).first()
+    if not goal: goal=CareerGoal(user_id=p["user_id"],target_role=BiotechRole(p["target_role"])); db.add(goal)
+    goal.target_role=BiotechRole(p["target_role"]); goal.industry_skills=p["industry_skills"]; goal.roadmap=p["roadmap"]
+    goal.mini_projects=p["mini_projects"]; goal.certifications=p["certifications"]; goal.readiness_score=p["readiness_score"]
+    goal.skill_snapshot=p.get("skill_snapshot"); goal.generated_at=datetime.utcnow(); db.commit()
+    return goal
+
+@job("career_goal")
+def _job_career_goal(db,p): save_career_goal(db,p)
+
+def career_profile(db,uid):
+    # What llm_career sees: SkillScore values and per-topic accuracy
+    topic_acc={t["topic"]:t["accuracy"] for t in get_breakdown(db,uid)}
+    skill_data={n:sc for n,sc in db.query(SkillScore.skill_name,SkillScore.score).filter(SkillScore.user_id==uid)}
+    return skill_data,topic_acc
+
+def profile_snapshot(skill_data,topic_acc):
+    return {**{f"topic:{k}":round(v*100,1) for k,v in topic_acc.items()},**{f"skill:{k}":float(v or 0) for k,v in skill_data.items()}}
+
+def profile_distance(a,b):
+    import numpy as np
+    a=a or {}; b=b or {}
+    return float(np.sqrt(sum((a.get(k,0.0)-b.get(k,0.0))**2 for k in a.keys()|b.keys())))
+
 # ── SESSION STORES ─────────────────────────────────────────────────────────────
-_pending:dict={}
-_labs:dict={}
+# Quiz questions awaiting an answer and running labs live in the database, so any
+# worker process can grade a submit or continue a lab another one started.
+def hold_questions(db,uid,topic,items):
+    rows=[PendingQuestion(user_id=uid,topic=topic,qtype=qtype,data=data) for qtype,data in items]
+    db.add_all(rows); db.commit(); return [r.id for r in rows]
+
+def claim_question(db,uid,qid):
+    row=db.query(PendingQuestion).with_entities(PendingQuestion.topic,PendingQuestion.qtype,PendingQuestion.data).filter(PendingQuestion.id==qid,PendingQuestion.user_id==uid).first()
+    if not row: return None
+    # A double submit can race to here; only the request whose delete lands grades the answer
+    if not db.query(PendingQuestion).filter(PendingQuestion.id==qid).delete(synchronize_session=False):
+        db.rollback(); return None
+    db.commit(); return {"topic":row.topic,"type":row.qtype,"data":row.data}
+
+def lab_state(db,sid,uid):
+    # A lab is live while its LabLog row is incomplete; the step follows from the chain so far
+    log=db.query(LabLog).filter(LabLog.session_id==sid,LabLog.user_id==uid,LabLog.outcome=="incomplete").first()
+    if not log: return None
+    chain=list(log.decision_chain or [])
+    return {"lab_type":log.lab_type,"user_id":uid,"step":len(chain)+1,"decision_chain":chain,"error_count":log.error_count or 0}
+
+# ── CLASS PROVISIONING ────────────────────────────────────────────────────────
+# An instructor uploads a whole class at once (CSV with a header row, or JSON).
+# Only accounts in BIOMIND_ADMIN_EMAILS may import, each within an hourly row quota.
+# Each row is validated on its own, existing emails are found with one IN query,
+# passwords are hashed in parallel and the new users go in as one executemany.
+# Rows without a password get a generated one, returned only in this response.
+_roster_usage:dict={}; _roster_lock=threading.Lock()
+
+def charge_roster(uid,rows,now=None):
+    # Sliding hour of rows (each one a bcrypt hash) per caller; returns seconds to wait, 0 if admitted
+    now=now or time.monotonic()
+    with _roster_lock:
+        spent=[(t,n) for t,n in _roster_usage.get(uid,[]) if now-t<3600]
+        used=sum(n for _,n in spent)
+        if used+rows>ROSTER_HASHES_PER_HOUR:
+            _roster_usage[uid]=spent; return int(3600-(now-spent[0][0]))+1 if spent else 3600
+        _roster_usage[uid]=spent+[(now,rows)]; return 0
+
+def parse_roster(body,content_type):
+    if "csv" in content_type:
+        reader=csv.DictReader(body.decode("utf-8-sig").splitlines())
+        return [{(k or "").strip().lower():(v or "").strip() or None for k,v in r.items()} for r in reader]
+    data=json_loads(body)
+    rows=data.get("students") if isinstance(data,dict) else data
+    if not isinstance(rows,list): raise ValueError('expected a list of students or {"students": [...]}')
+    return rows
+
+def provision_roster(db,rows,institution=None):
+    results=[]; entries=[]; seen=set()
+    for i,raw in enumerate(rows,1):
+        try: e=RosterEntry.model_validate({k:v for k,v in raw.items() if v is not None} if isinstance(raw,dict) else raw)
+        except ValidationError as err:
+            results.append(RosterRowResult(row=i,email=raw.get("email") if isinstance(raw,dict) else None,status="invalid",
+                                           error="; ".join(f"{'.'.join(map(str,x['loc'])) or 'row'}: {x['msg']}" for x in err.errors()))); continue
+        if e.email in seen: results.append(RosterRowResult(row=i,email=e.email,status="invalid",error="duplicate email in roster")); continue
+        seen.add(e.email); entries.append((i,e))
+    emails=[e.email for _,e in entries]; existing=set()
+    for k in range(0,len(emails),EXPORT_CHUNK):
+        existing.update(db.scalars(select(User.email).where(User.email.in_(emails[k:k+EXPORT_CHUNK]))))
+    for _ in range(2):
+        todo=[(i,e) for i,e in entries if e.email not in existing]
+        generated={i:secrets.token_urlsafe(9) for i,e in todo if not e.password}
+        with span("auth.hash_passwords",**{"auth.rows":len(todo)}):
+            hashes=hash_passwords([e.password or generated[i] for i,e in todo])
+        params=[{"name":e.name,"email":e.email,"hashed_pw":h,"institution":e.institution or institution,"level":e.level}
+                for (i,e),h in zip(todo,hashes)]
+        try:
+            ids=list(db.scalars(insert(User).returning(User.id,sort_by_parameter_order=True),params)) if params else []
+            db.commit(); break
+        except IntegrityError:
+            # someone registered one of these emails since the check; find them and insert the rest
+            db.rollback()
+            existing.update(db.scalars(select(User.email).where(User.email.in_([e.email for _,e in todo]))))
+    else: raise HTTPException(409,"Roster conflicts with concurrent registrations, please retry")
+    results+=[RosterRowResult(row=i,email=e.email,status="existing",error="Email already registered") for i,e in entries if e.email in existing]
+    results+=[RosterRowResult(row=i,email=e.email,status="created",id=uid,password=generated.get(i)) for (i,e),uid in zip(todo,ids)]
+    results.sort(key=lambda r:r.row)
+    count=Counter(r.status for r in results)
+    return RosterResponse(created=count["created"],existing=count["existing"],invalid=count["invalid"],rows=results)
+
+# ── ADMISSION CONTROL ─────────────────────────────────────────────────────────
+# LLM-backed routes take a slot before running: at most `global` at once and
+# `per_user` per student, with a bounded FIFO for the rest. Waiting happens on
+# the event loop, so queued requests hold no threadpool thread. An identical
+# request (same user, route and body) replaces a queued one and is refused
+# while one is already running. Limits are re-read from ADMISSION_FILE.
+class Shed(Exception):
+    def __init__(self,status_code,reason,detail,retry_after):
+        self.status_code=status_code; self.reason=reason; self.detail=detail; self.retry_after=retry_after
+
+class AdmissionController:
+    def __init__(self):
+        self.limits=dict(ADMISSION_DEFAULTS); self.active=0; self.user_active=Counter(); self.user_waiting=Counter()
+        self.waiters=deque(); self.keys={}; self.service=1.0; self.mtime=None; self.checked=0.0
+
+    def reload(self):
+        now=time.monotonic()
+        if now-self.checked<1.0: return
+        self.checked=now
+        try: mtime=os.path.getmtime(ADMISSION_FILE)
+        except OSError: mtime=None
+        if mtime==self.mtime: return
+        self.mtime=mtime; limits=dict(ADMISSION_DEFAULTS)
+        if mtime is not None:
+            try:
+                with open(ADMISSION_FILE) as f: limits.update({k:type(ADMISSION_DEFAULTS[k])(v) for k,v in json_loads(f.read()).items() if k in ADMISSION_DEFAULTS})
+            except (ValueError,TypeError) as e: print(f"[admission] ignoring {ADMISSION_FILE}: {e}"); return
+        self.limits=limits; self._dispatch()
+
+    def retry_after(self):
+        # Rough time for the queue ahead to drain at the current service rate
+        return max(1,round(self.service*(len(self.waiters)+1)/max(self.limits["global"],1)))
+
+    def _can_run(self,uid): return self.active<self.limits["global"] and self.user_active[uid]<self.limits["per_user"]
+
+    def _start(self,uid):
+        self.active+=1; self.user_active[uid]+=1; ADMISSION_ACTIVE.set(self.active)
+
+    def _unqueue(self,w):
+        self.waiters.remove(w); self.user_waiting[w[0]]-=1; ADMISSION_QUEUE.set(len(self.waiters))
+
+    def _dispatch(self):
+        for w in list(self.waiters):
+            if self.active>=self.limits["global"]: break
+            if self.user_active[w[0]]<self.limits["per_user"]:
+                self._unqueue(w); self._start(w[0]); w[2].set_result(True)
+
+    def _drop(self,w):
+        if w in self.waiters: self._unqueue(w)
+        if self.keys.get(w[1]) is w: del self.keys[w[1]]
+
+    async def acquire(self,uid,key):
+        self.reload(); old=self.keys.get(key)
+        if old is not None:
+            if old[2].done(): raise Shed(409,"duplicate","An identical request is already running",self.retry_after())
+            self._drop(old); old[2].set_exception(Shed(409,"superseded","Replaced by a newer identical request",0))
+        if not self.waiters and self._can_run(uid):
+            self._start(uid); fut=asyncio.get_running_loop().create_future(); fut.set_result(True)
+            self.keys[key]=(uid,key,fut); return
+        if self.user_waiting[uid]>=self.limits["user_queue"]: raise Shed(429,"user_queue","Too many requests in flight; slow down",self.retry_after())
+        if len(self.waiters)>=self.limits["queue"]: raise Shed(503,"queue_full","Server busy; try again shortly",self.retry_after())
+        w=(uid,key,asyncio.get_running_loop().create_future()); self.waiters.append(w); self.keys[key]=w; self.user_waiting[uid]+=1
+        ADMISSION_QUEUE.set(len(self.waiters))
+        try: await asyncio.wait_for(asyncio.shield(w[2]),self.limits["queue_timeout"])
+        except asyncio.TimeoutError:
+            if not (w[2].done() and not w[2].exception()):   # admitted just as the timer fired: keep the slot
+                self._drop(w); raise Shed(503,"timeout","Server busy; try again shortly",self.retry_after())
+        except asyncio.CancelledError:
+            if w[2].done() and not w[2].exception(): self.release(uid,key)
+            else: self._drop(w)
+            raise
+
+    def release(self,uid,key,elapsed=None):
+        self.active-=1; self.user_active[uid]-=1; ADMISSION_ACTIVE.set(self.active)
+        if elapsed is not None: self.service=0.9*self.service+0.1*elapsed
+        if key in self.keys and self.keys[key][2].done(): del self.keys[key]
+        self._dispatch()
+
+    def status(self):
+        self.reload()
+        return {"limits":self.limits,"active":self.active,"queued":len(self.waiters),"service_secs":round(self.service,3)}
+
+admission=AdmissionController()
+
+async def admit_llm(request:Request,u:User=Depends(get_current_user)):
+    route=request.url.path; key=(u.id,route,hashlib.sha1(await request.body()+request.url.query.encode()).hexdigest()); t0=time.perf_counter()
+    try: await admission.acquire(u.id,key)
+    except Shed as e:
+        ADMISSION_SHED.inc(route=route,reason=e.reason)
+        raise HTTPException(e.status_code,e.detail,headers={"Retry-After":str(e.retry_after)} if e.retry_after else None)
+    t1=time.perf_counter(); ADMISSION_WAIT.observe(t1-t0,route=route)
+    try: yield
+    finally: admission.release(u.id,key,time.perf_counter()-t1)
+
+LLM_ROUTE=[Depends(admit_llm)]
 
 # ── FASTAPI APP ────────────────────────────────────────────────────────────────
-@asynccontextmanager
-async def lifespan(app:FastAPI):
-    Base.metadata.create_all(bind=engine); yield
+def add_missing_columns():
+    # create_all never alters existing tables; add columns introduced since with their defaults.
+    # Returns the (table, column) pairs added so callers can backfill derived values.
+    engine=get_engine(); insp=inspect(engine); added=set()
+    for t in Base.metadata.sorted_tables:
+        if not insp.has_table(t.name): continue
+        have={c["name"] for c in insp.get_columns(t.name)}
+        for col in t.columns:
+            if col.name in have: continue
+            default=col.default.arg if col.default is not None and col.default.is_scalar else None
+            with engine.begin() as conn:
+                conn.execute(text(f"ALTER TABLE {t.name} ADD COLUMN {col.name} {col.type.compile(engine.dialect)}"+(f" DEFAULT {default!r}" if default is not None else "")))
+            added.add((t.name,col.name))
+    return added
+
+def create_indexes():
+    # create_all skips tables that already exist, so add new indexes explicitly
+    for t in Base.metadata.sorted_tables:
+        for ix in t.indexes: ix.create(bind=get_engine(),checkfirst=True)
+
+def schema_fingerprint():
+    parts=sorted(f"{t.name}.{c.name}:{c.type}" for t in Base.metadata.sorted_tables for c in t.columns)
+    parts+=sorted(f"{t.name}#{ix.name}" for t in Base.metadata.sorted_tables for ix in t.indexes)
+    return hashlib.sha1("\n".join(parts).encode()).hexdigest()
+
+def init_schema():
+    # create_all plus column/index reflection is dozens of round trips; skip it when the
+    # stored fingerprint says the database already matches these models
+    engine=get_engine(); fp=schema_fingerprint()
+    SchemaMeta.__table__.create(bind=engine,checkfirst=True)
+    db=SessionLocal()
+    try:
+        row=db.get(SchemaMeta,"schema")
+        if row and row.value==fp: return False
+        Base.metadata.create_all(bind=engine); added=add_missing_columns(); create_indexes()
+        if ("topic_mastery","p_known") in added: backfill_p_known(db)
+        db.merge(SchemaMeta(key="schema",value=fp)); db.commit(); return True
+    finally: db.close()
 
-app=FastAPI(title="BioMind AI",lifespan=lifespan)
-app.add_middleware(CORSMiddleware,allow_origins=["*"],allow_methods=["*"],allow_headers=["*"])
+_draining=threading.Event()   # set on SIGTERM; /readyz fails so balancers stop routing here
+_preforked=False              # the launcher already ran init_schema and job recovery
 
-@app.get("/",response_class=HTMLResponse)
+@asynccontextmanager
+async def lifespan(app:FastAPI):
+    if not _preforked: init_schema()
+    jobs.start(recover=not _preforked); tracer.start(); due_queue.start()
+    yield
+    due_queue.stop(); jobs.stop(); tracer.stop()
+
+class RouteTable:
+    # Routes are recorded at import and only turned into FastAPI routes (which builds
+    # their dependency/validation models) when create_app() assembles an app
+    def __init__(self): self.routes=[]
+    def _add(self,method,path,**kw):
+        def deco(fn): self.routes.append((method,path,fn,kw)); return fn
+        return deco
+    def get(self,path,**kw): return self._add("GET",path,**kw)
+    def post(self,path,**kw): return self._add("POST",path,**kw)
+    def delete(self,path,**kw): return self._add("DELETE",path,**kw)
+    def websocket(self,path,**kw): return self._add("WS",path,**kw)
+
+api=RouteTable()
+
+def create_app():
+    from fastapi.routing import serialize_response
+    # Newer FastAPI writes response_model routes straight to JSON bytes from pydantic, but only
+    # with the default response class; those keep it and everything else renders through json_bytes
+    native="dump_json" in serialize_response.__code__.co_varnames
+    app=FastAPI(title="BioMind AI",lifespan=lifespan)
+    app.add_middleware(CORSMiddleware,allow_origins=["*"],allow_methods=["*"],allow_headers=["*"])
+    app.middleware("http")(instrument)
+    for method,path,fn,kw in api.routes:
+        if method=="WS": app.add_api_websocket_route(path,fn,**kw); continue
+        if "response_class" not in kw and not (native and "response_model" in kw): kw={**kw,"response_class":FastJSONResponse}
+        app.add_api_route(path,fn,methods=[method],**kw)
+    return app
+
+def __getattr__(name):
+    # `biotechpro1:app` keeps working; the app is assembled the first time something asks for it
+    if name=="app":
+        app=globals()["app"]=create_app(); return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+async def instrument(request:Request,call_next):
+    st={"queries":0,"db_time":0.0}; tok=_req_stats.set(st); HTTP_INFLIGHT.inc(); t0=time.perf_counter(); code=500
+    tr=Trace(); root=os.urandom(8).hex(); ttok=_trace.set((tr,root)); start_ns=time.time_ns()
+    try:
+        resp=await call_next(request); code=resp.status_code; return resp
+    finally:
+        route=getattr(request.scope.get("route"),"path","unmatched"); HTTP_INFLIGHT.inc(-1); _req_stats.reset(tok); _trace.reset(ttok)
+        dt=time.perf_counter()-t0
+        HTTP_REQUESTS.inc(method=request.method,route=route,status=code)
+        HTTP_LATENCY.observe(dt,method=request.method,route=route)
+        REQ_DB_QUERIES.observe(st["queries"],route=route); REQ_DB_TIME.observe(st["db_time"],route=route)
+        tr.add(f"{request.method} {route}",root,None,start_ns,time.time_ns(),
+               {"http.method":request.method,"http.route":route,"http.status_code":code,"db.queries":st["queries"],"db.time_ms":round(st["db_time"]*1000,2)},
+               f"HTTP {code}" if code>=500 else None)
+        tracer.finish(tr,dt*1000,failed=code>=500)
+
+@api.get("/",response_class=HTMLResponse)
 def serve_frontend(): return HTMLResponse(content=FRONTEND_HTML)
 
-@app.post("/auth/register",response_model=UserResponse,status_code=201)
+@api.post("/auth/register",response_model=UserResponse,status_code=201)
 def register(p:UserRegister,db:Session=Depends(get_db)):
     if db.query(User).filter(User.email==p.email).first(): raise HTTPException(400,"Email already registered")
     u=User(name=p.name,email=p.email,hashed_pw=hash_password(p.password),institution=p.institution,level=p.level)
     db.add(u); db.commit(); db.refresh(u); return u
 
-@app.post("/auth/login",response_model=TokenResponse)
+@api.post("/auth/roster",response_model=RosterResponse)
+async def import_roster(request:Request,db:Session=Depends(get_db),u:User=Depends(get_admin_user)):
+    body=await request.body()
+    try: rows=parse_roster(body,request.headers.get("content-type",""))
+    except (ValueError,UnicodeDecodeError,csv.Error) as e: raise HTTPException(400,f"Unreadable roster: {e}")
+    if len(rows)>ROSTER_MAX_ROWS: raise HTTPException(413,f"At most {ROSTER_MAX_ROWS} students per roster")
+    if wait:=charge_roster(u.id,len(rows)):
+        raise HTTPException(429,f"Roster quota of {ROSTER_HASHES_PER_HOUR} students per hour used up",headers={"Retry-After":str(wait)})
+    return await run_in_threadpool(provision_roster,db,rows,u.institution)
+
+@api.post("/auth/login",response_model=TokenResponse)
 def login(form:OAuth2PasswordRequestForm=Depends(),db:Session=Depends(get_db)):
     u=db.query(User).filter(User.email==form.username).first()
     if not u or not verify_password(form.password,u.hashed_pw): raise HTTPException(401,"Invalid credentials")
     return {"access_token":create_access_token({"sub":str(u.id)}),"token_type":"bearer"}
 
-@app.get("/auth/me",response_model=UserResponse)
+@api.get("/auth/me",response_model=UserResponse)
 def me(u:User=Depends(get_current_user)): return u
 
-@app.post("/learn/generate-lesson",response_model=LessonResponse)
+@api.post("/learn/generate-lesson",response_model=LessonResponse,dependencies=LLM_ROUTE)
 def generate_lesson(p:LessonRequest,db:Session=Depends(get_db),u:User=Depends(get_current_user)):
     diff=p.difficulty.value if p.difficulty else u.level.value
+    if p.query and p.query.strip():
+        question=p.query.strip(); answer=tutor_answer(p.topic,diff,question,build_context(db,u.id))
+        record_turn(db,u.id,p.topic,question,answer)
+        enqueue(db,"xp",{"user_id":u.id,"pts":10})
+        return LessonResponse(topic=p.topic,difficulty=diff,content=answer,summary="",real_example="")
     data=llm_lesson(p.topic,diff,u.name,weak_topics(db,u.id))
-    add_xp(db,u,10)
+    if data.get("content"): record_turn(db,u.id,p.topic,f"Generate lesson: {p.topic} ({diff})",f"{data['content']}\n\n{data.get('summary','')}")
+    enqueue(db,"xp",{"user_id":u.id,"pts":10})
     return LessonResponse(topic=p.topic,difficulty=diff,content=data.get("content",""),summary=data.get("summary",""),real_example=data.get("real_example",""))
 
-@app.post("/quiz/generate",response_model=QuizQuestion)
+@api.get("/learn/conversation",response_model=List[TutorMessageOut])
+def conversation(limit:int=Query(50,ge=1,le=HISTORY_PAGE_MAX),db:Session=Depends(get_db),u:User=Depends(get_current_user)):
+    return db.query(TutorMessage).filter(TutorMessage.user_id==u.id).order_by(TutorMessage.id.desc()).limit(limit).all()[::-1]
+
+@api.delete("/learn/conversation",status_code=204)
+def clear_conversation(db:Session=Depends(get_db),u:User=Depends(get_current_user)):
+    db.query(TutorMessage).filter(TutorMessage.user_id==u.id).delete(synchronize_session=False)
+    db.query(TutorSummary).filter(TutorSummary.user_id==u.id).delete(synchronize_session=False); db.commit()
+
+@api.post("/quiz/generate",response_model=QuizQuestion,dependencies=LLM_ROUTE)
 def generate_quiz(p:QuizRequest,db:Session=Depends(get_db),u:User=Depends(get_current_user)):
-    qid=next(_qid_counter); diff=p.difficulty.value if p.difficulty else u.level.value
-    wrongs=[r.correct_answer for r in db.query(QuizResult).filter(QuizResult.user_id==u.id,QuizResult.topic==p.topic,QuizResult.is_correct==False).order_by(QuizResult.attempted_at.desc()).limit(3).all()]
-    data=llm_quiz(p.topic,diff,p.question_type.value,wrongs)
-    _pending[qid]={"topic":p.topic,"type":p.question_type.value,"data":data}
+    lvl=None if p.difficulty else topic_level(db,u.id,p.topic)
+    diff=p.difficulty.value if p.difficulty else (lvl or u.level).value
+    wrongs=recent_wrongs(db,u.id,p.topic)
+    # Without recent mistakes the prompt is user-independent, so a pre-generated question fits
+    data=None if wrongs else bank_pop(db,p.topic,diff,p.question_type.value)
+    if data is None: data=llm_quiz(p.topic,diff,p.question_type.value,wrongs)
+    if not wrongs and bank_depth(db,p.topic,diff,p.question_type.value)<QUESTION_BANK_DEPTH:
+        # Done jobs keep their key for JOB_RETENTION_HOURS, so the key carries a time window
+        window=int(time.time()//QUESTION_BANK_REFILL)
+        enqueue(db,"bank_refill",{"topic":p.topic,"difficulty":diff,"qtype":p.question_type.value},
+                key=f"bank_refill:{p.topic}:{diff}:{p.question_type.value}:{window}")
+    qid,=hold_questions(db,u.id,p.topic,[(p.question_type.value,data)])
     return QuizQuestion(question_id=qid,topic=p.topic,type=p.question_type.value,question=data.get("question",""),options=data.get("options"),scenario=data.get("scenario"))
 
-@app.post("/quiz/submit",response_model=QuizFeedback)
+@api.post("/quiz/session",response_model=QuizSession,dependencies=LLM_ROUTE)
+def quiz_session(p:QuizSessionRequest,db:Session=Depends(get_db),u:User=Depends(get_current_user)):
+    diff=p.difficulty.value if p.difficulty else (topic_level(db,u.id,p.topic) or u.level).value
+    types=[t.value for t in (p.question_types or list(QuestionType))]
+    slots=[types[i%len(types)] for i in range(p.count)]
+    wrongs=recent_wrongs(db,u.id,p.topic)
+    chunks=[slots[i:i+QUIZ_SESSION_CHUNK] for i in range(0,len(slots),QUIZ_SESSION_CHUNK)]
+    generated=[q for qs in fan_out(llm_quiz_set,[(p.topic,diff,c,wrongs) for c in chunks]) for q in qs if valid_question(q)]
+    if not generated: raise HTTPException(502,"Could not generate questions, please retry")
+    out=[]; generated=generated[:p.count]
+    for qid,data in zip(hold_questions(db,u.id,p.topic,[(d["type"],d) for d in generated]),generated):
+        out.append(QuizQuestion(question_id=qid,topic=p.topic,type=data["type"],question=data["question"],options=data.get("options"),scenario=data.get("scenario")))
+    return QuizSession(topic=p.topic,difficulty=diff,questions=out)
+
+@api.post("/quiz/submit",response_model=QuizFeedback,dependencies=LLM_ROUTE)
 def submit_quiz(p:QuizSubmit,db:Session=Depends(get_db),u:User=Depends(get_current_user)):
-    pending=_pending.pop(p.question_id,None)
+    pending=claim_question(db,u.id,p.question_id)
     if not pending: raise HTTPException(404,"Question not found")
     q=pending["data"]; topic=pending["topic"]
     raw=q.get("answer_index",q.get("sample_answer",""))
@@ -1129,48 +3165,176 @@ def submit_quiz(p:QuizSubmit,db:Session=Depends(get_db),u:User=Depends(get_curre
     r=QuizResult(user_id=u.id,topic=topic,question_type=pending["type"],question_data=q,student_answer=student,correct_answer=correct,is_correct=is_correct,score=1.0 if is_correct else 0.0,llm_explanation=explanation)
     db.add(r); db.commit()
     update_mastery(db,u.id,topic,is_correct)
-    add_xp(db,u,25 if is_correct else 5)
+    schedule_review(db,u.id,topic,is_correct)
+    enqueue(db,"xp",{"user_id":u.id,"pts":25 if is_correct else 5},key=f"xp:quiz:{r.id}",commit=False)
+    enqueue(db,"analytics_refresh",{"user_id":u.id})
     return QuizFeedback(is_correct=is_correct,correct_answer=correct,explanation=explanation,score_earned=1.0 if is_correct else 0.0,follow_up=follow_up)
 
-@app.post("/lab/start",response_model=LabStepResponse)
+@api.get("/review/next",response_model=ReviewQueue)
+def review_next(limit:int=Query(5,ge=1,le=50),db:Session=Depends(get_db),u:User=Depends(get_current_user)):
+    due=due_reviews(db,u.id,limit); nxt=None
+    if not due: nxt=db.query(func.min(ReviewSchedule.due_at)).filter(ReviewSchedule.user_id==u.id).scalar()
+    return ReviewQueue(due=due,next_due_at=nxt)
+
+@api.get("/review/notifications")
+def review_notifications(u:User=Depends(get_current_user)):
+    return {"due_topics":due_queue.take(u.id)}
+
+def lab_score(errors): return max(0.0,100.0-errors*15)
+
+def record_lab_decision(s,choice,data):
+    if data.get("error"): s["error_count"]+=1
+    s["decision_chain"].append({"step":s["step"],"choice":choice,"result":data.get("result"),"error":data.get("error")})
+    s["step"]+=1; return bool(data.get("is_final",False))
+
+def save_lab_step(db,sid,uid,chain,errors,is_final):
+    log=db.query(LabLog).filter(LabLog.session_id==sid).first(); score_val=None
+    if log:
+        log.decision_chain=chain; log.error_count=errors
+        if is_final:
+            log.outcome="success" if errors==0 else "partial"
+            log.score=lab_score(errors); log.completed_at=datetime.utcnow(); score_val=log.score
+        db.commit()
+    if is_final: enqueue(db,"xp",{"user_id":uid,"pts":50 if errors==0 else 20},key=f"xp:lab:{sid}")
+    return score_val
+
+def _lab_write(op,*args):
+    db=SessionLocal()
+    try:
+        if op=="start": db.add(LabLog(user_id=args[0],lab_type=args[1],session_id=args[2],decision_chain=[],outcome="incomplete",error_count=0)); db.commit()
+        else: save_lab_step(db,*args)
+    finally: db.close()
+
+def _lab_load(sid,uid):
+    db=SessionLocal()
+    try: return lab_state(db,sid,uid)
+    finally: db.close()
+
+async def _lab_writer(q):
+    # Drains one connection's LabLog writes in order, off the socket's critical path
+    while (op:=await q.get()) is not None:
+        try: await run_in_threadpool(_lab_write,*op)
+        except Exception as e: print(f"[lab ws] persist failed: {e}")
+
+# A send after the client dropped raises RuntimeError (Starlette) or OSError (uvicorn's
+# ClientDisconnected) rather than WebSocketDisconnect
+_WS_GONE=(WebSocketDisconnect,RuntimeError,OSError)
+
+async def _ws_close(ws,code=1000):
+    if ws.application_state==WebSocketState.CONNECTED and ws.client_state==WebSocketState.CONNECTED:
+        try: await ws.close(code=code)
+        except _WS_GONE: pass
+
+async def _lab_stream(ws,fn,*args):
+    # Runs a blocking llm_* call on the fan-out pool and relays its field deltas to the socket
+    loop=asyncio.get_running_loop(); q=asyncio.Queue()
+    emit=lambda field,text: loop.call_soon_threadsafe(q.put_nowait,(field,text))
+    fut=loop.run_in_executor(_llm_pool,copy_context().run,lambda: fn(*args,on_delta=emit))
+    fut.add_done_callback(lambda _: q.put_nowait(None))
+    while (item:=await q.get()) is not None: await ws.send_json({"type":"delta","field":item[0],"text":item[1]})
+    return await fut
+
+@api.websocket("/lab/ws")
+async def lab_ws(ws:WebSocket):
+    # Authenticate once ({"type":"auth","token":...}), then "start"/"decide" messages drive the lab.
+    # State stays on the connection; its LabLog row lets /lab/decide on any worker pick a run back up.
+    await ws.accept()
+    try: token=(await ws.receive_json()).get("token")
+    except (ValueError,AttributeError): await _ws_close(ws,1003); return
+    except _WS_GONE: return
+    def auth():
+        db=SessionLocal()
+        try: u=user_from_token(db,token); return (u.id,u.level.value) if u else None
+        finally: db.close()
+    who=await run_in_threadpool(auth)
+    if not who:
+        try: await ws.send_json({"type":"error","detail":"Invalid credentials"})
+        except _WS_GONE: return
+        await _ws_close(ws,4401); return
+    uid,level=who; sid=s=None; writes=asyncio.Queue(); writer=asyncio.create_task(_lab_writer(writes))
+
+    async def admitted(msg,fn,*args):
+        # Same admission control as the HTTP lab routes, one slot per generated step
+        key=(uid,"/lab/ws",hashlib.sha1(json_bytes(msg)).hexdigest())
+        try: await admission.acquire(uid,key)
+        except Shed as e:
+            ADMISSION_SHED.inc(route="/lab/ws",reason=e.reason)
+            await ws.send_json({"type":"error","detail":e.detail,"status":e.status_code,"retry_after":e.retry_after}); return None
+        t0=time.perf_counter()
+        try: return await _lab_stream(ws,fn,*args)
+        finally: admission.release(uid,key,time.perf_counter()-t0)
+
+    try:
+        await ws.send_json({"type":"ready","user_id":uid})
+        while True:
+            msg=await ws.receive_json(); kind=msg.get("type") if isinstance(msg,dict) else None
+            if kind=="start":
+                try: lab_type=LabType(msg.get("lab_type"))
+                except ValueError: await ws.send_json({"type":"error","detail":"Unknown lab type"}); continue
+                data=await admitted(msg,llm_start_lab,lab_type.value,level)
+                if data is None: continue
+                sid=str(uuid.uuid4()); s={"lab_type":lab_type.value,"user_id":uid,"step":1,"decision_chain":[],"error_count":0}
+                writes.put_nowait(("start",uid,lab_type.value,sid))
+                step=LabStepResponse(session_id=sid,step=1,scenario=data.get("scenario",""),choices=data.get("choices",[]))
+                await ws.send_json({"type":"step",**step.model_dump()})
+            elif kind=="decide":
+                if msg.get("session_id") and msg["session_id"]!=sid:
+                    sid=msg["session_id"]; s=await run_in_threadpool(_lab_load,sid,uid)
+                if not s or s["user_id"]!=uid: sid=s=None; await ws.send_json({"type":"error","detail":"Lab session not found"}); continue
+                choice=str(msg.get("choice",""))
+                data=await admitted(msg,llm_lab_decision,s["lab_type"],level,choice,s["step"],list(s["decision_chain"]))
+                if data is None: continue
+                is_final=record_lab_decision(s,choice,data)
+                writes.put_nowait(("step",sid,uid,list(s["decision_chain"]),s["error_count"],is_final))
+                next_step=None
+                if not is_final and data.get("scenario"):
+                    next_step=LabStepResponse(session_id=sid,step=s["step"],scenario=data["scenario"],choices=data.get("choices",[]))
+                out=LabDecisionResponse(result=data.get("result",""),error=data.get("error"),next_step=next_step,completed=is_final,
+                                        score=lab_score(s["error_count"]) if is_final else None)
+                await ws.send_json({"type":"decision",**out.model_dump()})
+                if is_final: sid=s=None
+            else: await ws.send_json({"type":"error","detail":"Expected a start or decide message"})
+    except ValueError: await _ws_close(ws,1003)   # not JSON
+    except _WS_GONE: pass
+    finally:
+        writes.put_nowait(None); await asyncio.shield(writer)   # a cancelled handler must not drop queued writes
+        await _ws_close(ws)
+
+@api.post("/lab/start",response_model=LabStepResponse,dependencies=LLM_ROUTE)
 def start_lab(p:LabStartRequest,db:Session=Depends(get_db),u:User=Depends(get_current_user)):
     sid=str(uuid.uuid4()); data=llm_start_lab(p.lab_type.value,u.level.value)
-    _labs[sid]={"lab_type":p.lab_type.value,"user_id":u.id,"step":1,"decision_chain":[],"error_count":0}
     log=LabLog(user_id=u.id,lab_type=p.lab_type.value,session_id=sid,decision_chain=[],outcome="incomplete",error_count=0)
     db.add(log); db.commit()
     return LabStepResponse(session_id=sid,step=1,scenario=data.get("scenario",""),choices=data.get("choices",[]))
 
-@app.post("/lab/decide",response_model=LabDecisionResponse)
+@api.post("/lab/decide",response_model=LabDecisionResponse,dependencies=LLM_ROUTE)
 def lab_decide(p:LabDecisionRequest,db:Session=Depends(get_db),u:User=Depends(get_current_user)):
-    s=_labs.get(p.session_id)
+    s=lab_state(db,p.session_id,u.id)
     if not s: raise HTTPException(404,"Lab session not found")
     data=llm_lab_decision(s["lab_type"],u.level.value,p.choice,s["step"],s["decision_chain"])
-    if data.get("error"): s["error_count"]+=1
-    s["decision_chain"].append({"step":s["step"],"choice":p.choice,"result":data.get("result"),"error":data.get("error")})
-    s["step"]+=1; is_final=data.get("is_final",False)
-    log=db.query(LabLog).filter(LabLog.session_id==p.session_id).first(); score_val=None
-    if log:
-        log.decision_chain=s["decision_chain"]; log.error_count=s["error_count"]
-        if is_final:
-            log.outcome="success" if s["error_count"]==0 else "partial"
-            log.score=max(0.0,100.0-(s["error_count"]*15)); log.completed_at=datetime.utcnow(); score_val=log.score
-        db.commit()
-    if is_final: add_xp(db,u,50 if s["error_count"]==0 else 20); del _labs[p.session_id]
+    is_final=record_lab_decision(s,p.choice,data)
+    score_val=save_lab_step(db,p.session_id,u.id,s["decision_chain"],s["error_count"],is_final)
     next_step=None
     if not is_final and data.get("scenario"):
         next_step=LabStepResponse(session_id=p.session_id,step=s["step"],scenario=data["scenario"],choices=data.get("choices",[]))
     return LabDecisionResponse(result=data.get("result",""),error=data.get("error"),next_step=next_step,completed=is_final,score=score_val)
 
-@app.get("/analytics/dashboard",response_model=AnalyticsResponse)
+@api.get("/analytics/dashboard",response_model=AnalyticsResponse)
 def dashboard(db:Session=Depends(get_db),u:User=Depends(get_current_user)):
     breakdown = get_breakdown(db, u.id)
     weak = weak_topics(db, u.id)
     strong = strong_topics(db, u.id)
     role = u.career_goal.target_role.value if u.career_goal else "researcher"
-    try:
-        tips = llm_tips(weak, u.level.value) if weak else []
-    except:
-        tips = []
+    snap = tips_snapshot(db, u.id)
+    if snap:
+        # Serve the last tips even if stale; a job regenerates them off the request path
+        tips = snap.tips
+        if snap.weak != sorted(weak): enqueue(db, "analytics_refresh", {"user_id": u.id})
+    else:
+        try:
+            tips = refresh_tips(db, u.id)
+        except:
+            tips = []
     return AnalyticsResponse(
         user_id=u.id,
         total_xp=u.xp_points,
@@ -1181,29 +3345,304 @@ def dashboard(db:Session=Depends(get_db),u:User=Depends(get_current_user)):
         improvement_tips=tips,
         industry_readiness=readiness(db, u.id, role)
     )
-@app.get("/analytics/learning-path")
+@api.get("/analytics/learning-path",dependencies=LLM_ROUTE)
 def learning_path(db:Session=Depends(get_db),u:User=Depends(get_current_user)):
-    role=u.career_goal.target_role.value if u.career_goal else "researcher"
-    return {"student":u.name,"level":u.level.value,"path":llm_path(u.level.value,role,weak_topics(db,u.id),strong_topics(db,u.id))}
-
-@app.post("/career/analyze",response_model=CareerResponse)
+    inputs=path_inputs(db,u.id); fp=path_fingerprint(inputs); row=stored_path(db,fp); stale=False
+    if not row:
+        ptr=db.query(UserLearningPath).filter(UserLearningPath.user_id==u.id).first()
+        row=stored_path(db,ptr.fingerprint) if ptr else None
+        if row: stale=True; enqueue(db,"learning_path",{"user_id":u.id},key=f"path:{u.id}:{fp}")
+        else: row=generate_path(db,fp,inputs)
+    if row and not stale: point_user_path(db,u.id,fp)
+    return {"student":u.name,"level":u.level.value,"path":row.path if row else {},"stale":stale}
+
+@api.post("/career/analyze",response_model=CareerResponse,dependencies=LLM_ROUTE)
 def career_analyze(p:CareerRequest,db:Session=Depends(get_db),u:User=Depends(get_current_user)):
-    role=p.target_role.value; gaps=skill_gaps(db,u.id,role); ready=readiness(db,u.id,role)
-    topic_acc={t["topic"]:t["accuracy"] for t in get_breakdown(db,u.id)}
-    skill_data={s.skill_name:s.score for s in db.query(SkillScore).filter(SkillScore.user_id==u.id).all()}
+    role=p.target_role.value; v=skill_vector(db,u.id); gaps=gaps_for(v,role); ready=readiness_all(v)[role]
+    skill_data,topic_acc=career_profile(db,u.id); snap=profile_snapshot(skill_data,topic_acc)
+    goal=db.query(CareerGoal).filter(CareerGoal.user_id==u.id).first()
+    # Readiness and gaps are always recomputed; the LLM plan only when the role or skills moved enough
+    if (not p.regenerate and goal and goal.roadmap and goal.target_role==p.target_role
+            and profile_distance(goal.skill_snapshot,snap)<CAREER_REGEN_DISTANCE):
+        goal.readiness_score=ready; db.commit()
+        return CareerResponse(target_role=role,readiness_score=ready,skill_gaps=[SkillGap(**g) for g in gaps],roadmap=goal.roadmap,
+                              mini_projects=goal.mini_projects or [],certifications=goal.certifications or [],generated_at=goal.generated_at)
     rd=llm_career(u.name,role,skill_data,topic_acc)
+    plan={"roadmap":rd.get("roadmap",[]),"mini_projects":rd.get("mini_projects",[]),"certifications":rd.get("certifications",[])}
+    if not plan["roadmap"]:
+        # The LLM failed: fall back to the saved plan for this role, flagged as stale, or give up
+        if not (goal and goal.roadmap and goal.target_role==p.target_role): raise HTTPException(503,"Could not generate a career plan, please retry")
+        return CareerResponse(target_role=role,readiness_score=ready,skill_gaps=[SkillGap(**g) for g in gaps],roadmap=goal.roadmap,
+                              mini_projects=goal.mini_projects or [],certifications=goal.certifications or [],generated_at=goal.generated_at,stale=True)
+    # Stored inline: the saved plan is what later calls and /career/plan serve
+    goal=save_career_goal(db,{"user_id":u.id,"target_role":role,"industry_skills":rd.get("industry_required_skills",{}),"readiness_score":ready,"skill_snapshot":snap,**plan})
+    return CareerResponse(target_role=role,readiness_score=ready,skill_gaps=[SkillGap(**g) for g in gaps],generated_at=goal.generated_at,regenerated=True,**plan)
+
+@api.get("/career/plan",response_model=CareerResponse)
+def career_plan(db:Session=Depends(get_db),u:User=Depends(get_current_user)):
     goal=db.query(CareerGoal).filter(CareerGoal.user_id==u.id).first()
-    if not goal: goal=CareerGoal(user_id=u.id,target_role=p.target_role); db.add(goal)
-    goal.target_role=p.target_role; goal.industry_skills=rd.get("industry_required_skills",{})
-    goal.roadmap=rd.get("roadmap",[]); goal.mini_projects=rd.get("mini_projects",[])
-    goal.certifications=rd.get("certifications",[]); goal.readiness_score=ready; db.commit()
-    return CareerResponse(target_role=role,readiness_score=ready,skill_gaps=[SkillGap(**g) for g in gaps],roadmap=goal.roadmap,mini_projects=goal.mini_projects,certifications=goal.certifications)
+    if not goal: raise HTTPException(404,"No career plan yet")
+    v=skill_vector(db,u.id); role=goal.target_role.value
+    return CareerResponse(target_role=role,readiness_score=readiness_all(v)[role],skill_gaps=[SkillGap(**g) for g in gaps_for(v,role)],roadmap=goal.roadmap or [],
+                          mini_projects=goal.mini_projects or [],certifications=goal.certifications or [],generated_at=goal.generated_at)
+
+@api.get("/career/readiness")
+def career_readiness(db:Session=Depends(get_db),u:User=Depends(get_current_user)):
+    v=skill_vector(db,u.id)
+    return {"readiness":readiness_all(v),"skill_gaps":{r:gaps_for(v,r) for r in BENCH_ROLES}}
+
+@api.get("/analytics/cohort")
+def cohort_report(cohort:Optional[str]=None,u:User=Depends(get_current_user)):
+    # Admins see every cohort; anyone else only the aggregates of their own institution
+    if not is_admin(u):
+        if not (u.institution or "").strip(): raise HTTPException(403,"Cohort reports need an institution on your profile")
+        if cohort not in (None,_cohort_of(u.institution)): raise HTTPException(403,"Not your cohort")
+        cohort=_cohort_of(u.institution)
+    report=load_cohort_report()
+    if not report: raise HTTPException(404,"Cohort report not generated yet")
+    out={"generated_at":report["manifest"]["generated_at"]}
+    for name in COHORT_TABLES: out[name]=[r for r in report[name] if cohort is None or r["cohort"]==cohort]
+    return out
+
+@api.get("/analytics/cohort/{table}")
+def cohort_table(table:str,format:str="csv",u:User=Depends(get_admin_user)):
+    # The files hold every cohort, so downloads are admin-only
+    if table not in COHORT_TABLES or format not in ("csv","parquet"): raise HTTPException(404,"Unknown cohort table")
+    path=os.path.join(COHORT_DIR,f"{table}.{format}")
+    if not os.path.exists(path): raise HTTPException(404,"Cohort report not generated yet")
+    return FileResponse(path,filename=f"{table}.{format}")
+
+@api.get("/quiz/history",response_model=QuizHistoryPage)
+def quiz_history(limit:int=Query(50,ge=1,le=HISTORY_PAGE_MAX),before:Optional[int]=None,full:bool=False,db:Session=Depends(get_db),u:User=Depends(get_current_user)):
+    return history_page(db,QuizResult,QUIZ_FULL if full else QUIZ_COLS,u.id,limit,before)
+
+@api.get("/quiz/history/export")
+def quiz_export(u:User=Depends(get_current_user)):
+    return StreamingResponse(stream_ndjson(QuizResult,QUIZ_FULL,u.id),media_type="application/x-ndjson",
+                             headers={"Content-Disposition":"attachment; filename=quiz_history.ndjson"})
+
+@api.get("/lab/history",response_model=LabHistoryPage)
+def lab_history(limit:int=Query(50,ge=1,le=HISTORY_PAGE_MAX),before:Optional[int]=None,full:bool=False,db:Session=Depends(get_db),u:User=Depends(get_current_user)):
+    return history_page(db,LabLog,LAB_FULL if full else LAB_COLS,u.id,limit,before)
+
+@api.get("/lab/history/export")
+def lab_export(u:User=Depends(get_current_user)):
+    return StreamingResponse(stream_ndjson(LabLog,LAB_FULL,u.id),media_type="application/x-ndjson",
+                             headers={"Content-Disposition":"attachment; filename=lab_history.ndjson"})
+
+@api.get("/metrics",response_class=PlainTextResponse)
+def metrics(db:Session=Depends(get_db)):
+    m=jobs.metrics(db)
+    for kind in JOB_HANDLERS: JOB_DEPTH.set(m["depth_by_kind"].get(kind,0),kind=kind)
+    JOB_INFLIGHT.set(m["inflight"])
+    for ev,n in m["counters"].items(): JOB_EVENTS.set(n,event=ev)
+    return PlainTextResponse(render_metrics(),media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@api.get("/traces/recent")
+def recent_traces(min_ms:float=0.0,route:Optional[str]=None,limit:int=Query(20,ge=1,le=TRACE_RECENT),u:User=Depends(get_current_user)):
+    out=[t for t in (timeline(tr) for tr in reversed(tracer.recent)) if t["duration_ms"]>=min_ms and (route is None or t["name"].endswith(" "+route))]
+    return out[:limit]
+
+@api.get("/healthz")
+def healthz(): return {"status":"ok","pid":os.getpid()}
+
+@api.get("/readyz")
+def readyz():
+    checks={"draining":_draining.is_set(),"jobs":jobs.thread is not None and jobs.thread.is_alive()}
+    try:
+        with get_engine().connect() as conn: conn.execute(text("SELECT 1")); checks["db"]=True
+    except Exception: checks["db"]=False
+    if checks["draining"] or not (checks["jobs"] and checks["db"]): raise HTTPException(503,checks)
+    return {"status":"ready",**checks}
+
+@api.get("/llm/routes")
+def llm_routes(u:User=Depends(get_current_user)):
+    return route_stats.report()
+
+@api.get("/admission")
+def admission_status(u:User=Depends(get_current_user)):
+    return admission.status()
+
+@api.get("/jobs/metrics")
+def job_metrics(db:Session=Depends(get_db),u:User=Depends(get_current_user)):
+    return jobs.metrics(db)
 
 # ── RUN ────────────────────────────────────────────────────────────────────────
+def run_import_budget(runs=5):
+    # Cold-import the module in fresh interpreters under -X importtime and fail (exit 1)
+    # when the median exceeds IMPORT_BUDGET_MS, so a stray eager import shows up in CI
+    import subprocess, statistics, sys
+    here=os.path.dirname(os.path.abspath(__file__)); totals=[]; heavy=Counter()
+    for _ in range(runs):
+        p=subprocess.run([sys.executable,"-X","importtime","-c","import biotechpro1"],cwd=here,capture_output=True,text=True)
+        if p.returncode: print(p.stderr[-2000:]); return 1
+        for line in p.stderr.splitlines():
+            m=re.match(r"import time:\s+\d+ \|\s+(\d+) \|( +)(\S+)$",line)
+            if not m: continue
+            if m[3]=="biotechpro1": totals.append(int(m[1])/1000)
+            elif len(m[2])==3: heavy[m[3]]=max(heavy[m[3]],int(m[1])/1000)   # direct imports of the module
+    t0=time.perf_counter(); create_app(); build_ms=(time.perf_counter()-t0)*1000
+    median=statistics.median(totals)
+    print(json.dumps({"runs":runs,"import_ms_median":round(median,1),"import_ms_min":round(min(totals),1),
+                      "budget_ms":IMPORT_BUDGET_MS,"create_app_ms":round(build_ms,1),
+                      "heaviest":{k:round(v,1) for k,v in heavy.most_common(8)}},indent=2))
+    return 0 if median<=IMPORT_BUDGET_MS else 1
+
+def run_server(workers=None):
+    # Production launch: build the app and bind the socket once, then fork the workers so they
+    # share the preloaded modules copy-on-write. SIGTERM is forwarded to the workers, which stop
+    # accepting, fail /readyz and give in-flight requests DRAIN_SECS before exiting.
+    global _preforked
+    import importlib, signal, uvicorn
+    from importlib.util import find_spec
+    n=workers or WEB_WORKERS or os.cpu_count() or 1
+    for mod in ("groq","jose.jwt","passlib.context"):
+        if find_spec(mod.split(".")[0]): importlib.import_module(mod)
+    app=create_app(); init_schema(); jobs.recover(); get_engine().dispose(); _preforked=True   # no pooled connections across fork
+
+    class DrainingServer(uvicorn.Server):
+        def handle_exit(self,sig,frame): _draining.set(); super().handle_exit(sig,frame)
+
+    config=uvicorn.Config(app,host=SERVER_HOST,port=SERVER_PORT,lifespan="on",access_log=False,proxy_headers=True,
+                          log_level=os.getenv("BIOMIND_LOG_LEVEL","info"),
+                          loop="uvloop" if find_spec("uvloop") else "asyncio",http="httptools" if find_spec("httptools") else "h11",
+                          timeout_graceful_shutdown=DRAIN_SECS)
+    sock=config.bind_socket()
+    print(f"BioMind AI: {n} worker(s) on http://{SERVER_HOST}:{SERVER_PORT} (loop={config.loop}, http={config.http})",flush=True)
+    if n==1: DrainingServer(config).run(sockets=[sock]); return 0
+
+    def spawn():
+        pid=os.fork()
+        if pid==0:
+            signal.signal(signal.SIGTERM,signal.SIG_DFL); signal.signal(signal.SIGINT,signal.SIG_DFL)
+            try: DrainingServer(config).run(sockets=[sock])
+            finally: os._exit(0)
+        return pid
+
+    children=[spawn() for _ in range(n)]; stopping=False
+    def stop(sig,frame):
+        nonlocal stopping
+        if stopping: return
+        stopping=True; signal.alarm(int(DRAIN_SECS)+5)
+        for pid in children:
+            try: os.kill(pid,signal.SIGTERM)
+            except ProcessLookupError: pass
+    def kill(sig,frame):
+        for pid in children:
+            try: os.kill(pid,signal.SIGKILL)
+            except ProcessLookupError: pass
+    signal.signal(signal.SIGTERM,stop); signal.signal(signal.SIGINT,stop); signal.signal(signal.SIGALRM,kill)
+    while children:
+        try: pid,status=os.wait()
+        except ChildProcessError: break
+        children.remove(pid)
+        if not stopping:   # a worker crashed; keep the pool at n
+            print(f"worker {pid} exited ({status}); restarting",flush=True); children.append(spawn())
+    return 0
+
+def _bench_client(base,token,paths,secs,conns,out):
+    import http.client
+    from urllib.parse import urlsplit
+    u=urlsplit(base); lat=[]; errors=[0]; lock=threading.Lock(); end=time.monotonic()+secs
+    def loop(i):
+        conn=http.client.HTTPConnection(u.hostname,u.port,timeout=30); mine=[]
+        for k in itertools.count(i):
+            if time.monotonic()>=end: break
+            method,path,body=paths[k%len(paths)]; t0=time.perf_counter()
+            try:
+                conn.request(method,path,body=body,headers={"Authorization":"Bearer "+token,"Content-Type":"application/json"})
+                r=conn.getresponse(); r.read(); ok=r.status<400
+            except Exception:
+                ok=False; conn.close(); conn=http.client.HTTPConnection(u.hostname,u.port,timeout=30)
+            if ok: mine.append(time.perf_counter()-t0)
+            else:
+                with lock: errors[0]+=1
+        with lock: lat.extend(mine)
+    ts=[threading.Thread(target=loop,args=(i,)) for i in range(conns)]
+    for t in ts: t.start()
+    for t in ts: t.join()
+    out.put((lat,errors[0]))
+
+def run_bench_serve():
+    # Requests/sec for 1..N workers against a fresh database with the LLM stubbed
+    # (BIOMIND_LLM_STUB_MS, default 50ms). Load comes from separate client processes.
+    import multiprocessing as mp, shutil, signal, socket, subprocess, sys, urllib.request
+    cores=os.cpu_count() or 1; secs=float(os.getenv("BIOMIND_BENCH_SECS","15")); conns=int(os.getenv("BIOMIND_BENCH_CONNS","64"))
+    counts=sorted({int(x) for x in os.getenv("BIOMIND_BENCH_WORKERS","").split(",") if x} or {1,*[2**i for i in range(1,8) if 2**i<cores],cores})
+    paths=[("GET","/auth/me",None),("POST","/lab/start",json.dumps({"lab_type":"pcr"})),("GET","/career/readiness",None)]
+    here=os.path.abspath(__file__); results=[]
+    for n in counts:
+        with socket.socket() as s: s.bind(("127.0.0.1",0)); port=s.getsockname()[1]
+        work=tempfile.mkdtemp(prefix="biomind-bench-"); base=f"http://127.0.0.1:{port}"
+        env={**os.environ,"DATABASE_URL":"sqlite:///./biotech.db","BIOMIND_PORT":str(port),"BIOMIND_HOST":"127.0.0.1","BIOMIND_WORKERS":str(n),
+             "BIOMIND_LLM_STUB_MS":os.getenv("BIOMIND_LLM_STUB_MS","50"),"BIOMIND_TRACE_SAMPLE":"0","BIOMIND_LOG_LEVEL":"warning"}
+        srv=subprocess.Popen([sys.executable,here,"serve"],cwd=work,env=env,stdout=subprocess.DEVNULL)
+        try:
+            for _ in range(200):
+                try: urllib.request.urlopen(base+"/readyz",timeout=1).close(); break
+                except Exception: time.sleep(0.1)
+            req=lambda path,data,ct: json.load(urllib.request.urlopen(urllib.request.Request(base+path,data=data,headers={"Content-Type":ct})))
+            req("/auth/register",json.dumps({"name":"Bench","email":"bench@example.com","password":"bench-pass"}).encode(),"application/json")
+            token=req("/auth/login",b"username=bench%40example.com&password=bench-pass","application/x-www-form-urlencoded")["access_token"]
+            procs=max(1,min(cores,8)); q=mp.Queue()
+            ps=[mp.Process(target=_bench_client,args=(base,token,paths,secs,max(1,conns//procs),q)) for _ in range(procs)]
+            for p in ps: p.start()
+            parts=[q.get() for _ in ps]
+            for p in ps: p.join()
+            lat=sorted(x for l,_ in parts for x in l); errors=sum(e for _,e in parts)
+            pct=lambda f: round(lat[min(len(lat)-1,int(f*len(lat)))]*1000,1) if lat else None
+            results.append({"workers":n,"rps":round(len(lat)/secs,1),"p50_ms":pct(0.5),"p99_ms":pct(0.99),"errors":errors})
+            print(json.dumps(results[-1]),flush=True)
+        finally:
+            srv.send_signal(signal.SIGTERM); srv.wait(DRAIN_SECS+10); shutil.rmtree(work,ignore_errors=True)
+    print(json.dumps({"cores":cores,"seconds":secs,"connections":conns,"llm_stub_ms":float(os.getenv("BIOMIND_LLM_STUB_MS","50")),"results":results},indent=2))
+
+def run_bench_json(reps=2000):
+    # Per-payload (de)serialisation cost of stdlib json vs the configured backend, using
+    # payloads shaped like the JSON columns and route responses they stand for
+    from fastapi.encoders import jsonable_encoder
+    now=datetime.utcnow(); text=lambda n: ("Denaturation at 95C separates the strands; primers anneal as the block cools. "*8)[:n]
+    q={"type":"scenario","scenario":text(400),"question":text(160),"options":[text(60)]*4,"answer_index":2,"explanation":text(300)}
+    chain=[{"step":i,"choice":text(80),"result":text(320),"error":None if i%3 else text(120)} for i in range(1,13)]
+    career={"industry_skills":{k:80 for k in BENCH_SKILLS},"roadmap":[text(120)]*5,"mini_projects":[text(100)]*3,"certifications":[text(40)]*2}
+    history={"items":[{"id":i,"topic":"PCR","question_type":"mcq","student_answer":text(40),"correct_answer":text(40),"is_correct":i%2==0,
+                       "score":1.0,"attempted_at":now,"question_data":q} for i in range(50)],"next_cursor":7}
+    readiness={r.value:round(37.5+i,1) for i,r in enumerate(BiotechRole)}
+    path={"weeks":[{"week":f"Week {2*i+1}-{2*i+2}","focus":text(60),"topics":[text(30)]*3,"priority":"high"} for i in range(3)],"milestone":text(80),
+          "cached":True,"generated_at":now}
+    cases=[("column quiz_results.question_data",q,True),("column lab_logs.decision_chain",chain,True),("column career_goals.*",career,True),
+           ("response /quiz/history (50 items)",history,False),("response /analytics/learning-path",path,False),("response /career/readiness",readiness,False)]
+    def per_call(fn,arg):
+        t0=time.perf_counter()
+        for _ in range(reps): fn(arg)
+        return (time.perf_counter()-t0)/reps*1e6
+    stdlib_render=lambda c: json.dumps(c,ensure_ascii=False,allow_nan=False,indent=None,separators=(",",":")).encode()   # Starlette JSONResponse
+    rows=[]
+    for name,obj,column in cases:
+        if column:
+            raw=json.dumps(obj)
+            row={"payload":name,"bytes":len(raw),"stdlib_us":per_call(json.dumps,obj)+per_call(json.loads,raw),
+                 "backend_us":per_call(json_dumps,obj)+per_call(json_loads,raw)}
+        else:
+            enc=jsonable_encoder(obj)
+            row={"payload":name,"bytes":len(stdlib_render(enc)),"stdlib_us":per_call(stdlib_render,enc),"backend_us":per_call(json_bytes,enc)}
+        row["saved_us"]=row["stdlib_us"]-row["backend_us"]; row["speedup"]=row["stdlib_us"]/max(row["backend_us"],1e-9)
+        rows.append({k:round(v,2) if isinstance(v,float) else v for k,v in row.items()})
+    print(json.dumps({"backend":"orjson" if json_loads is not json.loads else "stdlib","reps":reps,
+                      "note":"columns: dumps+loads per write/read; responses: final render after jsonable_encoder","results":rows},indent=2))
+
+JOBS = {"cohort-report": run_cohort_report, "bkt-recalibrate": run_bkt_recalibrate, "import-budget": run_import_budget,
+        "bench-serve": run_bench_serve, "bench-json": run_bench_json, "compact": run_compact}
+
 if __name__ == "__main__":
+    import sys
+    if len(sys.argv) > 1 and sys.argv[1] in JOBS:
+        sys.exit(JOBS[sys.argv[1]]() or 0)
+    if len(sys.argv) > 1 and sys.argv[1] == "serve":
+        sys.exit(run_server(int(sys.argv[sys.argv.index("--workers")+1]) if "--workers" in sys.argv else None))
     import uvicorn
     print("=" * 50)
     print("BioMind AI Platform Starting...")
     print("Open browser: http://localhost:5000")
     print("=" * 50)
-    uvicorn.run("biotechpro1:app", host="0.0.0.0", port=5000, reload=True)
\ No newline at end of file
+    uvicorn.run("biotechpro1:create_app", factory=True, host="0.0.0.0", port=5000, reload=True)
\ No newline at end of file
@@ -0,0 +1,40 @@
+import os, sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import biotechpro1 as bt
+
+
+@pytest.fixture
+def fresh_db(tmp_path, monkeypatch):
+    # Point the lazily built engine at a throwaway SQLite file for one test
+    monkeypatch.setattr(bt, "DATABASE_URL", f"sqlite:///{tmp_path / 'test.db'}")
+    monkeypatch.setattr(bt, "_engine", None)
+    bt._bkt_cache.clear()
+    yield bt
+    if bt._engine is not None: bt._engine.dispose()
+    bt._bkt_cache.clear()
+
+
+@pytest.fixture
+def client(fresh_db, tmp_path, monkeypatch):
+    from fastapi.testclient import TestClient
+    monkeypatch.setattr(bt, "TRACE_FILE", str(tmp_path / "traces.jsonl"))
+    monkeypatch.setattr(bt, "COHORT_DIR", str(tmp_path / "cohort_reports"))
+    with TestClient(bt.create_app()) as c:
+        yield c
+
+
+@pytest.fixture
+def make_user(fresh_db):
+    # Returns a factory: make_user(email, institution=...) -> auth headers for that user
+    def make(email, **kw):
+        db = bt.SessionLocal()
+        try:
+            u = bt.User(name=email.split("@")[0], email=email, hashed_pw="x", **kw)
+            db.add(u); db.commit()
+            return {"Authorization": f"Bearer {bt.create_access_token({'sub': str(u.id)})}"}
+        finally:
+            db.close()
+    return make
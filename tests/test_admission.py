@@ -0,0 +1,48 @@
+import asyncio
+
+import pytest
+
+import biotechpro1 as bt
+
+
+@pytest.fixture
+def controller(tmp_path, monkeypatch):
+    monkeypatch.setattr(bt, "ADMISSION_FILE", str(tmp_path / "admission.json"))
+    ctl = bt.AdmissionController()
+    ctl.limits.update({"global": 1, "per_user": 1, "user_queue": 1, "queue": 8, "queue_timeout": 1.0})
+    ctl.reload = lambda: None
+    return ctl
+
+
+def test_identical_running_request_is_rejected_with_409(controller):
+    async def go():
+        await controller.acquire(1, "k")
+        with pytest.raises(bt.Shed) as e: await controller.acquire(1, "k")
+        assert (e.value.status_code, e.value.reason) == (409, "duplicate")
+    asyncio.run(go())
+
+
+def test_newer_identical_request_supersedes_a_queued_one(controller):
+    async def go():
+        await controller.acquire(1, "running")
+        first = asyncio.ensure_future(controller.acquire(1, "k")); await asyncio.sleep(0)
+        second = asyncio.ensure_future(controller.acquire(1, "k")); await asyncio.sleep(0)
+        with pytest.raises(bt.Shed) as e: await first
+        assert (e.value.status_code, e.value.reason) == (409, "superseded")
+        controller.release(1, "running"); await second
+        assert controller.active == 1
+    asyncio.run(go())
+
+
+def test_per_user_queue_overflow_is_429(controller):
+    async def go():
+        await controller.acquire(1, "a")
+        queued = asyncio.ensure_future(controller.acquire(1, "b")); await asyncio.sleep(0)
+        with pytest.raises(bt.Shed) as e: await controller.acquire(1, "c")
+        assert (e.value.status_code, e.value.reason) == (429, "user_queue") and e.value.retry_after >= 1
+        # Another user still queues normally behind the same slot
+        other = asyncio.ensure_future(controller.acquire(2, "d")); await asyncio.sleep(0)
+        assert len(controller.waiters) == 2
+        controller.release(1, "a"); await queued
+        controller.release(1, "b"); await other
+    asyncio.run(go())
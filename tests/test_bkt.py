@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+import biotechpro1 as bt
+
+
+def test_bkt_forward_matches_the_online_step_and_ignores_padding():
+    prm = dict(bt.BKT_DEFAULTS)
+    seqs = [[1, 1, 0, 1, 1], [0, 0, 1], [1]]
+    obs = np.zeros((3, 5), dtype=bool); mask = np.zeros_like(obs)
+    for i, s in enumerate(seqs): obs[i, :len(s)] = s; mask[i, :len(s)] = True
+    ll, p = bt.bkt_forward(obs, mask, {k: np.array([v]) for k, v in prm.items()})
+    for i, s in enumerate(seqs):
+        online = prm["p_init"]
+        for a in s: online = bt.bkt_step(online, bool(a), prm)
+        assert p[i, 0] == pytest.approx(online)
+    assert ll.shape == (1,) and ll[0] < 0
+
+
+def test_bkt_forward_prefers_the_generating_parameters():
+    rng = np.random.default_rng(7); prm = {"p_init": 0.1, "p_learn": 0.2, "p_slip": 0.1, "p_guess": 0.2}
+    obs = np.zeros((400, 30), dtype=bool)
+    for i in range(400):
+        known = rng.random() < prm["p_init"]
+        for t in range(30):
+            obs[i, t] = rng.random() < (1 - prm["p_slip"] if known else prm["p_guess"])
+            known = known or rng.random() < prm["p_learn"]
+    grid = {k: np.array([v, 0.5]) for k, v in prm.items()}
+    ll, _ = bt.bkt_forward(obs, np.ones_like(obs), grid)
+    assert ll[0] > ll[1]
+
@@ -0,0 +1,52 @@
+from sqlalchemy import text
+
+
+def _baseline_db(bt):
+    # A database created before p_known existed: same tables, topic_mastery without the column
+    bt.init_schema()
+    with bt.get_engine().begin() as conn:
+        conn.execute(text("ALTER TABLE topic_mastery DROP COLUMN p_known"))
+        conn.execute(text("DELETE FROM schema_meta"))
+    db = bt.SessionLocal()
+    u = bt.User(name="Ada", email="ada@example.com", hashed_pw="x")
+    db.add(u); db.commit()
+    history = {"PCR": [1, 1, 1, 0, 1, 1, 1, 1, 1, 1], "CRISPR": [0, 0, 1, 0, 0, 0, 1, 0]}
+    for topic, answers in history.items():
+        for a in answers:
+            db.add(bt.QuizResult(user_id=u.id, topic=topic, is_correct=bool(a)))
+    db.commit()
+    with bt.get_engine().begin() as conn:
+        conn.execute(text("INSERT INTO topic_mastery (user_id,topic_name,attempts,correct,accuracy,current_level) VALUES "
+                          "(:u,'PCR',10,9,0.9,'advanced'),(:u,'CRISPR',8,2,0.25,'beginner'),(:u,'PCA',6,5,0.8333,'intermediate')"),
+                     {"u": u.id})
+    uid = u.id; db.close()
+    return uid
+
+
+def test_migration_backfills_p_known_and_keeps_levels(fresh_db):
+    bt = fresh_db
+    uid = _baseline_db(bt)
+    assert bt.init_schema() is True
+    db = bt.SessionLocal()
+    try:
+        rows = {m.topic_name: m for m in db.query(bt.TopicMastery).filter(bt.TopicMastery.user_id == uid)}
+        assert {t: m.current_level for t, m in rows.items()} == {
+            "PCR": bt.DifficultyLevel.advanced, "CRISPR": bt.DifficultyLevel.beginner, "PCA": bt.DifficultyLevel.intermediate}
+        # Replayed from QuizResult where history exists, seeded from accuracy where it does not
+        assert rows["PCR"].p_known > bt.BKT_ADVANCED
+        assert rows["CRISPR"].p_known < bt.WEAK_THRESHOLD
+        assert rows["PCA"].p_known == 0.8333
+        assert bt.weak_topics(db, uid) == ["CRISPR"]
+        assert sorted(bt.strong_topics(db, uid)) == ["PCA", "PCR"]
+        # The next answer continues from the backfilled estimate instead of demoting
+        bt.update_mastery(db, uid, "PCR", False)
+        db.refresh(rows["PCR"])
+        assert rows["PCR"].current_level == bt.DifficultyLevel.advanced
+    finally:
+        db.close()
+
+
+def test_backfill_runs_only_when_column_is_added(fresh_db):
+    bt = fresh_db
+    assert bt.init_schema() is True
+    assert bt.add_missing_columns() == set()
@@ -0,0 +1,25 @@
+import biotechpro1 as bt
+
+PLAN = {"roadmap": ["Learn qPCR"], "mini_projects": ["Primer design"], "certifications": ["GLP"], "industry_required_skills": {}}
+
+
+def test_failed_regeneration_serves_the_saved_plan_as_stale(client, make_user, monkeypatch):
+    me = make_user("ada@example.com")
+    monkeypatch.setattr(bt, "llm_career", lambda *a: dict(PLAN))
+    fresh = client.post("/career/analyze", json={"target_role": "researcher"}, headers=me).json()
+    assert fresh["regenerated"] and not fresh["stale"]
+    monkeypatch.setattr(bt, "llm_career", lambda *a: {})
+    r = client.post("/career/analyze", json={"target_role": "researcher", "regenerate": True}, headers=me)
+    assert r.status_code == 200
+    body = r.json()
+    assert body["stale"] and not body["regenerated"] and body["roadmap"] == PLAN["roadmap"]
+    assert body["generated_at"] == fresh["generated_at"]
+
+
+def test_failed_generation_without_a_saved_plan_is_503(client, make_user, monkeypatch):
+    me = make_user("ada@example.com")
+    monkeypatch.setattr(bt, "llm_career", lambda *a: dict(PLAN))
+    client.post("/career/analyze", json={"target_role": "researcher"}, headers=me)
+    monkeypatch.setattr(bt, "llm_career", lambda *a: {})
+    # A plan for a different role is not a fallback
+    assert client.post("/career/analyze", json={"target_role": "bioinformatician"}, headers=me).status_code == 503
@@ -0,0 +1,27 @@
+import biotechpro1 as bt
+
+
+def _report(client, make_user):
+    make_user("a1@uni-a.edu", institution="Uni A"); make_user("b1@uni-b.edu", institution="Uni B")
+    db = bt.SessionLocal()
+    try: bt.build_cohort_report(db)
+    finally: db.close()
+
+
+def test_students_only_see_their_own_cohort(client, make_user):
+    _report(client, make_user)
+    me = make_user("a2@uni-a.edu", institution="Uni A")
+    r = client.get("/analytics/cohort", headers=me)
+    assert r.status_code == 200 and {row["cohort"] for row in r.json()["cohorts"]} == {"Uni A"}
+    assert client.get("/analytics/cohort", params={"cohort": "Uni B"}, headers=me).status_code == 403
+    assert client.get("/analytics/cohort", headers=make_user("x@nowhere.org")).status_code == 403
+    assert client.get("/analytics/cohort/cohorts", headers=me).status_code == 403
+
+
+def test_admins_see_every_cohort(client, make_user, monkeypatch):
+    _report(client, make_user)
+    monkeypatch.setattr(bt, "ADMIN_EMAILS", {"ops@biomind.dev"})
+    admin = make_user("Ops@biomind.dev")
+    r = client.get("/analytics/cohort", headers=admin)
+    assert {row["cohort"] for row in r.json()["cohorts"]} == {"Uni A", "Uni B"}
+    assert client.get("/analytics/cohort/cohorts", headers=admin).status_code == 200
@@ -0,0 +1,24 @@
+import time
+
+import biotechpro1 as bt
+
+
+def test_lab_ws_survives_client_dropping_mid_stream(client, make_user, monkeypatch):
+    monkeypatch.setattr(bt, "llm_client", bt.StubLLM("200"))
+    headers = make_user("ada@example.com")
+    with client.websocket_connect("/lab/ws") as ws:
+        ws.send_json({"type": "auth", "token": headers["Authorization"].split()[1]})
+        assert ws.receive_json()["type"] == "ready"
+        ws.send_json({"type": "start", "lab_type": "pcr"})
+    time.sleep(0.4)   # the step finishes streaming into a closed socket
+    # The handler exited cleanly and released its admission slot
+    assert bt.admission.active == 0
+
+
+def test_lab_ws_closes_on_bad_json(client, make_user):
+    headers = make_user("ada@example.com")
+    with client.websocket_connect("/lab/ws") as ws:
+        ws.send_json({"type": "auth", "token": headers["Authorization"].split()[1]})
+        assert ws.receive_json()["type"] == "ready"
+        ws.send_text("not json")
+        assert ws.receive()["type"] == "websocket.close"
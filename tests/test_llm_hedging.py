@@ -0,0 +1,44 @@
+import time
+
+import pytest
+
+import biotechpro1 as bt
+
+PRIMARY, FALLBACK = bt.LLM_MODEL, bt.LLM_FAST_MODEL
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    # Primary answers in 400ms, the fallback in 20ms; llm_answer's SLO is cut to 100ms
+    monkeypatch.setattr(bt, "llm_client", bt.StubLLM(f"400,{FALLBACK}=20"))
+    monkeypatch.setattr(bt, "route_stats", bt.RouteStats())
+    monkeypatch.setitem(bt.LLM_ROUTES, "llm_answer", {**bt.LLM_ROUTES["llm_answer"], "slo": 0.1})
+    return bt.route_stats
+
+
+def _attempts(outcome, model):
+    h = bt.LLM_ATTEMPT_LATENCY.hist.get(("llm_answer", model, outcome))
+    return h[2] if h else 0
+
+
+def test_fallback_wins_after_the_slo(stub):
+    lost_before = _attempts("lost", PRIMARY)
+    t0 = time.perf_counter()
+    answer = bt.llm_answer("PCR", "beginner", "What is annealing?")
+    elapsed = time.perf_counter() - t0
+    assert answer.startswith("Stub answer for:")
+    assert 0.1 <= elapsed < 0.4   # answered by the hedge, not by waiting for the primary
+    report = stub.report()["llm_answer"]
+    assert report["calls"] == 1 and report["hedged"] == 1 and report["wins"] == {FALLBACK: 1}
+    # The primary still finishes; its answer is counted as lost and its usage is still billed
+    deadline = time.monotonic() + 2
+    while _attempts("lost", PRIMARY) == lost_before and time.monotonic() < deadline: time.sleep(0.02)
+    assert _attempts("lost", PRIMARY) == lost_before + 1
+    assert stub.attempts["llm_answer"] == 2
+
+
+def test_primary_within_the_slo_is_not_hedged(stub, monkeypatch):
+    monkeypatch.setattr(bt, "llm_client", bt.StubLLM(f"10,{FALLBACK}=10"))
+    bt.llm_answer("PCR", "beginner", "What is annealing?")
+    report = stub.report()["llm_answer"]
+    assert report["hedged"] == 0 and report["wins"] == {PRIMARY: 1} and stub.attempts["llm_answer"] == 1
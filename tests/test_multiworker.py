@@ -0,0 +1,72 @@
+import os, json, signal, socket, subprocess, sys, time, urllib.error, urllib.request
+
+import pytest
+
+import biotechpro1 as bt
+
+
+def _serve(db_url, tmp_path):
+    # One `serve` process; two of them on one database stand in for two workers
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0)); port = s.getsockname()[1]
+    env = {**os.environ, "DATABASE_URL": db_url, "BIOMIND_PORT": str(port), "BIOMIND_HOST": "127.0.0.1", "BIOMIND_WORKERS": "1",
+           "BIOMIND_LLM_STUB_MS": "0", "BIOMIND_TRACE_SAMPLE": "0", "BIOMIND_LOG_LEVEL": "warning"}
+    proc = subprocess.Popen([sys.executable, bt.__file__, "serve"], cwd=tmp_path, env=env, stdout=subprocess.DEVNULL)
+    base = f"http://127.0.0.1:{port}"
+    for _ in range(200):
+        try: urllib.request.urlopen(base + "/readyz", timeout=1).close(); return proc, base
+        except Exception: time.sleep(0.1)
+    proc.kill(); pytest.fail("server did not become ready")
+
+
+@pytest.fixture
+def workers(fresh_db, make_user, tmp_path):
+    bt.init_schema()   # before either worker starts, as run_server does
+    me = make_user("ada@example.com")
+    procs, bases = [], []
+    try:
+        for _ in range(2):
+            proc, base = _serve(bt.DATABASE_URL, tmp_path); procs.append(proc); bases.append(base)
+        yield me, bases
+    finally:
+        for p in procs:
+            p.send_signal(signal.SIGTERM)
+            try: p.wait(bt.DRAIN_SECS + 10)
+            except subprocess.TimeoutExpired: p.kill()
+
+
+def _post(base, path, body, headers):
+    req = urllib.request.Request(base + path, data=json.dumps(body).encode(), headers={**headers, "Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(req, timeout=10) as r: return r.status, json.load(r)
+    except urllib.error.HTTPError as e: return e.code, json.load(e)
+
+
+def test_quiz_and_lab_continue_on_another_worker(workers):
+    me, (a, b) = workers
+    q1 = _post(a, "/quiz/generate", {"topic": "PCR", "question_type": "mcq"}, me)[1]
+    q2 = _post(b, "/quiz/generate", {"topic": "PCR", "question_type": "mcq"}, me)[1]
+    # Ids come from the shared table, so two workers never hand out the same one
+    assert q1["question_id"] != q2["question_id"]
+    for q, other in ((q1, b), (q2, a)):
+        status, body = _post(other, "/quiz/submit", {"question_id": q["question_id"], "student_answer": "0"}, me)
+        assert status == 200 and "is_correct" in body
+    # A question is graded once, wherever the repeat lands
+    assert _post(a, "/quiz/submit", {"question_id": q1["question_id"], "student_answer": "0"}, me)[0] == 404
+
+    sid = _post(a, "/lab/start", {"lab_type": "pcr"}, me)[1]["session_id"]
+    status, body = _post(b, "/lab/decide", {"session_id": sid, "choice": "A"}, me)
+    assert status == 200 and "completed" in body
+    db = bt.SessionLocal()
+    try:
+        assert len(db.query(bt.LabLog).filter(bt.LabLog.session_id == sid).one().decision_chain) == 1
+    finally:
+        db.close()
+
+
+def test_submit_rejects_another_students_question(client, make_user, monkeypatch):
+    monkeypatch.setattr(bt, "llm_client", bt.StubLLM("0"))
+    ada, bob = make_user("ada@example.com"), make_user("bob@example.com")
+    qid = client.post("/quiz/generate", json={"topic": "PCR", "question_type": "mcq"}, headers=ada).json()["question_id"]
+    assert client.post("/quiz/submit", json={"question_id": qid, "student_answer": "0"}, headers=bob).status_code == 404
+    assert client.post("/quiz/submit", json={"question_id": qid, "student_answer": "0"}, headers=ada).status_code == 200
@@ -0,0 +1,22 @@
+from datetime import datetime, timedelta
+
+import biotechpro1 as bt
+
+
+def test_due_queue_announces_each_due_row_once(fresh_db):
+    bt.init_schema(); db = bt.SessionLocal()
+    try:
+        u = bt.User(name="Ada", email="ada@example.com", hashed_pw="x"); db.add(u); db.commit()
+        now = datetime(2026, 1, 1, 12)
+        for topic, due in (("PCR", now - timedelta(days=1)), ("CRISPR", now + timedelta(minutes=10))):
+            db.add(bt.ReviewSchedule(user_id=u.id, topic=topic, due_at=due))
+        db.commit()
+        q = bt.DueQueue()
+        q.notify(q.pop_due(db, now))
+        assert q.take(u.id) == ["PCR"] and q.take(u.id) == []
+        # Rows written by any worker are seen on the next poll; nothing is announced twice
+        assert q.pop_due(db, now + timedelta(minutes=5)) == {}
+        q.notify(q.pop_due(db, now + timedelta(minutes=15)))
+        assert q.take(u.id) == ["CRISPR"]
+    finally:
+        db.close()
@@ -0,0 +1,25 @@
+import biotechpro1 as bt
+
+ROSTER = "name,email\nAda Lovelace,ada@uni-a.edu\nAlan Turing,alan@uni-a.edu\n"
+
+
+def _post(client, headers):
+    return client.post("/auth/roster", content=ROSTER, headers={**headers, "Content-Type": "text/csv"})
+
+
+def test_roster_import_requires_admin(client, make_user):
+    assert _post(client, make_user("student@uni-a.edu", institution="Uni A")).status_code == 403
+
+
+def test_roster_import_is_quota_limited_per_caller(client, make_user, monkeypatch):
+    monkeypatch.setattr(bt, "ADMIN_EMAILS", {"prof@uni-a.edu", "dean@uni-a.edu"})
+    monkeypatch.setattr(bt, "HASH_WORKERS", 1)
+    monkeypatch.setattr(bt, "ROSTER_HASHES_PER_HOUR", 3)
+    monkeypatch.setattr(bt, "_roster_usage", {})
+    prof = make_user("prof@uni-a.edu", institution="Uni A")
+    r = _post(client, prof)
+    assert r.status_code == 200 and r.json()["created"] == 2
+    r = _post(client, prof)
+    assert r.status_code == 429 and int(r.headers["Retry-After"]) > 0
+    # The quota is per caller; a second admin is unaffected
+    assert _post(client, make_user("dean@uni-a.edu", institution="Uni A")).status_code == 200
@@ -0,0 +1,66 @@
+import pytest
+
+import biotechpro1 as bt
+
+
+@pytest.fixture
+def fake_llm(monkeypatch):
+    calls = []
+    def llm_answer(topic, difficulty, question, context=""):
+        calls.append(context)
+        return f"answer {len(calls)} for {question}"
+    monkeypatch.setattr(bt, "llm_answer", llm_answer)
+    monkeypatch.setattr(bt, "answer_cache", bt.SemanticCache())
+    return calls
+
+
+def test_context_free_questions_share_the_cache(fake_llm):
+    first = bt.tutor_answer("PCR", "beginner", "What does Taq polymerase do in PCR?")
+    again = bt.tutor_answer("pcr ", "beginner", "What does Taq polymerase do in PCR?")
+    assert again == first and fake_llm == [""]
+
+
+def test_follow_ups_with_context_bypass_the_cache(fake_llm):
+    q = "Why is that?"
+    mine = bt.tutor_answer("PCR", "beginner", q, "Student [PCR]: my gel shows smears")
+    theirs = bt.tutor_answer("PCR", "beginner", q, "Student [PCR]: I study plant genomics")
+    assert mine != theirs
+    assert fake_llm == ["Student [PCR]: my gel shows smears", "Student [PCR]: I study plant genomics"]
+    # Private answers are never inserted, so nothing is shared
+    assert bt.answer_cache.lookup(("pcr", "beginner"), bt.embed(q)) is None
+
+
+def test_standalone_questions_share_the_cache_despite_context(fake_llm):
+    q = "What does Taq polymerase do in PCR?"
+    mine = bt.tutor_answer("PCR", "beginner", q, "Student [PCR]: my gel shows smears")
+    theirs = bt.tutor_answer("PCR", "beginner", q, "Student [PCR]: I study plant genomics")
+    # Answered once from the context-free prompt; the conversation never reaches it
+    assert mine == theirs and fake_llm == [""]
+
+
+def test_chip_after_a_lesson_hits_the_cache(client, make_user, fake_llm, monkeypatch):
+    monkeypatch.setattr(bt, "llm_lesson", lambda *a: {"content": "PCR amplifies DNA.", "summary": "", "real_example": ""})
+    answers = []
+    for email in ("ada@example.com", "alan@example.com"):
+        me = make_user(email)
+        client.post("/learn/generate-lesson", json={"topic": "PCR", "difficulty": "beginner"}, headers=me)
+        r = client.post("/learn/generate-lesson", json={"topic": "PCR", "difficulty": "beginner", "query": "Common mistakes?"}, headers=me)
+        answers.append(r.json()["content"])
+    assert answers[0] == answers[1] and fake_llm == [""]
+
+
+def test_embedding_damps_both_hash_signs_equally(monkeypatch):
+    # Four features, two per sign: a bucket hit k times weighs sqrt(k) whichever sign it has
+    buckets = {"a": 0x80000000 | 0, "b": 1, "c": 0x80000000 | 2, "d": 3}
+    monkeypatch.setattr(bt, "_features", lambda text: iter(text.split()))
+    monkeypatch.setattr(bt.zlib, "crc32", lambda f: buckets[f.decode()])
+    v = bt.embed(" ".join(["a"] * 4 + ["b"] * 4 + ["c"] * 9 + ["d"] * 9), dim=4)
+    assert [round(float(x / v[0]), 6) for x in v] == [1.0, -1.0, 1.5, -1.5]
+
+
+def test_near_duplicate_questions_clear_the_threshold_and_others_do_not():
+    sim = lambda a, b: float(bt.embed(a) @ bt.embed(b))
+    q = "What does Taq polymerase do in PCR?"
+    assert sim(q, "what does taq polymerase do in pcr") > bt.SEMANTIC_THRESHOLD
+    assert sim(q, "What does the Taq polymerase do in a PCR?") > sim(q, "Why do primers need a melting temperature?")
+    assert sim(q, "Why do primers need a melting temperature?") < bt.SEMANTIC_THRESHOLD
@@ -0,0 +1,29 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+import biotechpro1 as bt
+
+
+def _row():
+    return SimpleNamespace(easiness=bt.REVIEW_EASE_INIT, interval_days=0.0, repetitions=0, due_at=None, last_reviewed_at=None)
+
+
+def test_sm2_intervals_grow_1_6_then_by_easiness():
+    row = _row(); now = datetime(2026, 1, 1)
+    bt.sm2(row, True, now); assert row.interval_days == 1.0 and row.due_at == now + timedelta(days=1)
+    now = row.due_at; bt.sm2(row, True, now); assert row.interval_days == 6.0
+    now = row.due_at; ease = row.easiness; bt.sm2(row, True, now)
+    assert row.repetitions == 3 and row.interval_days == pytest.approx(6.0 * ease)
+
+
+def test_sm2_early_review_does_not_extend_and_a_miss_relearns():
+    row = _row(); now = datetime(2026, 1, 1)
+    bt.sm2(row, True, now); due = row.due_at
+    bt.sm2(row, True, now + timedelta(hours=1))
+    assert row.due_at == due and row.repetitions == 1
+    bt.sm2(row, False, now + timedelta(hours=2))
+    assert row.repetitions == 0 and row.interval_days == bt.REVIEW_RELEARN_MINUTES / 1440
+    for _ in range(20): bt.sm2(row, False, now)
+    assert row.easiness == bt.REVIEW_EASE_MIN
@@ -0,0 +1,18 @@
+import biotechpro1 as bt
+
+
+def test_dashboard_serves_tips_a_job_stored_elsewhere(client, make_user, monkeypatch):
+    me = make_user("ada@example.com")
+    db = bt.SessionLocal()
+    try:
+        uid = db.query(bt.User.id).filter(bt.User.email == "ada@example.com").scalar()
+        db.add(bt.TopicMastery(user_id=uid, topic_name="PCR", attempts=4, correct=1, accuracy=0.25, p_known=0.2)); db.commit()
+        monkeypatch.setattr(bt, "llm_tips", lambda weak, level: [f"Revise {t}" for t in weak])
+        bt.JOB_HANDLERS["analytics_refresh"](db, {"user_id": uid})   # as any worker's job pool would
+    finally:
+        db.close()
+    # The snapshot lives in the database, so no worker needs the LLM on the request path
+    def no_llm(*a): raise AssertionError("llm_tips called on the request path")
+    monkeypatch.setattr(bt, "llm_tips", no_llm)
+    r = client.get("/analytics/dashboard", headers=me)
+    assert r.status_code == 200 and r.json()["improvement_tips"] == ["Revise PCR"]